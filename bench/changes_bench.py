@@ -0,0 +1,194 @@
+r"""
+Charge de la base avec des centaines de tableaux de bord ouverts : abonnés au
+flux /api/changes (mode sse) ou rechargements périodiques de la page (mode
+poll), pendant qu'un client modifie des études à débit fixe.
+
+    DB_HOST=... DB_USER=... DB_PASSWORD=... DB_NAME=bench \
+        python bench/changes_bench.py --url http://localhost:5000 --mode sse --clients 500 \
+        --writes-per-sec 5 --duration 60 --output results/changes_sse.json
+    ... --mode poll --interval 10 --output results/changes_poll.json
+
+La charge de la base est mesurée par les compteurs globaux de MariaDB
+(Questions, Com_select) avant et après l'essai ; l'écrivain les incrémente
+de la même façon dans les deux modes. En mode sse, le délai de livraison est
+mesuré du début de chaque écriture à la réception de l'événement. Le serveur
+doit pouvoir tenir `--clients` connexions ouvertes (WEB_WORKER_CLASS=gevent,
+CHANGES_MAX_SUBSCRIBERS suffisant).
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import datagen
+from load import Client, percentile
+
+WRITER = 'bench-writer'
+
+
+def global_status(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Questions', 'Com_select')")
+        return {row['Variable_name']: int(row['Value']) for row in cursor.fetchall()}
+
+
+def subscriber(args, cookie, stop, stats, lock):
+    """Lit le flux jusqu'à l'arrêt ; reconnecte avec Last-Event-ID comme un navigateur."""
+    parts = urlsplit(args.url)
+    last_id, delays, events, connects = None, [], 0, 0
+    while not stop.is_set():
+        conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=args.duration + 30)
+        headers = {'Cookie': cookie, 'Accept': 'text/event-stream'}
+        if last_id:
+            headers['Last-Event-ID'] = last_id
+        try:
+            conn.request('GET', '/api/changes?tables=studies', headers=headers)
+            response = conn.getresponse()
+            connects += 1
+            if response.status != 200:
+                with lock:
+                    stats['refused'] += 1
+                stop.wait(1)
+                continue
+            while not stop.is_set():
+                line = response.readline()
+                if not line:
+                    break
+                line = line.decode().rstrip('\n')
+                if line.startswith('id: '):
+                    last_id = line[4:]
+                elif line.startswith('data: ') and '"bench ' in line:
+                    row = json.loads(line[6:])['row']
+                    if row:
+                        delays.append((time.time() - float(row['study_description'].split()[1])) * 1000)
+                    events += 1
+        except (http.client.HTTPException, OSError):
+            stop.wait(1)
+        finally:
+            conn.close()
+    with lock:
+        stats['events'] += events
+        stats['connects'] += connects
+        stats['delays'].extend(delays)
+
+
+def poller(args, cookie, stop, stats, lock, rng):
+    """Recharge le tableau de bord toutes les `interval` secondes, avec If-None-Match comme un navigateur."""
+    client = Client(args.url)
+    client.cookie = cookie
+    etag, counts = None, {}
+    stop.wait(rng.uniform(0, args.interval))
+    while not stop.is_set():
+        headers = {'If-None-Match': etag} if etag else {}
+        try:
+            response = client.request('GET', '/', headers=headers)
+            counts[response.status] = counts.get(response.status, 0) + 1
+            etag = response.getheader('ETag') or etag
+        except (http.client.HTTPException, OSError):
+            counts['error'] = counts.get('error', 0) + 1
+        stop.wait(args.interval)
+    with lock:
+        for status, n in counts.items():
+            stats['responses'][str(status)] = stats['responses'].get(str(status), 0) + n
+
+
+def writer(args, stop, stats, max_study_id, rng):
+    """Modifie une étude au hasard `writes_per_sec` fois par seconde ; la description porte l'heure d'écriture."""
+    client = Client(args.url)
+    client.login(WRITER, args.writer_password)
+    period = 1 / args.writes_per_sec
+    next_at = time.monotonic()
+    while not stop.is_set():
+        body = json.dumps({'study_description': f"bench {time.time():.6f}"})
+        response = client.request('PUT', f"/api/studies/{rng.randint(1, max_study_id)}", body,
+                                  {'Content-Type': 'application/json'})
+        stats['writes'] += response.status == 200
+        next_at += period
+        stop.wait(max(0, next_at - time.monotonic()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--writer-password', default='bench')
+    parser.add_argument('--mode', choices=('sse', 'poll'), default='sse')
+    parser.add_argument('--clients', type=int, default=300)
+    parser.add_argument('--interval', type=float, default=10, help="mode poll : secondes entre deux rechargements")
+    parser.add_argument('--writes-per-sec', type=float, default=5)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    args = parser.parse_args()
+
+    db = datagen.connect(autocommit=True)
+    datagen.ensure_user(db, WRITER, args.writer_password, role='modification')
+    with db.cursor() as cursor:
+        cursor.execute("SELECT MAX(id) AS max_id FROM studies")
+        max_study_id = cursor.fetchone()['max_id'] or 1
+
+    login = Client(args.url)
+    login.login(args.username, args.password)
+    rng = random.Random(args.seed)
+    stop, lock = threading.Event(), threading.Lock()
+    stats = {'events': 0, 'connects': 0, 'refused': 0, 'delays': [], 'responses': {}, 'writes': 0}
+    if args.mode == 'sse':
+        clients = [threading.Thread(target=subscriber, args=(args, login.cookie, stop, stats, lock), daemon=True)
+                   for _ in range(args.clients)]
+    else:
+        clients = [threading.Thread(target=poller, args=(args, login.cookie, stop, stats, lock,
+                                                         random.Random(rng.random())), daemon=True)
+                   for _ in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    # Connexions établies avant la mesure
+    time.sleep(min(5, args.duration / 4))
+
+    before = global_status(db)
+    started = time.monotonic()
+    write_thread = threading.Thread(target=writer, args=(args, stop, stats, max_study_id, random.Random(args.seed)))
+    write_thread.start()
+    time.sleep(args.duration)
+    after = global_status(db)
+    elapsed = time.monotonic() - started
+    stop.set()
+    write_thread.join()
+    for thread in clients:
+        thread.join(timeout=5)
+
+    delays = sorted(stats['delays'])
+    result = {
+        'mode': args.mode,
+        'clients': args.clients,
+        'interval_s': args.interval if args.mode == 'poll' else None,
+        'duration_s': round(elapsed, 1),
+        'writes': stats['writes'],
+        'db_questions_per_sec': round((after['Questions'] - before['Questions']) / elapsed, 1),
+        'db_selects_per_sec': round((after['Com_select'] - before['Com_select']) / elapsed, 1),
+        'events_received': stats['events'],
+        'connects': stats['connects'],
+        'refused': stats['refused'],
+        'delivery_ms': {'p50': percentile(delays, 50), 'p99': percentile(delays, 99)} if delays else None,
+        'responses': stats['responses'] or None,
+    }
+    print(f"{args.mode} x{args.clients} : {result['db_questions_per_sec']} requêtes SQL/s "
+          f"({result['db_selects_per_sec']} SELECT/s), {result['writes']} écritures")
+    if delays:
+        print(f"Livraison : p50 {result['delivery_ms']['p50']:.0f} ms, p99 {result['delivery_ms']['p99']:.0f} ms, "
+              f"{result['events_received']} événements, {result['refused']} refus")
+    if stats['responses']:
+        print(f"Réponses : {stats['responses']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare deux fichiers de résultats de bench/load.py et signale les régressions.
+
+    python bench/compare.py results/base.json results/new.json --threshold 10
+
+Code de sortie 1 si une latence (p50/p95/p99) ou les requêtes SQL par requête
+augmentent, ou si le débit baisse, de plus de `--threshold` pour cent.
+"""
+import argparse
+import json
+import sys
+
+# (métrique, chemin dans le résultat, une hausse est-elle une régression ?)
+METRICS = [
+    ('p50', ('latency_ms', 'p50'), True),
+    ('p95', ('latency_ms', 'p95'), True),
+    ('p99', ('latency_ms', 'p99'), True),
+    ('req/s', ('throughput_rps',), False),
+    ('sql/req', ('queries_per_request',), True),
+]
+
+
+def _get(result, path):
+    for key in path:
+        result = result.get(key) if result else None
+    return result
+
+
+def compare(base, new, threshold):
+    base_index = {(r['scenario'], r['concurrency']): r for r in base['results']}
+    regressions = []
+    rows = []
+    for result in new['results']:
+        key = (result['scenario'], result['concurrency'])
+        previous = base_index.get(key)
+        if previous is None:
+            continue
+        for name, path, higher_is_worse in METRICS:
+            old, cur = _get(previous, path), _get(result, path)
+            if old is None or cur is None:
+                continue
+            delta = ((cur - old) / old * 100) if old else (0.0 if cur == old else float('inf'))
+            worse = delta > threshold if higher_is_worse else delta < -threshold
+            rows.append((key, name, old, cur, delta, worse))
+            if worse:
+                regressions.append((key, name, old, cur, delta))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help="tolérance en pourcentage")
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    rows, regressions = compare(base, new, args.threshold)
+    for (scenario, concurrency), name, old, cur, delta, worse in rows:
+        flag = 'RÉGRESSION' if worse else ''
+        print(f"{scenario:20} c={concurrency:<4} {name:8} {old:>10} -> {cur:>10} ({delta:+.1f}%) {flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} régression(s) au-delà de {args.threshold}%.")
+        sys.exit(1)
+    print("\nAucune régression.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Générateur de données synthétiques (patients et études) pour les benchmarks.
+
+Les noms suivent une distribution de Zipf sur des listes de noms et prénoms
+français courants, accents compris, pour que les index et la recherche soient
+sollicités comme sur une base réelle.
+"""
+import os
+import random
+from datetime import date, datetime, timedelta
+
+import pymysql
+
+LASTNAMES = [
+    'Martin', 'Bernard', 'Thomas', 'Petit', 'Robert', 'Richard', 'Durand', 'Dubois', 'Moreau', 'Laurent',
+    'Simon', 'Michel', 'Lefèbvre', 'Leroy', 'Roux', 'David', 'Bertrand', 'Morel', 'Fournier', 'Girard',
+    'Bonnet', 'Dupont', 'Lambert', 'Fontaine', 'Rousseau', 'Vincent', 'Muller', 'Lefèvre', 'Faure', 'André',
+    'Mercier', 'Blanc', 'Guérin', 'Boyer', 'Garnier', 'Chevalier', 'François', 'Legrand', 'Gauthier', 'Garcia',
+    'Perrin', 'Robin', 'Clément', 'Morin', 'Nicolas', 'Henry', 'Roussel', 'Mathieu', 'Gautier', 'Masson',
+    'Marchand', 'Duval', 'Denis', 'Dumont', 'Marie', 'Lemaire', 'Noël', 'Meyer', 'Dufour', 'Meunier',
+    'Brun', 'Blanchard', 'Giraud', 'Joly', 'Rivière', 'Lucas', 'Brunet', 'Gaillard', 'Barbier', 'Arnaud',
+    'Martínez', 'Gérard', 'Roche', 'Renard', 'Schmitt', 'Roy', 'Leroux', 'Colin', 'Vidal', 'Caron',
+    'Picard', 'Roger', 'Fabre', 'Aubert', 'Lemoine', 'Renaud', 'Dumas', 'Lacroix', 'Olivier', 'Philippe',
+    'Bourgeois', 'Pierre', 'Benoît', 'Rey', 'Leclerc', 'Payet', 'Rolland', 'Leclercq', 'Guillaume', 'Lecomte',
+]
+FIRSTNAMES_M = [
+    'Jean', 'Pierre', 'Michel', 'André', 'Philippe', 'Louis', 'Nicolas', 'François', 'Jacques', 'Daniel',
+    'Alain', 'Bernard', 'Éric', 'Christophe', 'Patrick', 'Frédéric', 'Stéphane', 'Laurent', 'Julien', 'Sébastien',
+    'Hugo', 'Lucas', 'Léo', 'Gabriel', 'Raphaël', 'Jérôme', 'Benoît', 'Noé', 'Théo', 'Loïc',
+]
+FIRSTNAMES_F = [
+    'Marie', 'Nathalie', 'Isabelle', 'Sylvie', 'Catherine', 'Françoise', 'Monique', 'Christine', 'Valérie', 'Sandrine',
+    'Hélène', 'Céline', 'Émilie', 'Chloé', 'Léa', 'Manon', 'Camille', 'Inès', 'Zoé', 'Anaïs',
+    'Élodie', 'Mélanie', 'Aurélie', 'Cécile', 'Geneviève', 'Agnès', 'Béatrice', 'Gaëlle', 'Maëlle', 'Noémie',
+]
+# Modalités DICOM avec leur fréquence relative et des descriptions typiques
+MODALITIES = {
+    'RX': (40, ['Radio du thorax', 'Radio du genou', 'Radio du poignet', 'Radio du bassin', 'Radio du rachis lombaire']),
+    'CT': (20, ['Scanner cérébral', 'Scanner thoraco-abdominal', 'Scanner des sinus', 'Angioscanner pulmonaire']),
+    'IRM': (15, ['IRM du genou', 'IRM cérébrale', 'IRM de l\'épaule', 'IRM du rachis cervical', 'Examen du genou']),
+    'US': (15, ['Échographie abdominale', 'Échographie thyroïdienne', 'Échographie pelvienne', 'Doppler veineux']),
+    'MG': (7, ['Mammographie de dépistage', 'Mammographie bilatérale']),
+    'PT': (3, ['TEP-scanner corps entier', 'TEP cérébrale']),
+}
+
+
+def _zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+
+class Generator:
+    """Tirages reproductibles (graine fixe) de patients et d'études."""
+
+    def __init__(self, seed=42):
+        self.rng = random.Random(seed)
+        self._lastname_weights = _zipf_weights(len(LASTNAMES))
+        self._modalities = list(MODALITIES)
+        self._modality_weights = [MODALITIES[m][0] for m in self._modalities]
+
+    def patient(self):
+        gender = self.rng.choices(['M', 'F', 'O'], weights=[49, 49, 2])[0]
+        firstnames = FIRSTNAMES_F if gender == 'F' else FIRSTNAMES_M
+        birthdate = date(1930, 1, 1) + timedelta(days=self.rng.randrange(0, 365 * 93))
+        return (
+            self.rng.choices(LASTNAMES, weights=self._lastname_weights)[0],
+            self.rng.choice(firstnames),
+            birthdate,
+            gender,
+        )
+
+    def study(self, patient_id, years=10):
+        modality = self.rng.choices(self._modalities, weights=self._modality_weights)[0]
+        study_date = datetime.now() - timedelta(seconds=self.rng.randrange(0, 365 * 24 * 3600 * years))
+        return (patient_id, study_date.replace(microsecond=0), self.rng.choice(MODALITIES[modality][1]), modality)
+
+
+def connect(**overrides):
+    """Connexion à partir des mêmes variables d'environnement que l'application."""
+    params = dict(
+        host=os.environ.get('DB_HOST', '127.0.0.1'),
+        port=int(os.environ.get('DB_PORT', 3306)),
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASSWORD'),
+        database=os.environ.get('DB_NAME'),
+        cursorclass=pymysql.cursors.DictCursor,
+        autocommit=False,
+    )
+    params.update(overrides)
+    return pymysql.connect(**params)
+
+
+def seed(conn, patients, studies, batch_size=5000, seed=42, log=print):
+    """
+    Insère `patients` patients puis `studies` études réparties entre eux,
+    par lots multi-lignes validés un par un.
+    """
+    gen = Generator(seed)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) AS max_id FROM patients")
+        first_id = cursor.fetchone()['max_id'] + 1
+
+        for start in range(0, patients, batch_size):
+            rows = [gen.patient() for _ in range(min(batch_size, patients - start))]
+            cursor.executemany(
+                "INSERT INTO patients (lastname, firstname, birthdate, gender) VALUES (%s, %s, %s, %s)", rows)
+            conn.commit()
+            log(f"patients: {start + len(rows)}/{patients}")
+
+        for start in range(0, studies, batch_size):
+            rows = [gen.study(first_id + gen.rng.randrange(patients))
+                    for _ in range(min(batch_size, studies - start))]
+            cursor.executemany(
+                "INSERT INTO studies (patient_id, study_date, study_description, modality) VALUES (%s, %s, %s, %s)",
+                rows)
+            conn.commit()
+            log(f"studies: {start + len(rows)}/{studies}")
+
+
+def reset(conn):
+    """Vide les tables de données (les utilisateurs et rôles sont conservés)."""
+    with conn.cursor() as cursor:
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+        cursor.execute("TRUNCATE TABLE studies")
+        cursor.execute("TRUNCATE TABLE patients")
+        cursor.execute("SET FOREIGN_KEY_CHECKS = 1")
+    conn.commit()
+
+
+def ensure_user(conn, username, password, role='lecture'):
+    """Crée (ou réinitialise) le compte utilisé par le générateur de charge."""
+    from werkzeug.security import generate_password_hash
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM roles WHERE name = %s", (role,))
+        role_id = cursor.fetchone()['id']
+        cursor.execute(
+            "INSERT INTO users (username, password_hash, role_id) VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE password_hash = VALUES(password_hash), role_id = VALUES(role_id), is_active = TRUE",
+            (username, generate_password_hash(password), role_id))
+    conn.commit()
@@ -0,0 +1,126 @@
+r"""
+Microbenchmark de la sérialisation JSON et de la compression des réponses,
+sans base de données : lignes d'études synthétiques (datagen) telles que les
+renvoient /api/studies, /api/search ou le tableau de bord.
+
+    python bench/json_bench.py --rows 10000 --repeat 5 --output bench/results/json.json
+
+Compare le fournisseur JSON de Flask à celui d'orjson (jsonify et sérialisation
+ligne à ligne des flux), puis la taille sur le réseau et le coût de chaque
+encodage disponible (gzip ; br et zstd si brotli / zstandard sont installés),
+en corps complet et en flux vidé tous les `--chunk-size` lignes.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask'))
+
+import datagen  # noqa: E402
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+import compression  # noqa: E402
+import json_provider  # noqa: E402
+
+
+def make_rows(n, seed):
+    gen = datagen.Generator(seed)
+    rows = []
+    for study_id in range(1, n + 1):
+        lastname, firstname, birthdate, gender = gen.patient()
+        patient_id, study_date, description, modality = gen.study(study_id // 3 + 1)
+        rows.append({
+            'patient_id': patient_id, 'lastname': lastname, 'firstname': firstname, 'birthdate': birthdate,
+            'gender': gender, 'study_id': study_id, 'study_date': study_date, 'study_description': description,
+            'modality': modality, 'version': 1, 'updated_at': study_date,
+            # Valeur de type DECIMAL, comme un agrégat SUM(...) de MariaDB
+            'score': Decimal('1.25'),
+        })
+    return rows
+
+
+def timed(fn, repeat):
+    """Médiane en millisecondes de `repeat` exécutions, et le dernier résultat."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(durations), 2), result
+
+
+def bench_providers(app, rows, repeat, chunk_size):
+    providers = {'default': DefaultJSONProvider(app)}
+    if json_provider.orjson is not None:
+        providers['orjson'] = json_provider.OrjsonProvider(app)
+    results = {}
+    with app.app_context():
+        for name, provider in providers.items():
+            response_ms, response = timed(lambda: provider.response(rows), repeat)
+            stream_ms, _ = timed(lambda: ''.join(
+                ','.join(provider.dumps(row) for row in rows[i:i + chunk_size])
+                for i in range(0, len(rows), chunk_size)), repeat)
+            results[name] = {'jsonify_ms': response_ms, 'stream_dumps_ms': stream_ms,
+                             'bytes': len(response.get_data())}
+    return results, response.get_data()
+
+
+def bench_encodings(payload, repeat, chunk_size):
+    results = {'identity': {'bytes': len(payload), 'compress_ms': 0.0}}
+    # Morceaux de `chunk_size` lignes, comme ceux d'un flux json_stream
+    chunks = payload.split(b'},{')
+    step = max(1, chunk_size)
+    stream_chunks = [b'},{'.join(chunks[i:i + step]) for i in range(0, len(chunks), step)]
+    for name in compression.available_encodings(list(compression.ENCODINGS)):
+        factory = compression.ENCODINGS[name]
+
+        def whole():
+            compressor = factory()
+            return compressor.compress(payload) + compressor.finish()
+
+        def streamed():
+            return b''.join(compression.compress_stream(stream_chunks, factory()))
+
+        whole_ms, body = timed(whole, repeat)
+        stream_ms, stream_body = timed(streamed, repeat)
+        results[name] = {'bytes': len(body), 'ratio': round(len(payload) / len(body), 2), 'compress_ms': whole_ms,
+                         'stream_bytes': len(stream_body), 'stream_compress_ms': stream_ms}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--chunk-size', type=int, default=500, help="lignes par morceau de flux (STREAM_CHUNK_SIZE)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    rows = make_rows(args.rows, args.seed)
+    providers, payload = bench_providers(app, rows, args.repeat, args.chunk_size)
+    encodings = bench_encodings(payload, args.repeat, args.chunk_size)
+
+    print(f"Sérialisation de {args.rows} lignes (médiane sur {args.repeat}) :")
+    for name, result in providers.items():
+        print(f"  {name:8} jsonify {result['jsonify_ms']:>9} ms   flux {result['stream_dumps_ms']:>9} ms   "
+              f"{result['bytes']} octets")
+    print("Compression :")
+    for name, result in encodings.items():
+        extra = (f"  x{result['ratio']}  {result['compress_ms']} ms  (flux : {result['stream_bytes']} octets, "
+                 f"{result['stream_compress_ms']} ms)") if name != 'identity' else ''
+        print(f"  {name:8} {result['bytes']:>10} octets{extra}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'rows': args.rows, 'providers': providers, 'encodings': encodings}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
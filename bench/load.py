@@ -0,0 +1,308 @@
+r"""
+Générateur de charge : interroge les vrais endpoints à concurrence fixe et
+enregistre latences (p50/p95/p99), débit et requêtes SQL par requête HTTP
+(en-tête X-Query-Count) dans un fichier JSON.
+
+    python bench/load.py --url http://localhost:5000 --concurrency 1,8,32 \
+        --duration 20 --output results/base.json --tag workers=4
+
+Chaque scénario tourne `--duration` secondes par niveau de concurrence, en
+boucle fermée (chaque client enchaîne ses requêtes). Pour mesurer la montée
+en charge avec le nombre de workers Gunicorn, relancer le serveur avec
+WEB_WORKERS=1, 2, 4... et comparer les fichiers avec bench/compare.py.
+
+`--background api_search=64` ajoute pendant chaque mesure une charge abusive
+(64 clients sans pause sur le scénario donné) : la latence des endpoints peu
+coûteux doit rester stable, les requêtes abusives étant limitées (429) ou
+délestées (503) par le contrôle d'admission.
+
+    python bench/load.py --scenarios health,api_patient --concurrency 4 \
+        --background api_search=64 --output results/abuse.json
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode, urlsplit
+
+import datagen
+from datagen import FIRSTNAMES_F, FIRSTNAMES_M, LASTNAMES, MODALITIES
+
+SEARCH_TERMS = LASTNAMES[:30] + FIRSTNAMES_F[:10] + FIRSTNAMES_M[:10] + list(MODALITIES) + ['genou', 'thorax']
+
+
+class Client:
+    """Connexion HTTP persistante (keep-alive) avec le cookie de session Flask-Login ou un jeton d'API."""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        self.cookie = None
+        self.token = None
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        try:
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Connexion fermée par le serveur (recyclage de worker...) : on rouvre une fois
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            self.conn.request(method, path, body=body, headers=headers)
+            response = self.conn.getresponse()
+        response.read()
+        return response
+
+    def login(self, username, password):
+        body = urlencode({'username': username, 'password': password})
+        response = self.request('POST', '/login', body,
+                                {'Content-Type': 'application/x-www-form-urlencoded'})
+        cookie = response.getheader('Set-Cookie')
+        if response.status != 302 or not cookie:
+            raise SystemExit(f"Échec de la connexion de {username!r} (HTTP {response.status}).")
+        self.cookie = cookie.split(';', 1)[0]
+        return response
+
+
+# Chaque scénario renvoie (méthode, chemin, corps, en-têtes) pour une itération
+def _get(path):
+    return 'GET', path, None, None
+
+
+SCENARIOS = {
+    'health': lambda rng, ctx: _get('/health'),
+    'api_patients': lambda rng, ctx: _get(f"/api/patients?page={rng.randint(1, 50)}"),
+    'api_patients_cursor': lambda rng, ctx: _get("/api/patients?cursor=&per_page=50"),
+    'api_patient': lambda rng, ctx: _get(f"/api/patients/{rng.randint(1, ctx['max_patient_id'])}"),
+    'api_search': lambda rng, ctx: _get('/api/search?' + urlencode({'q': rng.choice(SEARCH_TERMS)})),
+    'dashboard': lambda rng, ctx: _get('/'),
+    'patient_detail': lambda rng, ctx: _get(f"/patient/{rng.randint(1, ctx['max_patient_id'])}"),
+    'api_studies': lambda rng, ctx: _get('/api/studies'),
+    'api_suggest': lambda rng, ctx: _get('/api/patients/suggest?' + urlencode(
+        {'q': rng.choice(SEARCH_TERMS)[:rng.randint(2, 4)]})),
+    'study_form': lambda rng, ctx: _get('/study/new'),
+    'login': lambda rng, ctx: ('POST', '/login', urlencode({'username': ctx['username'],
+                                                            'password': ctx['password']}),
+                               {'Content-Type': 'application/x-www-form-urlencoded'}),
+}
+
+DEFAULT_SCENARIOS = ['health', 'api_patients', 'api_patient', 'api_search', 'dashboard', 'patient_detail', 'login']
+
+
+def percentile(sorted_values, p):
+    """Percentile par rang le plus proche sur une liste triée."""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def _client(name, args):
+    client = Client(args.url)
+    if name in ('login', 'health'):
+        return client
+    if args.token and name.startswith('api_'):
+        client.token = args.token
+    else:
+        client.login(args.username, args.password)
+    return client
+
+
+def run_background(name, concurrency, stop, args, ctx):
+    """Clients enchaînant sans pause les requêtes de `name` jusqu'à `stop` ; renvoie les statuts HTTP reçus."""
+    build = SCENARIOS[name]
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker(index):
+        rng = random.Random(f"{args.seed}-background-{name}-{index}")
+        client = _client(name, args)
+        local = {}
+        while not stop.is_set():
+            method, path, body, headers = build(rng, ctx)
+            try:
+                status = client.request(method, path, body, headers).status
+            except (http.client.HTTPException, OSError):
+                status = 'error'
+            local[status] = local.get(status, 0) + 1
+        with lock:
+            for status, n in local.items():
+                statuses[str(status)] = statuses.get(str(status), 0) + n
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    return threads, statuses
+
+
+def run_scenario(name, concurrency, duration, args, ctx, background=None):
+    build = SCENARIOS[name]
+    latencies, query_counts, errors = [], [], [0]
+    lock = threading.Lock()
+
+    stop = threading.Event()
+    background_threads, background_statuses = [], {}
+    if background:
+        background_threads, background_statuses = run_background(*background, stop, args, ctx)
+    deadline = time.monotonic() + duration
+
+    def worker(index):
+        rng = random.Random(f"{args.seed}-{name}-{concurrency}-{index}")
+        client = _client(name, args)
+        local_latencies, local_queries, local_errors = [], [], 0
+        while time.monotonic() < deadline:
+            method, path, body, headers = build(rng, ctx)
+            if name == 'login':
+                client.cookie = None
+            start = time.perf_counter()
+            try:
+                response = client.request(method, path, body, headers)
+            except (http.client.HTTPException, OSError):
+                local_errors += 1
+                continue
+            local_latencies.append((time.perf_counter() - start) * 1000)
+            if response.status >= 500 or response.status in (401, 403, 429):
+                local_errors += 1
+            count = response.getheader('X-Query-Count')
+            if count is not None:
+                local_queries.append(int(count))
+        with lock:
+            latencies.extend(local_latencies)
+            query_counts.extend(local_queries)
+            errors[0] += local_errors
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    stop.set()
+    for thread in background_threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        'scenario': name,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'duration_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'p50': _round(percentile(latencies, 50)),
+            'p95': _round(percentile(latencies, 95)),
+            'p99': _round(percentile(latencies, 99)),
+            'max': _round(latencies[-1] if latencies else None),
+        },
+        'queries_per_request': round(sum(query_counts) / len(query_counts), 2) if query_counts else None,
+        'background': {'scenario': background[0], 'concurrency': background[1],
+                       'statuses': background_statuses} if background else None,
+    }
+
+
+def _round(value):
+    return round(value, 2) if value is not None else None
+
+
+def _max_patient_id(args):
+    if args.max_patient_id:
+        return args.max_patient_id
+    try:
+        with datagen.connect().cursor() as cursor:
+            cursor.execute("SELECT MAX(id) AS max_id FROM patients")
+            return cursor.fetchone()['max_id'] or 1
+    except Exception as e:
+        raise SystemExit(f"Indiquer --max-patient-id (base inaccessible: {e}).")
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--username', default='bench')
+    parser.add_argument('--password', default='bench')
+    parser.add_argument('--token', help="jeton d'API pour les scénarios api_* (au lieu de la session)")
+    parser.add_argument('--scenarios', default=','.join(DEFAULT_SCENARIOS),
+                        help=f"parmi : {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help="niveaux de concurrence, séparés par des virgules")
+    parser.add_argument('--duration', type=float, default=20, help="secondes par scénario et par niveau")
+    parser.add_argument('--background', help="charge abusive simultanée « scénario=clients » (ex. api_search=64)")
+    parser.add_argument('--max-patient-id', type=int, help="sinon lu en base (variables DB_*)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--tag', action='append', default=[], help="métadonnée clé=valeur (ex. workers=4)")
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"scénario(s) inconnu(s): {', '.join(unknown)}")
+    levels = [int(c) for c in args.concurrency.split(',')]
+    background = None
+    if args.background:
+        background_name, _, background_clients = args.background.partition('=')
+        if background_name not in SCENARIOS or not background_clients.isdigit():
+            parser.error(f"--background invalide: {args.background} (attendu scénario=clients)")
+        background = (background_name, int(background_clients))
+        scenarios_used = scenarios + [background_name]
+    else:
+        scenarios_used = scenarios
+    ctx = {'username': args.username, 'password': args.password}
+    if any(s in ('api_patient', 'patient_detail') for s in scenarios_used):
+        ctx['max_patient_id'] = _max_patient_id(args)
+
+    results = []
+    for name in scenarios:
+        for concurrency in levels:
+            result = run_scenario(name, concurrency, args.duration, args, ctx, background)
+            results.append(result)
+            lat = result['latency_ms']
+            print(f"{name:20} c={concurrency:<4} {result['throughput_rps']:>9} req/s  "
+                  f"p50={lat['p50']} p95={lat['p95']} p99={lat['p99']} ms  "
+                  f"sql/req={result['queries_per_request']}  erreurs={result['errors']}")
+            if background:
+                print(f"{'':20} charge de fond {background[0]} x{background[1]} : {result['background']['statuses']}")
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'url': args.url,
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'host': platform.node(),
+            'duration_s': args.duration,
+            'tags': dict(tag.split('=', 1) for tag in args.tag if '=' in tag),
+        },
+        'results': results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
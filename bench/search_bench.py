@@ -0,0 +1,84 @@
+r"""
+Compare la recherche LIKE historique au moteur plein texte de `flask/search.py`.
+
+    DB_HOST=127.0.0.1 DB_USER=... DB_PASSWORD=... DB_NAME=bench \
+        python bench/search_bench.py --patients 200000 --studies 1000000
+
+Utiliser une base dédiée : les données générées s'ajoutent aux tables existantes.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask'))
+
+import datagen  # noqa: E402
+import search  # noqa: E402
+
+LIKE_SQL = """
+    SELECT
+        p.id as patient_id, p.lastname, p.firstname, p.birthdate, p.gender,
+        s.id as study_id, s.study_date, s.study_description, s.modality
+    FROM patients p
+    LEFT JOIN studies s ON p.id = s.patient_id
+    WHERE
+        p.lastname LIKE %s OR
+        p.firstname LIKE %s OR
+        s.study_description LIKE %s OR
+        s.modality LIKE %s
+"""
+
+QUERIES = ['dupont', 'Hélène', 'helene martin', 'genou', 'scanner cérébral', 'IRM', 'echographie', 'lefevre']
+
+
+def timed(fn, repeat):
+    samples = []
+    rows = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'rows': rows, 'median_ms': round(statistics.median(samples), 2), 'max_ms': round(max(samples), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=200000)
+    parser.add_argument('--studies', type=int, default=1000000)
+    parser.add_argument('--skip-seed', action='store_true', help="réutiliser les données déjà présentes")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    args = parser.parse_args()
+
+    conn = datagen.connect()
+    if not args.skip_seed:
+        datagen.seed(conn, args.patients, args.studies)
+
+    results = []
+    with conn.cursor() as cursor:
+        for q in QUERIES:
+            term = f"%{q}%"
+
+            def run_like():
+                cursor.execute(LIKE_SQL, (term, term, term, term))
+                return len(cursor.fetchall())
+
+            def run_fulltext():
+                return len(search.search(cursor, q, limit=args.limit))
+
+            result = {'query': q, 'like': timed(run_like, args.repeat), 'fulltext': timed(run_fulltext, args.repeat)}
+            results.append(result)
+            print(f"{q!r:22} LIKE {result['like']['median_ms']:>9} ms   "
+                  f"FULLTEXT {result['fulltext']['median_ms']:>9} ms")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
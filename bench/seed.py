@@ -0,0 +1,39 @@
+r"""
+Peuple une base MariaDB locale avec des données synthétiques reproductibles.
+
+    DB_HOST=127.0.0.1 DB_USER=... DB_PASSWORD=... DB_NAME=bench \
+        python bench/seed.py --patients 1000000 --studies 5000000 --reset
+
+La base doit avoir le schéma de l'application (db/init.sql puis `flask db upgrade`).
+"""
+import argparse
+import time
+
+import datagen
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--studies', type=int, default=500000)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42, help="graine du générateur (reproductibilité)")
+    parser.add_argument('--reset', action='store_true', help="vider patients et études avant insertion")
+    parser.add_argument('--user', default='bench', help="compte créé pour le générateur de charge")
+    parser.add_argument('--password', default='bench')
+    args = parser.parse_args()
+
+    conn = datagen.connect()
+    if args.reset:
+        datagen.reset(conn)
+    start = time.monotonic()
+    datagen.seed(conn, args.patients, args.studies, batch_size=args.batch_size, seed=args.seed)
+    datagen.ensure_user(conn, args.user, args.password)
+    with conn.cursor() as cursor:
+        cursor.execute("ANALYZE TABLE patients, studies")
+        cursor.fetchall()
+    print(f"Données générées en {time.monotonic() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+r"""
+Microbenchmark de l'index en mémoire de /api/patients/suggest, sans base de
+données : patients synthétiques (datagen), construction du segment compact,
+mémoire occupée et latence des recherches par préfixe.
+
+    python bench/suggest_bench.py --patients 1000000 --queries 20000 --output bench/results/suggest.json
+
+La mémoire indiquée est celle du segment (octets des blocs et des tableaux) ;
+le pic de construction (tracemalloc) inclut la liste temporaire des entrées,
+libérée une fois le segment construit.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask'))
+
+import datagen  # noqa: E402
+import patient_index  # noqa: E402
+
+
+def make_rows(n, seed):
+    gen = datagen.Generator(seed)
+    for patient_id in range(1, n + 1):
+        lastname, firstname, birthdate, _ = gen.patient()
+        yield {'id': patient_id, 'lastname': lastname, 'firstname': firstname, 'birthdate': birthdate}
+
+
+def make_queries(n, seed):
+    """Saisies de 1 à 5 lettres d'un nom ou d'un prénom, parfois suivies du début de l'autre."""
+    rng = random.Random(seed)
+    names = datagen.LASTNAMES + datagen.FIRSTNAMES_F + datagen.FIRSTNAMES_M
+    queries = []
+    for _ in range(n):
+        query = rng.choice(names)[:rng.randint(1, 5)]
+        if rng.random() < 0.3:
+            query = f"{rng.choice(datagen.LASTNAMES)} {rng.choice(names)[:rng.randint(1, 3)]}"
+        queries.append(query)
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patients', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="fichier JSON de résultats")
+    args = parser.parse_args()
+
+    rows = list(make_rows(args.patients, args.seed))
+    start = time.perf_counter()
+    segment = patient_index.build_segment(rows)
+    build_s = time.perf_counter() - start
+    # Seconde construction sous tracemalloc pour le pic de mémoire (plus lente)
+    tracemalloc.start()
+    patient_index.build_segment(rows)
+    build_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del rows
+
+    index = patient_index.PatientIndex()
+    index._state = (segment, patient_index.Delta())
+    queries = make_queries(args.queries, args.seed)
+    durations = []
+    for query in queries:
+        t0 = time.perf_counter()
+        index.lookup(query, args.limit)
+        durations.append((time.perf_counter() - t0) * 1e6)
+    durations.sort()
+
+    result = {
+        'patients': args.patients,
+        'keys': len(segment),
+        'build_s': round(build_s, 2),
+        'segment_bytes': segment.nbytes(),
+        'bytes_per_patient': round(segment.nbytes() / args.patients, 1),
+        'build_peak_mb': round(build_peak / 1e6, 1),
+        'lookup_us': {
+            'p50': round(statistics.median(durations), 1),
+            'p99': round(durations[int(len(durations) * 0.99) - 1], 1),
+            'max': round(durations[-1], 1),
+        },
+    }
+    print(f"{args.patients} patients, {result['keys']} clés : segment de {result['segment_bytes'] / 1e6:.1f} Mo "
+          f"({result['bytes_per_patient']} octets/patient), construit en {result['build_s']} s, "
+          f"pic de {result['build_peak_mb']} Mo pendant la construction")
+    print(f"Recherche ({args.queries} saisies, limit={args.limit}) : p50 {result['lookup_us']['p50']} µs, "
+          f"p99 {result['lookup_us']['p99']} µs, max {result['lookup_us']['max']} µs")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,19 @@
+-- Schéma initial, exécuté à la création du volume MariaDB.
+-- Les évolutions ultérieures sont des migrations : flask/migrations/ (flask db upgrade).
+
 -- Création de la table 'patients'
 CREATE TABLE IF NOT EXISTS patients (
     id INT AUTO_INCREMENT PRIMARY KEY,
     lastname VARCHAR(100) NOT NULL,
     firstname VARCHAR(100) NOT NULL,
     birthdate DATE,
-    gender ENUM('M', 'F', 'O') -- M: Male, F: Female, O: Other
-);
+    gender ENUM('M', 'F', 'O'), -- M: Male, F: Female, O: Other
+    -- Version de la ligne (ETag) et date de dernière modification
+    version INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- Recherche plein texte ; la collation _unicode_ci rend la recherche insensible aux accents
+    FULLTEXT KEY ft_patients_name (lastname, firstname)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- Création de la table 'studies'
 CREATE TABLE IF NOT EXISTS studies (
@@ -14,9 +22,22 @@ CREATE TABLE IF NOT EXISTS studies (
     study_date DATETIME,
     study_description VARCHAR(255),
     modality VARCHAR(50),
-    FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE
+    version INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE,
+    FULLTEXT KEY ft_studies_description (study_description),
+    KEY idx_studies_modality (modality)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Compteurs de modification par table, incrémentés par chaque écriture (ETag des listes)
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name VARCHAR(64) PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 );
 
+INSERT INTO table_versions (table_name) VALUES ('patients'), ('studies');
+
 -- Insertion de quelques données de test (optionnel mais recommandé)
 INSERT INTO patients (lastname, firstname, birthdate, gender) VALUES
 ('Dupont', 'Jean', '1985-05-20', 'M'),
@@ -0,0 +1,269 @@
+# Contrôle d'admission : débit par utilisateur (ou jeton d'API) et par classe
+# d'endpoint, et nombre borné de requêtes coûteuses simultanées par processus.
+# Une requête refusée l'est tout de suite (429 ou 503 avec Retry-After) plutôt
+# que d'occuper un thread du worker et une connexion MariaDB.
+
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, jsonify, request
+from flask_login import current_user
+
+CLASSES = ('search', 'list', 'write')
+
+# Endpoints de lecture coûteux ; les autres lectures (/health, GET /api/patients/<id>...) ne sont pas limitées
+ENDPOINT_CLASSES = {
+    'api.search': 'search',
+    'api.get_patients': 'list',
+    'api.get_studies': 'list',
+    'api.bulk_export': 'list',
+    'api.get_stats': 'list',
+    'frontend.dashboard': 'list',
+}
+
+# Écritures non limitées : la connexion est anonyme et le formulaire doit rester accessible
+EXEMPT_ENDPOINTS = ('frontend.login', 'static')
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def classify(req):
+    """Classe d'admission de la requête, ou None si elle n'est pas limitée."""
+    if req.endpoint is None or req.endpoint in EXEMPT_ENDPOINTS:
+        return None
+    if req.method not in SAFE_METHODS:
+        return 'write'
+    if req.endpoint == 'frontend.dashboard' and req.args.get('q'):
+        return 'search'
+    return ENDPOINT_CLASSES.get(req.endpoint)
+
+
+def identity():
+    """Clé du compteur de débit : le jeton d'API, sinon l'utilisateur, sinon l'adresse du client."""
+    if current_user.is_authenticated:
+        jti = getattr(current_user, 'jti', None)
+        return f"token:{jti}" if jti else f"user:{current_user.id}"
+    return f"ip:{request.remote_addr}"
+
+
+def parse_classes(value, setting, convert):
+    """Valeurs par classe « classe=valeur,... » (ADMISSION_RATES, ADMISSION_CONCURRENCY)."""
+    values = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, raw = item.partition('=')
+        try:
+            if name.strip() not in CLASSES:
+                raise ValueError(name)
+            values[name.strip()] = convert(raw.strip())
+        except ValueError:
+            raise ValueError(f"{setting} invalide: {item} (classes : {', '.join(CLASSES)}).") from None
+    return values
+
+
+def parse_rate(value):
+    """« débit:rafale » en requêtes par seconde, par ex. « 2:10 » ; la rafale vaut le débit par défaut."""
+    rate, _, burst = value.partition(':')
+    rate, burst = float(rate), float(burst or rate)
+    if rate <= 0 or burst < 1:
+        raise ValueError(value)
+    return rate, burst
+
+
+def parse_count(value):
+    count = int(value)
+    if count < 1:
+        raise ValueError(value)
+    return count
+
+
+class TokenBuckets:
+    """
+    Seaux à jetons par clé : `burst` requêtes d'affilée, puis `rate` par
+    seconde. Les `maxsize` clés les plus récentes sont conservées ; une clé
+    oubliée repart avec un seau plein, ce qui reste permissif.
+    """
+
+    def __init__(self, rate, burst, maxsize=10000):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        """Consomme un jeton ; renvoie 0, ou le délai en secondes avant le prochain jeton."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConcurrencyLimit:
+    """
+    Au plus `limit` requêtes en cours ; au-delà, `max_queue` requêtes attendent
+    une place au plus `timeout` secondes. Une requête qui attend occupe un
+    thread du worker : la file reste donc courte.
+    """
+
+    def __init__(self, limit, max_queue=1, timeout=0.5):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """True si une place a été obtenue après attente, False sans attente, None si refusée."""
+        with self._cond:
+            if self.active < self.limit:
+                self.active += 1
+                return False
+            if self.waiting >= self.max_queue:
+                return None
+            self.waiting += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+
+class AdmissionControl:
+    """Débit par identité et concurrence par classe, avec les compteurs de décisions."""
+
+    def __init__(self, rates, concurrency, max_queue=1, queue_timeout=0.5):
+        self.buckets = {name: TokenBuckets(rate, burst) for name, (rate, burst) in rates.items()}
+        self.limits = {name: ConcurrencyLimit(limit, max_queue, queue_timeout)
+                       for name, limit in concurrency.items()}
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self.counters = {name: {'admitted': 0, 'queued': 0, 'throttled': 0, 'shed': 0} for name in CLASSES}
+
+    def _count(self, name, decision):
+        with self._lock:
+            self.counters[name][decision] += 1
+
+    def admit(self, name, key):
+        """
+        Renvoie (statut, délai) : ('admitted', None) ou ('queued', None) si la
+        requête peut s'exécuter (la place est à rendre par `release`),
+        ('throttled', secondes) au-delà du débit, ('shed', secondes) si les
+        requêtes coûteuses en cours et en attente sont trop nombreuses.
+        """
+        buckets = self.buckets.get(name)
+        if buckets is not None:
+            wait = buckets.take(key)
+            if wait:
+                self._count(name, 'throttled')
+                return 'throttled', wait
+        limit = self.limits.get(name)
+        if limit is not None:
+            queued = limit.acquire()
+            if queued is None:
+                self._count(name, 'shed')
+                return 'shed', self.queue_timeout
+            if queued:
+                self._count(name, 'queued')
+        self._count(name, 'admitted')
+        return 'admitted', None
+
+    def release(self, name):
+        limit = self.limits.get(name)
+        if limit is not None:
+            limit.release()
+
+    def stats(self):
+        with self._lock:
+            counters = {name: dict(counts) for name, counts in self.counters.items()}
+        for name, counts in counters.items():
+            buckets = self.buckets.get(name)
+            limit = self.limits.get(name)
+            # TokenBuckets définit __len__ : un seau sans clé serait faux, d'où `is not None`
+            counts['rate'] = ({'per_sec': buckets.rate, 'burst': buckets.burst, 'keys': len(buckets)}
+                              if buckets is not None else None)
+            counts['concurrency'] = ({'limit': limit.limit, 'active': limit.active,
+                                      'waiting': limit.waiting, 'max_queue': limit.max_queue}
+                                     if limit is not None else None)
+        return counters
+
+
+MESSAGES = {
+    'throttled': "Trop de requêtes : réessayer dans {retry} s.",
+    'shed': "Serveur occupé : réessayer dans {retry} s.",
+}
+
+
+def _refuse(decision, delay):
+    retry = max(1, math.ceil(delay))
+    message = MESSAGES[decision].format(retry=retry)
+    code = 429 if decision == 'throttled' else 503
+    headers = {'Retry-After': str(retry)}
+    if request.blueprint == 'api':
+        return jsonify(status="error", message=message), code, headers
+    return message, code, headers
+
+
+def _admit():
+    name = classify(request)
+    if name is None:
+        return None
+    decision, delay = current_app.extensions['admission'].admit(name, identity())
+    if delay is not None:
+        return _refuse(decision, delay)
+    g.admission_class = name
+    return None
+
+
+def _release_on_close(response):
+    """La place est rendue quand la réponse a été envoyée : un flux garde sa place jusqu'au bout."""
+    name = g.pop('admission_class', None)
+    if name is not None:
+        control = current_app.extensions['admission']
+        response.call_on_close(lambda: control.release(name))
+    return response
+
+
+def _release(e=None):
+    # Exception avant after_request : la place n'a pas été confiée à la réponse
+    name = g.pop('admission_class', None)
+    if name is not None:
+        current_app.extensions['admission'].release(name)
+
+
+def init_app(app):
+    config = app.config
+    control = AdmissionControl(parse_classes(config['ADMISSION_RATES'], 'ADMISSION_RATES', parse_rate),
+                               parse_classes(config['ADMISSION_CONCURRENCY'], 'ADMISSION_CONCURRENCY', parse_count),
+                               max_queue=config['ADMISSION_MAX_QUEUE'],
+                               queue_timeout=config['ADMISSION_QUEUE_TIMEOUT'])
+    app.extensions['admission'] = control
+    app.before_request(_admit)
+    app.after_request(_release_on_close)
+    app.teardown_request(_release)
@@ -1,7 +1,9 @@
 import os
-from flask import Flask
+from flask import Flask, jsonify
 from flask_login import LoginManager
-from models import User
+from models import User, UsersVersion
+from cache import TTLCache
+from changes import subscriber_limit
 
 def create_app():
     app = Flask(__name__)
@@ -12,6 +14,94 @@ def create_app():
     app.config['DB_USER'] = os.environ.get('DB_USER')
     app.config['DB_PASSWORD'] = os.environ.get('DB_PASSWORD')
     app.config['DB_NAME'] = os.environ.get('DB_NAME')
+    app.config['MIGRATIONS_DIR'] = os.environ.get('MIGRATIONS_DIR', os.path.join(app.root_path, 'migrations'))
+    # Pool de connexions MariaDB
+    app.config['DB_POOL_MIN_SIZE'] = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+    app.config['DB_POOL_MAX_SIZE'] = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+    app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+    app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 3600))
+    app.config['DB_POOL_PING_INTERVAL'] = int(os.environ.get('DB_POOL_PING_INTERVAL', 30))
+    app.config['READINESS_TIMEOUT'] = float(os.environ.get('READINESS_TIMEOUT', 1))
+    # Répliques en lecture (« hôte[:port],... », mêmes identifiants que le primaire)
+    app.config['DB_REPLICAS'] = os.environ.get('DB_REPLICAS', '')
+    app.config['DB_REPLICA_STRATEGY'] = os.environ.get('DB_REPLICA_STRATEGY', 'round_robin')
+    app.config['DB_REPLICA_MAX_LAG'] = float(os.environ.get('DB_REPLICA_MAX_LAG', 5))
+    app.config['DB_REPLICA_CHECK_INTERVAL'] = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 5))
+    app.config['DB_REPLICA_ACQUIRE_TIMEOUT'] = float(os.environ.get('DB_REPLICA_ACQUIRE_TIMEOUT', 0.5))
+    app.config['DB_READ_YOUR_WRITES'] = int(os.environ.get('DB_READ_YOUR_WRITES', 10))
+    # Shards de patients supplémentaires (« hôte[:port]/base,... ») ; la base principale est le shard 0
+    app.config['DB_SHARDS'] = os.environ.get('DB_SHARDS', '')
+    # Instrumentation SQL
+    app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+    app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+    app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '1') == '1'
+    # Cache des utilisateurs authentifiés
+    app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 60))
+    # Délai maximal de prise en compte, dans les autres workers, d'un changement de rôle ou de statut
+    app.config['USER_CACHE_CHECK_INTERVAL'] = float(os.environ.get('USER_CACHE_CHECK_INTERVAL', 2))
+    app.extensions['user_cache'] = TTLCache(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+    app.extensions['users_version'] = UsersVersion(app.config['USER_CACHE_CHECK_INTERVAL'])
+    # Pagination et compteurs de l'API
+    app.config['PATIENTS_MAX_PER_PAGE'] = int(os.environ.get('PATIENTS_MAX_PER_PAGE', 100))
+    app.config['PATIENTS_MAX_IDS'] = int(os.environ.get('PATIENTS_MAX_IDS', 100))
+    app.config['COUNT_CACHE_TTL'] = int(os.environ.get('COUNT_CACHE_TTL', 30))
+    app.extensions['count_cache'] = TTLCache(64, app.config['COUNT_CACHE_TTL'])
+    app.config['SEARCH_MAX_LIMIT'] = int(os.environ.get('SEARCH_MAX_LIMIT', 200))
+    app.config['DASHBOARD_PER_PAGE'] = int(os.environ.get('DASHBOARD_PER_PAGE', 50))
+    app.config['DASHBOARD_STREAM_BUFFER'] = int(os.environ.get('DASHBOARD_STREAM_BUFFER', 100))
+    app.config['STREAM_CHUNK_SIZE'] = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+    app.config['PATCH_MAX_ITEMS'] = int(os.environ.get('PATCH_MAX_ITEMS', 500))
+    # Import en masse
+    app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+    app.config['IMPORT_MAX_CHUNK_SIZE'] = int(os.environ.get('IMPORT_MAX_CHUNK_SIZE', 10000))
+    app.config['IMPORT_MAX_ERRORS'] = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))
+    # Sérialisation JSON (auto : orjson s'il est installé) et compression des réponses
+    app.config['JSON_PROVIDER'] = os.environ.get('JSON_PROVIDER', 'auto')
+    app.config['COMPRESSION_ENCODINGS'] = os.environ.get('COMPRESSION_ENCODINGS', 'zstd,br,gzip')
+    app.config['COMPRESSION_MIN_SIZE'] = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+    # Contrôle d'admission, par worker : débit par utilisateur ou jeton (« classe=débit/s:rafale »)
+    # et requêtes coûteuses simultanées par classe (search, list, write)
+    app.config['ADMISSION_RATES'] = os.environ.get('ADMISSION_RATES', 'search=2:10,list=10:30,write=10:30')
+    app.config['ADMISSION_CONCURRENCY'] = os.environ.get('ADMISSION_CONCURRENCY', 'search=1,list=2')
+    app.config['ADMISSION_MAX_QUEUE'] = int(os.environ.get('ADMISSION_MAX_QUEUE', 1))
+    app.config['ADMISSION_QUEUE_TIMEOUT'] = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.5))
+    # Jetons d'API signés (clé dérivée de SECRET_KEY par défaut)
+    app.config['API_TOKEN_SECRET'] = os.environ.get('API_TOKEN_SECRET')
+    app.config['API_TOKEN_TTL'] = int(os.environ.get('API_TOKEN_TTL', 86400))
+    app.config['API_TOKEN_MAX_TTL'] = int(os.environ.get('API_TOKEN_MAX_TTL', 30 * 86400))
+    app.config['API_TOKEN_REVOCATION_REFRESH'] = int(os.environ.get('API_TOKEN_REVOCATION_REFRESH', 30))
+    # Index en mémoire de /api/patients/suggest (saisie semi-automatique)
+    app.config['SUGGEST_MAX_LIMIT'] = int(os.environ.get('SUGGEST_MAX_LIMIT', 50))
+    app.config['SUGGEST_MAX_SCAN'] = int(os.environ.get('SUGGEST_MAX_SCAN', 500))
+    app.config['SUGGEST_REFRESH_INTERVAL'] = float(os.environ.get('SUGGEST_REFRESH_INTERVAL', 2))
+    app.config['SUGGEST_REBUILD_INTERVAL'] = int(os.environ.get('SUGGEST_REBUILD_INTERVAL', 3600))
+    app.config['SUGGEST_MERGE_THRESHOLD'] = int(os.environ.get('SUGGEST_MERGE_THRESHOLD', 50000))
+    app.config['SUGGEST_OVERLAP'] = int(os.environ.get('SUGGEST_OVERLAP', 60))
+    # Tâches de fond (web : exécutées par les workers web ; off : par `flask jobs worker`)
+    app.config['JOBS_RUNNER'] = os.environ.get('JOBS_RUNNER', 'web')
+    app.config['JOBS_CONCURRENCY'] = os.environ.get('JOBS_CONCURRENCY', '')
+    app.config['JOBS_POLL_INTERVAL'] = float(os.environ.get('JOBS_POLL_INTERVAL', 2))
+    app.config['JOBS_STALE_AFTER'] = int(os.environ.get('JOBS_STALE_AFTER', 60))
+    app.config['JOBS_DIR'] = os.environ.get('JOBS_DIR', os.path.join(app.instance_path, 'jobs'))
+    # Flux des modifications /api/changes (Server-Sent Events)
+    app.config['CHANGES_POLL_INTERVAL'] = float(os.environ.get('CHANGES_POLL_INTERVAL', 1))
+    app.config['CHANGES_BATCH_SIZE'] = int(os.environ.get('CHANGES_BATCH_SIZE', 500))
+    app.config['CHANGES_BUFFER'] = int(os.environ.get('CHANGES_BUFFER', 10000))
+    app.config['CHANGES_GAP_TIMEOUT'] = float(os.environ.get('CHANGES_GAP_TIMEOUT', 10))
+    # Plafonné sous WEB_THREADS hors gevent : chaque abonné y garde un thread (0 : pas de flux)
+    app.config['CHANGES_MAX_SUBSCRIBERS'] = subscriber_limit(int(os.environ.get('CHANGES_MAX_SUBSCRIBERS', 1000)),
+                                                             os.environ.get('WEB_WORKER_CLASS', 'gevent'),
+                                                             int(os.environ.get('WEB_THREADS', 4)))
+    app.config['CHANGES_KEEPALIVE'] = float(os.environ.get('CHANGES_KEEPALIVE', 15))
+    app.config['CHANGES_MAX_DURATION'] = float(os.environ.get('CHANGES_MAX_DURATION', 300))
+    # Archivage des études : fenêtre chaude lue par défaut, lots de `flask studies archive`
+    app.config['STUDIES_HOT_DAYS'] = int(os.environ.get('STUDIES_HOT_DAYS', 730))
+    app.config['ARCHIVE_BATCH_SIZE'] = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+    app.config['ARCHIVE_PAUSE'] = float(os.environ.get('ARCHIVE_PAUSE', 0.1))
+
+    import json_provider
+    json_provider.init_app(app)
 
     # Initialisation de Flask-Login
     login_manager = LoginManager()
@@ -20,7 +110,11 @@ def create_app():
 
     @login_manager.user_loader
     def load_user(user_id):
-        return User.get(user_id)
+        return User.get_cached(user_id)
+
+    # Clients machine : jeton « Authorization: Bearer » vérifié par signature, sans requête SQL
+    import tokens
+    login_manager.request_loader(tokens.load_from_request)
 
     # Importation et enregistrement des Blueprints
     from routes.api import api_bp
@@ -31,14 +125,133 @@ def create_app():
     from db import init_app
     init_app(app)
 
+    import instrumentation
+    instrumentation.init_app(app)
+
+    # Après l'instrumentation : les requêtes refusées apparaissent aussi dans /metrics
+    import admission
+    admission.init_app(app)
+
+    import compression
+    compression.init_app(app)
+
+    import patient_index
+    patient_index.init_app(app)
+
+    import jobs
+    jobs.init_app(app)
+
+    # Commandes CLI (flask export, flask db ..., flask stats ..., flask jobs ..., flask changes ..., flask studies ...)
+    from archive import studies_cli
+    from bulk import export_command
+    from changes import changes_cli
+    from migrate import db_cli
+    from study_stats import stats_cli
+    app.cli.add_command(export_command)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(jobs.jobs_cli)
+    app.cli.add_command(changes_cli)
+    app.cli.add_command(studies_cli)
+
     return app
 
 app = create_app()
 
 @app.route('/health')
+@app.route('/health/live')
 def health_check():
-    """A simple health check endpoint."""
+    """Liveness: the process answers, without touching the database."""
     return "OK", 200
 
+@app.route('/health/ready')
+def readiness_check():
+    """Readiness: a pooled connection can be obtained and answers a query."""
+    from db import get_pool
+    from pool import PoolTimeout
+    import pymysql
+    pool = get_pool()
+    try:
+        conn = pool.acquire(timeout=app.config['READINESS_TIMEOUT'])
+    except (PoolTimeout, pymysql.MySQLError) as e:
+        return jsonify(status="unavailable", message=str(e)), 503
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except pymysql.MySQLError as e:
+        pool.release(conn, discard=True)
+        return jsonify(status="unavailable", message=str(e)), 503
+    pool.release(conn)
+    return jsonify(status="ready", pid=os.getpid())
+
+@app.route('/health/pool')
+def pool_stats():
+    """Statistiques du pool de connexions (en usage, inactives, attente, débit), et de ceux des shards."""
+    from db import get_pool
+    stats = get_pool().stats()
+    if app.extensions['db_shards']:
+        stats['shards'] = [pool.stats() for pool in app.extensions['db_shards']]
+    return jsonify(stats)
+
+@app.route('/health/replicas')
+def replica_stats():
+    """État des répliques en lecture de ce processus : retard, disponibilité, lectures servies."""
+    replicas = app.extensions.get('db_replicas')
+    return jsonify(replicas.stats() if replicas is not None else {'replicas': []})
+
+@app.route('/health/suggest')
+def suggest_stats():
+    """Index des patients de ce processus : taille, delta, reconstructions."""
+    return jsonify(app.extensions['patient_index'].stats())
+
+@app.route('/health/jobs')
+def job_stats():
+    """File des tâches de fond par type et statut, et runner de ce processus."""
+    import jobs
+    from db import get_db
+    import pymysql
+    try:
+        with get_db().cursor() as cursor:
+            cursor.execute("SELECT job_type, status, COUNT(*) AS n FROM jobs "
+                           "WHERE status IN ('queued', 'running') GROUP BY job_type, status")
+            rows = cursor.fetchall()
+    except pymysql.MySQLError as e:
+        return jsonify(status="unavailable", message=str(e)), 503
+    queue = {}
+    for row in rows:
+        queue.setdefault(row['job_type'], {})[row['status']] = row['n']
+    runner = jobs.current_runner()
+    return jsonify(queue=queue, runner=runner.stats() if runner is not None else None)
+
+@app.route('/health/changes')
+def change_feed_stats():
+    """Flux des modifications de ce processus : abonnés, position dans le journal, cycles de lecture."""
+    import changes
+    feed = changes.current_feed()
+    return jsonify(feed.stats() if feed is not None else {'running': False, 'subscribers': 0})
+
+@app.route('/health/admission')
+def admission_stats():
+    """Décisions du contrôle d'admission de ce processus par classe : admises, en file, limitées, délestées."""
+    return jsonify(app.extensions['admission'].stats())
+
+@app.route('/metrics')
+def sql_metrics():
+    """Histogrammes par endpoint du nombre de requêtes SQL et du temps passé en base."""
+    import instrumentation
+    return jsonify(instrumentation.metrics.snapshot())
+
+@app.route('/health/etag')
+def etag_stats():
+    """Réponses conditionnelles servies en 304 (hits) ou en entier (misses), par endpoint."""
+    import versioning
+    return jsonify(versioning.stats.snapshot())
+
+@app.route('/health/tokens')
+def token_stats():
+    """Taille et fraîcheur de la liste des jetons d'API révoqués de ce processus."""
+    import tokens
+    return jsonify(tokens.revocations.stats())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,134 @@
+# Archivage des études anciennes : `studies` ne garde que la fenêtre chaude
+# (STUDIES_HOT_DAYS jours), seule lue par défaut. `flask studies archive`,
+# à planifier, déplace les études plus anciennes dans `studies_archive` par
+# petits lots validés un à un : seules les lignes du lot sont verrouillées.
+# Les lectures ne descendent dans l'archive que sur demande (`archive=1`) ;
+# les synthèses de study_stats comptent les deux tables.
+
+import time
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import changes
+import versioning
+from db import get_shard, shard_count
+
+ARCHIVE_TABLE = 'studies_archive'
+
+# Colonnes communes aux deux tables, recopiées telles quelles (id et version compris)
+COLUMNS = ('id', 'patient_id', 'study_date', 'study_description', 'modality', 'version', 'updated_at')
+
+
+def study_tables(include_archive=False):
+    """Tables d'études à lire : la table chaude, et l'archive si elle est demandée."""
+    return ('studies', ARCHIVE_TABLE) if include_archive else ('studies',)
+
+
+def parse_range(args):
+    """
+    Filtres d'une requête : `from` et `to` (AAAA-MM-JJ, inclus) et `archive=1`.
+    Renvoie (date_from, date_to, include_archive) ; lève ValueError si une date est invalide.
+    """
+    date_from = date.fromisoformat(args['from']) if args.get('from') else None
+    date_to = date.fromisoformat(args['to']) if args.get('to') else None
+    return date_from, date_to, args.get('archive') in ('1', 'true')
+
+
+def date_conditions(column, date_from=None, date_to=None):
+    """Conditions SQL sur `column` pour une période aux bornes incluses, et leurs paramètres."""
+    conditions, params = [], []
+    if date_from:
+        conditions.append(f"{column} >= %s")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{column} < %s")
+        params.append(date_to + timedelta(days=1))
+    return conditions, params
+
+
+def cutoff(days):
+    """Début du jour situé `days` jours avant aujourd'hui : les études antérieures sont archivées."""
+    return datetime.combine(date.today() - timedelta(days=days), datetime.min.time())
+
+
+def pending(before):
+    """Nombre d'études à archiver sur l'ensemble des shards (parcours de idx_studies_study_date)."""
+    total = 0
+    for index in range(shard_count()):
+        with get_shard(index).cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) AS total FROM studies WHERE study_date < %s", (before,))
+            total += cursor.fetchone()['total']
+    return total
+
+
+def archive_batch(db, before, batch_size):
+    """
+    Déplace jusqu'à `batch_size` études datées d'avant `before`, les plus
+    anciennes d'abord, en une transaction. Les synthèses ne changent pas ;
+    le flux des modifications les publie comme supprimées de `studies`.
+    Renvoie le nombre d'études déplacées.
+    """
+    columns = ', '.join(COLUMNS)
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT id FROM studies WHERE study_date < %s ORDER BY study_date, id LIMIT %s FOR UPDATE",
+                           (before, batch_size))
+            ids = [row['id'] for row in cursor.fetchall()]
+            if ids:
+                placeholders = ', '.join(['%s'] * len(ids))
+                cursor.execute(f"INSERT INTO {ARCHIVE_TABLE} ({columns}) "
+                               f"SELECT {columns} FROM studies WHERE id IN ({placeholders})", ids)
+                cursor.execute(f"DELETE FROM studies WHERE id IN ({placeholders})", ids)
+                versioning.touch(cursor, 'studies')
+                changes.record(cursor, 'studies', ids, 'delete')
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(ids)
+
+
+def archive_shards(before, batch_size=1000, pause=0.0, progress=None):
+    """
+    archive_batch jusqu'à épuisement, shard après shard, avec `pause` secondes
+    entre deux lots pour laisser passer les écritures et la réplication.
+    `progress(moved)` est appelé après chaque lot et peut lever une exception
+    pour interrompre : les lots déjà validés restent archivés.
+    """
+    moved = 0
+    for index in range(shard_count()):
+        db = get_shard(index)
+        while True:
+            count = archive_batch(db, before, batch_size)
+            moved += count
+            if progress is not None and count:
+                progress(moved)
+            if count < batch_size:
+                break
+            time.sleep(pause)
+    return moved
+
+
+studies_cli = AppGroup('studies', help="Études : archivage des études anciennes.")
+
+
+@studies_cli.command('archive')
+@click.option('--days', type=int, help="Âge minimal des études archivées, en jours (STUDIES_HOT_DAYS par défaut).")
+@click.option('--batch-size', type=int, help="Études déplacées par transaction (ARCHIVE_BATCH_SIZE par défaut).")
+@click.option('--pause', type=float, help="Pause entre deux lots, en secondes (ARCHIVE_PAUSE par défaut).")
+@click.option('--dry-run', is_flag=True, help="Compter les études à archiver sans les déplacer.")
+def archive_command(days, batch_size, pause, dry_run):
+    """Déplacer les études sorties de la fenêtre chaude dans studies_archive, par lots, sur chaque shard."""
+    config = current_app.config
+    before = cutoff(config['STUDIES_HOT_DAYS'] if days is None else days)
+    total = pending(before)
+    if dry_run or not total:
+        click.echo(f"{total} étude(s) antérieure(s) au {before:%Y-%m-%d} à archiver.")
+        return
+    moved = archive_shards(before, batch_size or config['ARCHIVE_BATCH_SIZE'],
+                           config['ARCHIVE_PAUSE'] if pause is None else pause,
+                           progress=lambda moved: click.echo(f"{moved}/{total} étude(s) archivée(s)..."))
+    click.echo(f"{moved} étude(s) antérieure(s) au {before:%Y-%m-%d} archivée(s).")
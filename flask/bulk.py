@@ -0,0 +1,431 @@
+import csv
+import io
+import json
+import time
+import zlib
+from datetime import date, datetime
+
+import click
+import pymysql
+from flask import current_app
+from db import get_shard, merged_query, next_shard, shard_of
+import versioning
+import study_stats
+import changes
+import archive
+
+GENDERS = ('M', 'F', 'O')
+
+
+class RowError(ValueError):
+    """Ligne d'import invalide ; le message est renvoyé tel quel dans le rapport."""
+
+
+def read_rows(stream, fmt, delimiter=','):
+    """
+    Itère sur les lignes d'un flux NDJSON ou CSV sans le charger en mémoire.
+    Produit des couples (numéro de ligne, dict ou RowError).
+    """
+    text = io.TextIOWrapper(io.BufferedReader(stream), encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        reader = csv.DictReader(text, delimiter=delimiter)
+        for row in reader:
+            yield reader.line_num, {k.strip(): (v.strip() if isinstance(v, str) else v)
+                                    for k, v in row.items() if k is not None}
+        return
+
+    for line_num, line in enumerate(text, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, RowError(f"JSON invalide: {e}")
+            continue
+        if not isinstance(row, dict):
+            yield line_num, RowError("Chaque ligne doit être un objet JSON.")
+            continue
+        yield line_num, row
+
+
+def _required(row, key, max_length=None):
+    value = row.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        raise RowError(f"Champ obligatoire manquant: {key}.")
+    value = str(value).strip()
+    if max_length and len(value) > max_length:
+        raise RowError(f"Champ trop long: {key} ({max_length} caractères max).")
+    return value
+
+
+def _optional(row, key):
+    value = row.get(key)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return value
+
+
+def validate_patient(row):
+    """Renvoie le tuple à insérer dans `patients` ou lève RowError."""
+    birthdate = _optional(row, 'birthdate')
+    if birthdate is not None:
+        try:
+            birthdate = date.fromisoformat(str(birthdate))
+        except ValueError:
+            raise RowError(f"Date de naissance invalide: {birthdate} (attendu AAAA-MM-JJ).")
+    gender = _optional(row, 'gender')
+    if gender is not None and gender not in GENDERS:
+        raise RowError(f"Sexe invalide: {gender} (attendu M, F ou O).")
+    return (_required(row, 'lastname', 100), _required(row, 'firstname', 100), birthdate, gender)
+
+
+def validate_study(row):
+    """Renvoie le tuple à insérer dans `studies` ou lève RowError."""
+    try:
+        patient_id = int(_required(row, 'patient_id'))
+    except ValueError:
+        raise RowError("patient_id doit être un entier.")
+    study_date = _optional(row, 'study_date')
+    if study_date is None:
+        study_date = datetime.now().replace(microsecond=0)
+    else:
+        try:
+            study_date = datetime.fromisoformat(str(study_date))
+        except ValueError:
+            raise RowError(f"Date d'étude invalide: {study_date} (attendu ISO 8601).")
+    return (patient_id, study_date, _required(row, 'study_description', 255), _required(row, 'modality', 50))
+
+
+class ImportReport:
+    """Compteurs et erreurs par ligne d'un import, dans la limite de `max_errors` détails."""
+
+    def __init__(self, max_errors):
+        self.max_errors = max_errors
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+        self.started_at = time.monotonic()
+
+    def error(self, line, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        duration = time.monotonic() - self.started_at
+        return {
+            'received': self.received,
+            'inserted': self.inserted,
+            'failed': self.failed,
+            'errors': sorted(self.errors, key=lambda e: e['line']),
+            'errors_truncated': self.failed > len(self.errors),
+            'duration_s': round(duration, 3),
+            'rows_per_sec': round(self.inserted / duration, 1) if duration else None,
+        }
+
+
+class _Importer:
+    """
+    Valide les lignes et les insère par lots, chaque lot dans sa propre
+    transaction (une par shard concerné).
+    """
+
+    table = None
+    insert_sql = None
+
+    def __init__(self, chunk_size, report, progress=None):
+        self.chunk_size = chunk_size
+        self.report = report
+        self.progress = progress
+
+    def validate(self, row):
+        raise NotImplementedError
+
+    def partition(self, chunk):
+        """Répartit un lot par shard ({indice: lignes})."""
+        raise NotImplementedError
+
+    def filter_chunk(self, cursor, chunk):
+        """Point d'extension pour écarter des lignes valides mais inapplicables (références...)."""
+        return chunk
+
+    def after_insert(self, cursor, chunk):
+        """Exécuté dans la transaction du lot, après l'insertion."""
+        versioning.touch(cursor, self.table)
+        changes.record_bulk(cursor, self.table)
+
+    def run(self, rows):
+        chunk = []
+        for line, row in rows:
+            self.report.received += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                chunk.append((line, self.validate(row)))
+            except RowError as e:
+                self.report.error(line, str(e))
+            if len(chunk) >= self.chunk_size:
+                self.flush(chunk)
+                chunk = []
+        if chunk:
+            self.flush(chunk)
+        return self.report
+
+    def flush(self, chunk):
+        for index, part in self.partition(chunk).items():
+            db = get_shard(index)
+            try:
+                with db.cursor() as cursor:
+                    part = self.filter_chunk(cursor, part)
+                    if part:
+                        # PyMySQL réécrit executemany en un INSERT multi-lignes
+                        cursor.executemany(self.insert_sql, [values for _, values in part])
+                        self.after_insert(cursor, part)
+                db.commit()
+                self.report.inserted += len(part)
+            except pymysql.MySQLError as e:
+                db.rollback()
+                for line, _ in part:
+                    self.report.error(line, f"Lot rejeté par la base: {e}")
+        if self.progress is not None:
+            self.progress(self.report)
+
+
+class PatientImporter(_Importer):
+    table = 'patients'
+    insert_sql = "INSERT INTO patients (lastname, firstname, birthdate, gender) VALUES (%s, %s, %s, %s)"
+
+    def validate(self, row):
+        return validate_patient(row)
+
+    def partition(self, chunk):
+        # Les ids sont attribués par le shard : tout le lot va au suivant, à tour de rôle
+        return {next_shard(): chunk}
+
+
+class StudyImporter(_Importer):
+    table = 'studies'
+    insert_sql = "INSERT INTO studies (patient_id, study_date, study_description, modality) VALUES (%s, %s, %s, %s)"
+
+    def validate(self, row):
+        return validate_study(row)
+
+    def partition(self, chunk):
+        # Chaque étude rejoint le shard de son patient
+        parts = {}
+        for line, values in chunk:
+            parts.setdefault(shard_of(values[0]), []).append((line, values))
+        return parts
+
+    def filter_chunk(self, cursor, chunk):
+        # Une seule requête IN (...) par lot pour résoudre les patients référencés
+        patient_ids = sorted({values[0] for _, values in chunk})
+        placeholders = ', '.join(['%s'] * len(patient_ids))
+        cursor.execute(f"SELECT id, gender, birthdate FROM patients WHERE id IN ({placeholders})", patient_ids)
+        known = {row['id']: row for row in cursor.fetchall()}
+        self.patients = known
+        kept = []
+        for line, values in chunk:
+            if values[0] in known:
+                kept.append((line, values))
+            else:
+                self.report.error(line, f"Patient non trouvé: {values[0]}.")
+        return kept
+
+    def after_insert(self, cursor, chunk):
+        super().after_insert(cursor, chunk)
+        # Patients déjà lus par filter_chunk : les statistiques se calculent sans relire les études
+        study_stats.add_rows(cursor, ((study_date, modality, self.patients[patient_id]['gender'],
+                                       self.patients[patient_id]['birthdate'])
+                                      for patient_id, study_date, _, modality in (values for _, values in chunk)))
+
+
+IMPORTERS = {
+    'patients': PatientImporter,
+    'studies': StudyImporter,
+}
+
+
+def import_rows(kind, rows, chunk_size=None, progress=None):
+    """
+    Importe un flux de lignes `(numéro, dict)` et renvoie le rapport.
+    `progress(report)` est appelé après chaque lot.
+    """
+    config = current_app.config
+    chunk_size = max(1, min(chunk_size or config['IMPORT_CHUNK_SIZE'], config['IMPORT_MAX_CHUNK_SIZE']))
+    report = ImportReport(config['IMPORT_MAX_ERRORS'])
+    IMPORTERS[kind](chunk_size, report, progress).run(rows)
+    current_app.logger.info("Import %s: %s lignes insérées, %s rejetées, %s lignes/s",
+                            kind, report.inserted, report.failed, report.as_dict()['rows_per_sec'])
+    return report
+
+
+# --- Export ---
+
+EXPORT_PATIENTS_SQL = "SELECT * FROM patients p {where} ORDER BY p.id"
+
+EXPORT_PATIENTS_STUDIES_SQL = """
+    SELECT p.id AS patient_id, p.lastname, p.firstname, p.birthdate, p.gender,
+           s.id AS study_id, s.study_date, s.study_description, s.modality
+    FROM patients p
+    LEFT JOIN studies s ON s.patient_id = p.id
+    {where}
+    ORDER BY p.id, s.id
+"""
+
+# Avec l'archive (archive=1) : second flux, fusionné au premier par patient puis par étude
+EXPORT_ARCHIVED_STUDIES_SQL = """
+    SELECT p.id AS patient_id, p.lastname, p.firstname, p.birthdate, p.gender,
+           s.id AS study_id, s.study_date, s.study_description, s.modality
+    FROM patients p
+    JOIN studies_archive s ON s.patient_id = p.id
+    {where}
+    ORDER BY p.id, s.id
+"""
+
+# La ligne sans étude du LEFT JOIN n'est gardée que pour un patient sans étude archivée non plus
+NO_ARCHIVED_STUDY = "(s.id IS NOT NULL OR NOT EXISTS (SELECT 1 FROM studies_archive a WHERE a.patient_id = p.id))"
+
+PATIENT_COLUMNS = ('lastname', 'firstname', 'birthdate', 'gender')
+STUDY_COLUMNS = ('study_date', 'study_description', 'modality')
+
+
+def export_filters(since_id=None, until_id=None, updated_since=None, include_studies=False,
+                   include_archive=False):
+    """
+    Conditions des exports incrémentaux : patients d'id dans ]since_id, until_id]
+    et/ou modifiés (eux ou, avec leurs études, l'une d'elles, archivées comprises
+    avec `include_archive`) depuis `updated_since`.
+    """
+    conditions, params = [], []
+    if since_id is not None:
+        conditions.append("p.id > %s")
+        params.append(since_id)
+    if until_id is not None:
+        conditions.append("p.id <= %s")
+        params.append(until_id)
+    if updated_since is not None:
+        if include_studies:
+            tables = archive.study_tables(include_archive)
+            studies = " OR ".join(f"EXISTS (SELECT 1 FROM {table} s2 WHERE s2.patient_id = p.id "
+                                  f"AND s2.updated_at >= %s)" for table in tables)
+            conditions.append(f"(p.updated_at >= %s OR {studies})")
+            params.extend([updated_since] * (len(tables) + 1))
+        else:
+            conditions.append("p.updated_at >= %s")
+            params.append(updated_since)
+    return conditions, params
+
+
+def _where(conditions):
+    return ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+
+def export_rows(include_studies=False, since_id=None, until_id=None, updated_since=None, size=500,
+                include_archive=False):
+    """
+    Ouvre un curseur serveur par shard sur les lignes à exporter, fusionnées
+    par id de patient (voir `db.merged_query`). Avec `include_archive`, les
+    études archivées sont lues dans un second flux par shard.
+    """
+    conditions, params = export_filters(since_id, until_id, updated_since, include_studies, include_archive)
+    if not include_studies:
+        return merged_query(EXPORT_PATIENTS_SQL.format(where=_where(conditions)), params,
+                            key=lambda row: row['id'], size=size)
+    if include_archive:
+        sql = [EXPORT_PATIENTS_STUDIES_SQL.format(where=_where(conditions + [NO_ARCHIVED_STUDY])),
+               EXPORT_ARCHIVED_STUDIES_SQL.format(where=_where(conditions))]
+    else:
+        sql = EXPORT_PATIENTS_STUDIES_SQL.format(where=_where(conditions))
+    return merged_query(sql, params, key=lambda row: (row['patient_id'], row['study_id'] or 0), size=size)
+
+
+def nest_studies(rows):
+    """
+    Regroupe les lignes patient × étude (triées par patient) en un objet par patient
+    portant la liste de ses études. Un seul patient est en mémoire à la fois.
+    """
+    current = None
+    for row in rows:
+        if current is None or current['id'] != row['patient_id']:
+            if current is not None:
+                yield current
+            current = {'id': row['patient_id'], **{c: row[c] for c in PATIENT_COLUMNS}, 'studies': []}
+        if row['study_id'] is not None:
+            current['studies'].append({'id': row['study_id'], **{c: row[c] for c in STUDY_COLUMNS}})
+    if current is not None:
+        yield current
+
+
+def _csv_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def encode_rows(rows, fmt, dumps, chunk_size=500):
+    """Sérialise les lignes en NDJSON ou CSV, par paquets de `chunk_size` lignes."""
+    buffer = io.StringIO()
+    writer = None
+    count = 0
+    for row in rows:
+        if fmt == 'csv':
+            if writer is None:
+                writer = csv.writer(buffer)
+                writer.writerow(row.keys())
+            writer.writerow([_csv_value(v) for v in row.values()])
+        else:
+            buffer.write(dumps(row))
+            buffer.write('\n')
+        count += 1
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compresse à la volée un itérable de chaînes en un flux gzip."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@click.command('export')
+@click.option('--include-studies', is_flag=True, help="Joindre les études de chaque patient.")
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--since-id', type=int, help="N'exporter que les patients d'id strictement supérieur.")
+@click.option('--until-id', type=int, help="N'exporter que les patients d'id inférieur ou égal.")
+@click.option('--updated-since', type=click.DateTime(), help="N'exporter que les patients modifiés depuis cette date.")
+@click.option('--archive', 'include_archive', is_flag=True, help="Inclure les études archivées (avec --include-studies).")
+@click.option('--gzip', 'compress', is_flag=True, help="Compresser la sortie en gzip.")
+@click.option('--output', '-o', type=click.Path(dir_okay=False), help="Fichier de sortie (stdout par défaut).")
+def export_command(include_studies, fmt, since_id, until_id, updated_since, include_archive, compress, output):
+    """Exporter les patients (et leurs études) en NDJSON ou CSV."""
+    rows = export_rows(include_studies, since_id, until_id, updated_since,
+                       size=current_app.config['STREAM_CHUNK_SIZE'], include_archive=include_archive)
+    try:
+        if include_studies and fmt == 'ndjson':
+            rows_out = nest_studies(rows)
+        else:
+            rows_out = rows
+        chunks = encode_rows(rows_out, fmt, current_app.json.dumps, current_app.config['STREAM_CHUNK_SIZE'])
+        if compress:
+            out = open(output, 'wb') if output else click.get_binary_stream('stdout')
+            for data in gzip_chunks(chunks):
+                out.write(data)
+        else:
+            out = open(output, 'w', encoding='utf-8') if output else click.get_text_stream('stdout')
+            for chunk in chunks:
+                out.write(chunk)
+        if output:
+            out.close()
+    finally:
+        rows.close()
@@ -0,0 +1,441 @@
+# Flux des modifications : les écritures de patients et d'études ajoutent une ligne à
+# `change_log` dans leur transaction ; un seul thread par processus lit le journal et
+# diffuse les lignes modifiées aux clients abonnés en Server-Sent Events (/api/changes).
+# Un abonné n'occupe ni connexion MariaDB ni requête SQL : il attend sur une condition.
+# Avec des shards, chacun a son journal et le jeton de reprise une position par shard.
+
+import os
+import threading
+import time
+from collections import deque
+from datetime import date
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import shards
+from db import get_shard, shard_count
+
+TABLES = ('patients', 'studies')
+
+# Contenu des événements, relu une fois par cycle pour tous les abonnés
+PAYLOAD_SQL = {
+    'patients': "SELECT id, lastname, firstname, birthdate, gender, version FROM patients WHERE id IN ({})",
+    'studies': "SELECT s.id, s.patient_id, s.study_date, s.study_description, s.modality, s.version, "
+               "p.lastname, p.firstname FROM studies s JOIN patients p ON p.id = s.patient_id WHERE s.id IN ({})",
+}
+
+# Sans abonné depuis ce délai (secondes), le thread de lecture s'arrête
+IDLE_GRACE = 30
+
+
+def record(cursor, table, ids, op='update'):
+    """
+    Journalise les lignes modifiées. À appeler dans la transaction de
+    l'écriture, comme versioning.touch, pour que le journal suive le commit.
+    """
+    if ids:
+        cursor.executemany("INSERT INTO change_log (table_name, row_id, op) VALUES (%s, %s, %s)",
+                           [(table, row_id, op) for row_id in ids])
+
+
+def record_bulk(cursor, table):
+    """Un import en masse n'est journalisé qu'une fois par lot : les clients rechargent la table."""
+    cursor.execute("INSERT INTO change_log (table_name, row_id, op) VALUES (%s, NULL, 'bulk')", (table,))
+
+
+class FeedFull(Exception):
+    """Nombre maximal d'abonnés atteint dans ce processus."""
+
+
+class Event:
+    """Modification publiée, déjà mise en forme : le message est partagé par tous les abonnés."""
+
+    __slots__ = ('seq', 'shard', 'change_id', 'table', 'message')
+
+    def __init__(self, seq, shard, change_id, table, message):
+        self.seq = seq
+        self.shard = shard
+        self.change_id = change_id
+        self.table = table
+        self.message = message
+
+
+def format_token(positions):
+    """Jeton de reprise : la position dans le journal, ou celles de chaque shard séparées par des points."""
+    return positions[0] if len(positions) == 1 else '.'.join(str(p) for p in positions)
+
+
+def parse_token(token):
+    """Positions d'un jeton de reprise (tuple) ; lève ValueError s'il est invalide."""
+    parts = str(token).split('.')
+    if not all(part.isdigit() for part in parts):
+        raise ValueError(f"Jeton de reprise invalide: {token}.")
+    return tuple(int(part) for part in parts)
+
+
+def format_event(event, data, token=None):
+    """Message SSE ; `id` porte le jeton de reprise renvoyé par le navigateur en Last-Event-ID."""
+    head = f"id: {token}\n" if token is not None else ''
+    return f"{head}event: {event}\ndata: {data}\n\n"
+
+
+def iso_dates(row):
+    """
+    Dates d'une ligne en ISO 8601 : les fournisseurs JSON de l'application
+    émettent des dates HTTP, que le tableau de bord devrait convertir pour les
+    afficher comme les lignes rendues par le serveur.
+    """
+    return {key: value.isoformat() if isinstance(value, date) else value for key, value in row.items()}
+
+
+class ChangeFeed:
+    """
+    Diffusion des entrées de `change_log` aux abonnés de ce processus.
+
+    Toutes les `poll_interval` secondes, tant qu'il y a des abonnés, un thread
+    lit les nouvelles entrées (une requête sur la clé primaire), relit les
+    lignes concernées (une requête par table) et publie les événements dans un
+    tampon circulaire de `buffer_size` événements ; les abonnés sont réveillés
+    ensemble. Le coût en base ne dépend donc pas du nombre d'abonnés.
+
+    Les identifiants du journal sont attribués à l'insertion mais visibles au
+    commit : une entrée peut apparaître après une entrée plus récente. Le jeton
+    de reprise est donc un filigrane (`position`, un par shard) sous lequel
+    toutes les entrées ont été publiées ; un trou est abandonné (transaction
+    annulée) après `gap_timeout` secondes. Sur un shard, les ids du journal
+    avancent du nombre de shards (voir shards.py). Reprendre à ce jeton peut rejouer quelques
+    événements, jamais en perdre ; les événements portent l'état courant de la
+    ligne et peuvent être appliqués plusieurs fois.
+    """
+
+    def __init__(self, app, poll_interval=1.0, batch_size=500, buffer_size=10000, gap_timeout=10,
+                 max_subscribers=1000):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.gap_timeout = gap_timeout
+        self.max_subscribers = max_subscribers
+        self.pid = os.getpid()
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._thread = None
+        self._idle_since = None
+        self._stopped = False
+        self.count = 1
+        # Filigranes par shard : toutes les entrées <= position ont été publiées (ou abandonnées)
+        self.positions = None
+        # Plus anciennes positions de reprise servies depuis le tampon
+        self.floors = None
+        self._seen = []
+        self._missing = []
+        self.subscribers = 0
+        self.polls = 0
+        self.published = 0
+        self.gaps_skipped = 0
+        self.rejected = 0
+        self.errors = 0
+        self.last_poll = None
+
+    @property
+    def position(self):
+        """Jeton de reprise correspondant aux événements publiés."""
+        return format_token(self.positions) if self.positions is not None else None
+
+    # --- Abonnements ---
+
+    def subscribe(self, resume=None, tables=TABLES):
+        """
+        Inscrit un abonné et renvoie son flux (`resume` : positions d'un jeton
+        de reprise). Démarre la lecture du journal si nécessaire (dans le
+        contexte de la requête). Lève FeedFull au-delà de `max_subscribers`.
+        """
+        with self._cond:
+            if self.subscribers >= self.max_subscribers:
+                self.rejected += 1
+                raise FeedFull()
+            if self._thread is None:
+                self._start(resume)
+            self.subscribers += 1
+            self._idle_since = None
+            if resume is None:
+                return Subscription(self, self._seq, tuple(self.positions), tables)
+            if len(resume) != self.count or any(r < floor for r, floor in zip(resume, self.floors)):
+                # Jeton trop ancien, ou d'un autre nombre de shards
+                return Subscription(self, self._seq, tuple(self.positions), tables, reset=True)
+            return Subscription(self, self._events[0].seq - 1 if self._events else self._seq, resume, tables)
+
+    def _unsubscribe(self):
+        with self._cond:
+            self.subscribers -= 1
+            if not self.subscribers:
+                self._idle_since = time.monotonic()
+
+    def _start(self, resume):
+        """Reprend au jeton demandé sur chaque shard où il est assez récent, sinon à la fin du journal."""
+        latest = latest_positions()
+        self.count = len(latest)
+        if resume is None or len(resume) != self.count:
+            resume = latest
+        start = [r if top - self.buffer_size <= r < top else top for r, top in zip(resume, latest)]
+        self.positions, self.floors = start, list(start)
+        self._events.clear()
+        self._seen = [set() for _ in start]
+        self._missing = [{} for _ in start]
+        self._stopped = False
+        self._thread = threading.Thread(target=self._loop, name='change-feed', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Arrête la lecture et termine les flux en cours (arrêt du worker)."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    # --- Lecture du journal ---
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                idle = self._idle_since is not None and time.monotonic() - self._idle_since >= IDLE_GRACE
+                if self._stopped or idle:
+                    self._thread = None
+                    return
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception:
+                self.errors += 1
+                self.app.logger.exception("Échec de la lecture du journal des modifications")
+            time.sleep(self.poll_interval)
+
+    def poll(self):
+        """Un cycle : nouvelles entrées du journal de chaque shard, lignes concernées, publication."""
+        entries, rows = [], {}
+        for index in range(self.count):
+            # Une ligne et son entrée du journal sont sur le même shard
+            with get_shard(index).cursor() as cursor:
+                cursor.execute("SELECT id, table_name, row_id, op FROM change_log WHERE id > %s ORDER BY id LIMIT %s",
+                               (self.positions[index], self.batch_size))
+                shard_entries = [entry for entry in cursor.fetchall() if entry['id'] not in self._seen[index]]
+                rows.update(self._rows(cursor, shard_entries))
+            self._advance(index, [entry['id'] for entry in shard_entries], time.monotonic())
+            entries.extend((index, entry) for entry in shard_entries)
+        self.polls += 1
+        self.last_poll = time.time()
+        if not entries:
+            return
+
+        dumps = self.app.json.dumps
+        token = self.position
+        with self._cond:
+            for index, entry in entries:
+                self._seq += 1
+                table, row_id = entry['table_name'], entry['row_id']
+                data = dumps({'change': entry['id'], 'op': entry['op'], 'id': row_id,
+                              'row': rows.get((table, row_id))})
+                message = format_event(table, data, token)
+                if len(self._events) == self._events.maxlen:
+                    oldest = self._events[0]
+                    self.floors[oldest.shard] = max(self.floors[oldest.shard], oldest.change_id)
+                self._events.append(Event(self._seq, index, entry['id'], table, message))
+            self.published += len(entries)
+            self._cond.notify_all()
+
+    @staticmethod
+    def _rows(cursor, entries):
+        """État courant des lignes modifiées ; absentes du résultat si supprimées."""
+        rows = {}
+        for table, sql in PAYLOAD_SQL.items():
+            ids = sorted({e['row_id'] for e in entries if e['table_name'] == table and e['row_id'] is not None})
+            if ids:
+                cursor.execute(sql.format(', '.join(['%s'] * len(ids))), ids)
+                rows.update(((table, row['id']), iso_dates(row)) for row in cursor.fetchall())
+        return rows
+
+    def _advance(self, index, ids, now):
+        """
+        Avance le filigrane du shard sur les entrées contiguës publiées, et les
+        trous trop anciens. Les ids d'un shard se suivent de `count` en `count`.
+        """
+        seen, missing = self._seen[index], self._missing[index]
+        seen.update(ids)
+        position = self.positions[index]
+        top = max(seen, default=position)
+        for change_id in range(shards.next_id(position, index, self.count), top, self.count):
+            if change_id not in seen:
+                missing.setdefault(change_id, now)
+        while True:
+            change_id = shards.next_id(position, index, self.count)
+            if change_id > top:
+                break
+            if change_id in seen:
+                seen.discard(change_id)
+            elif now - missing[change_id] >= self.gap_timeout:
+                self.gaps_skipped += 1
+            else:
+                break
+            missing.pop(change_id, None)
+            position = change_id
+        self.positions[index] = position
+        # Entrées hors de la suite du shard (écrites sans le réglage d'auto-incrément)
+        seen.difference_update([change_id for change_id in seen if change_id <= position])
+
+    def _since(self, seq):
+        """Événements publiés après `seq`, ou None si l'abonné a été distancé par le tampon."""
+        if not self._events or seq >= self._events[-1].seq:
+            return []
+        oldest = self._events[0].seq
+        if seq + 1 < oldest:
+            return None
+        return list(islice(self._events, seq + 1 - oldest, None))
+
+    def stats(self):
+        with self._cond:
+            return {
+                'running': self._thread is not None,
+                'subscribers': self.subscribers,
+                'max_subscribers': self.max_subscribers,
+                'position': self.position,
+                'floor': format_token(self.floors) if self.floors is not None else None,
+                'buffered': len(self._events),
+                'pending_gaps': sum(len(missing) for missing in self._missing),
+                'polls': self.polls,
+                'published': self.published,
+                'gaps_skipped': self.gaps_skipped,
+                'rejected': self.rejected,
+                'errors': self.errors,
+                'last_poll': self.last_poll,
+            }
+
+
+class Subscription:
+    """Flux SSE d'un abonné : événements des tables demandées postérieurs à son jeton."""
+
+    def __init__(self, feed, seq, after, tables, reset=False):
+        # `after` : positions par shard au-delà desquelles les événements sont envoyés
+        self.feed = feed
+        self.seq = seq
+        self.after = after
+        self.tables = tables
+        self.reset = reset
+
+    def stream(self, keepalive=15, max_duration=300, retry=3000):
+        """
+        Générateur des messages. Sans événement, un commentaire part toutes les
+        `keepalive` secondes (il détecte aussi les clients partis) ; après
+        `max_duration` secondes le flux se termine et le navigateur se
+        reconnecte avec son Last-Event-ID, ce qui libère régulièrement le worker.
+        """
+        feed = self.feed
+        deadline = time.monotonic() + max_duration
+        try:
+            after = format_token(self.after)
+            yield f"retry: {retry}\n" + format_event('ready', feed.app.json.dumps({'position': feed.position}), after)
+            if self.reset:
+                yield format_event('reset', '{"reason": "resume_too_old"}')
+                return
+            while True:
+                with feed._cond:
+                    if feed._seq == self.seq and not feed._stopped:
+                        feed._cond.wait(max(0, min(keepalive, deadline - time.monotonic())))
+                    if feed._stopped:
+                        return
+                    events = feed._since(self.seq)
+                    self.seq = feed._seq
+                    position = feed.position
+                if events is None:
+                    yield format_event('reset', '{"reason": "too_slow"}')
+                    return
+                chunk = ''.join(e.message for e in events
+                                if e.table in self.tables and e.change_id > self.after[e.shard])
+                yield chunk or f": keepalive\nid: {position}\n\n"
+                if time.monotonic() >= deadline:
+                    return
+        finally:
+            feed._unsubscribe()
+
+
+def subscriber_limit(limit, worker_class, threads):
+    """
+    Abonnés admis par worker selon la classe de workers gunicorn. Avec gevent,
+    un abonné ne coûte qu'une greenlet ; avec gthread, il garde un thread du
+    worker pendant tout le flux : la moitié des threads au plus, pour que les
+    autres requêtes soient toujours servies ; aucun avec des workers sync.
+    """
+    if worker_class == 'gevent':
+        return limit
+    if worker_class == 'sync':
+        return 0
+    return min(limit, threads // 2)
+
+
+def create_feed(app):
+    config = app.config
+    return ChangeFeed(app, poll_interval=config['CHANGES_POLL_INTERVAL'], batch_size=config['CHANGES_BATCH_SIZE'],
+                      buffer_size=config['CHANGES_BUFFER'], gap_timeout=config['CHANGES_GAP_TIMEOUT'],
+                      max_subscribers=config['CHANGES_MAX_SUBSCRIBERS'])
+
+
+_feed = None
+_feed_lock = threading.Lock()
+
+
+def get_feed():
+    """Flux de ce processus, créé une fois par pid (après le fork de Gunicorn)."""
+    global _feed
+    if _feed is not None and _feed.pid == os.getpid():
+        return _feed
+    with _feed_lock:
+        if _feed is None or _feed.pid != os.getpid():
+            _feed = create_feed(current_app._get_current_object())
+    return _feed
+
+
+def current_feed():
+    if _feed is not None and _feed.pid == os.getpid():
+        return _feed
+    return None
+
+
+def latest_positions():
+    """Dernier id du journal de chaque shard."""
+    positions = []
+    for index in range(shard_count()):
+        with get_shard(index).cursor() as cursor:
+            cursor.execute("SELECT COALESCE(MAX(id), 0) AS id FROM change_log")
+            positions.append(cursor.fetchone()['id'])
+    return positions
+
+
+def position():
+    """Jeton de reprise correspondant à l'état actuel, pour une page qui s'abonnera ensuite."""
+    feed = current_feed()
+    if feed is not None and feed.position is not None:
+        return feed.position
+    return format_token(latest_positions())
+
+
+changes_cli = AppGroup('changes', help="Journal des modifications.")
+
+
+@changes_cli.command('purge')
+@click.option('--days', type=int, default=7, show_default=True, help="Âge minimal des entrées supprimées.")
+def purge_command(days):
+    """Supprimer les entrées du journal de plus de `days` jours, par lots, sur chaque shard."""
+    deleted = 0
+    for index in range(shard_count()):
+        db = get_shard(index)
+        while True:
+            with db.cursor() as cursor:
+                count = cursor.execute("DELETE FROM change_log WHERE created_at < NOW() - INTERVAL %s DAY LIMIT 10000",
+                                       (days,))
+            db.commit()
+            deleted += count
+            if count < 10000:
+                break
+    click.echo(f"{deleted} entrée(s) supprimée(s).")
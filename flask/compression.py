@@ -0,0 +1,138 @@
+import zlib
+
+from flask import current_app, request
+from werkzeug.wsgi import ClosingIterator
+
+import versioning
+
+# Dépendances optionnelles : brotli (br) et zstandard (zstd)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/html', 'text/csv', 'text/plain')
+
+# Niveaux par défaut choisis pour le débit plutôt que pour le meilleur taux
+
+
+class GzipCompressor:
+    def __init__(self, level=6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    def __init__(self, quality=4):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class ZstdCompressor:
+    def __init__(self, level=3):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+# Par ordre de préférence du serveur à qualité égale dans Accept-Encoding
+ENCODINGS = {
+    'zstd': ZstdCompressor if zstandard else None,
+    'br': BrotliCompressor if brotli else None,
+    'gzip': GzipCompressor,
+}
+
+
+def available_encodings(preferred):
+    """Encodages de `preferred` (ordre de préférence du serveur) dont le module est installé."""
+    return [name for name in preferred if ENCODINGS.get(name) is not None]
+
+
+def compress_stream(chunks, compressor):
+    """
+    Compresse un flux morceau par morceau, en vidant le compresseur après
+    chaque morceau : le client reçoit les lignes au fil de l'eau.
+    """
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk) + compressor.flush()
+        if data:
+            yield data
+    yield compressor.finish()
+
+
+def compress_response(response):
+    """
+    Compresse la réponse selon Accept-Encoding (zstd, br puis gzip, selon la
+    configuration et les modules installés) si son type s'y prête. Les corps
+    en mémoire ne le sont qu'au-delà de COMPRESSION_MIN_SIZE ; les réponses en
+    flux (json_stream, tableau de bord) le sont toujours, morceau par morceau.
+    Un ETag fort est suffixé de l'encodage : les octets envoyés diffèrent de
+    ceux de la représentation non compressée.
+    """
+    if (response.status_code < 200 or response.status_code in (204, 206, 304) or request.method == 'HEAD'
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough
+            or 'Content-Encoding' in response.headers or 'no-transform' in response.headers.get('Cache-Control', '')):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encodings = current_app.extensions['compression_encodings']
+    encoding = request.accept_encodings.best_match(encodings)
+    if encoding is None:
+        return response
+
+    compressor = ENCODINGS[encoding]()
+    if response.is_streamed:
+        body = response.response
+        close = getattr(body, 'close', None)
+        response.response = ClosingIterator(compress_stream(body, compressor), [close] if close else None)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < current_app.config['COMPRESSION_MIN_SIZE']:
+            return response
+        response.set_data(compressor.compress(data) + compressor.finish())
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(versioning.encoded_etag(etag, encoding))
+    return response
+
+
+def init_app(app):
+    """Active la compression des réponses si COMPRESSION_ENCODINGS n'est pas vide."""
+    preferred = [name.strip() for name in app.config['COMPRESSION_ENCODINGS'].split(',') if name.strip()]
+    unknown = [name for name in preferred if name not in ENCODINGS]
+    if unknown:
+        raise ValueError(f"Encodage(s) de compression inconnu(s): {', '.join(unknown)}.")
+    app.extensions['compression_encodings'] = available_encodings(preferred)
+    if app.extensions['compression_encodings']:
+        app.after_request(compress_response)
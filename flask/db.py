@@ -1,27 +1,325 @@
+import itertools
+import time
+from functools import wraps
 import pymysql
-from flask import g, current_app
+from flask import g, current_app, has_request_context, request
+from pool import ConnectionPool
+from replicas import Replica, ReplicaSet
+from instrumentation import InstrumentedDictCursor, InstrumentedSSDictCursor, current_queries
+import shards
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Cookie posé après une écriture : les lectures du client restent sur le primaire jusqu'à l'échéance
+PRIMARY_COOKIE = 'db_primary_until'
+
+def create_pool(app, host=None, port=3306, database=None, shard=0):
+    """Construit le pool de connexions à partir de la configuration de l'application."""
+    connect_kwargs = dict(
+        host=host or app.config['DB_HOST'],
+        port=port,
+        user=app.config['DB_USER'],
+        password=app.config['DB_PASSWORD'],
+        database=database or app.config['DB_NAME'],
+        cursorclass=InstrumentedDictCursor
+    )
+    count = 1 + len(shards.parse_shards(app.config['DB_SHARDS']))
+    if count > 1:
+        # Ids globalement uniques : chaque shard n'attribue que ceux de sa classe modulo `count`
+        connect_kwargs['init_command'] = shards.init_command(shard, count)
+    return ConnectionPool(
+        connect_kwargs=connect_kwargs,
+        min_size=app.config['DB_POOL_MIN_SIZE'],
+        max_size=app.config['DB_POOL_MAX_SIZE'],
+        timeout=app.config['DB_POOL_TIMEOUT'],
+        recycle=app.config['DB_POOL_RECYCLE'],
+        ping_interval=app.config['DB_POOL_PING_INTERVAL'],
+    )
+
+def create_replicas(app):
+    """Répliques en lecture de DB_REPLICAS (« hôte[:port],... »), ou None."""
+    replicas = []
+    for address in filter(None, (a.strip() for a in app.config['DB_REPLICAS'].split(','))):
+        host, _, port = address.partition(':')
+        replicas.append(Replica(address, create_pool(app, host, int(port or 3306))))
+    if not replicas:
+        return None
+    return ReplicaSet(replicas, strategy=app.config['DB_REPLICA_STRATEGY'], max_lag=app.config['DB_REPLICA_MAX_LAG'],
+                      check_interval=app.config['DB_REPLICA_CHECK_INTERVAL'],
+                      acquire_timeout=app.config['DB_REPLICA_ACQUIRE_TIMEOUT'])
+
+def create_shards(app):
+    """Pools des shards supplémentaires de DB_SHARDS ; le shard 0 est la base principale."""
+    return [create_pool(app, host, port, database, shard=index)
+            for index, (host, port, database) in enumerate(shards.parse_shards(app.config['DB_SHARDS']), start=1)]
+
+def get_pool():
+    """Returns the connection pool of the current application."""
+    return current_app.extensions['db_pool']
+
+def read_only(f):
+    """
+    Marque une route de lecture pouvant être servie par une réplique : toutes
+    ses requêtes (get_db, stream_query, y compris la sonde ETag) y sont envoyées.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method in SAFE_METHODS:
+            g.read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+def _wants_primary():
+    """Lecture de ses propres écritures : cookie posé par une écriture récente, ou demande explicite."""
+    if request.headers.get('X-Read-From') == 'primary':
+        return True
+    until = request.cookies.get(PRIMARY_COOKIE, '')
+    return until.isdigit() and int(until) > time.time()
+
+def _acquire():
+    """(pool, connexion) pour le contexte courant : une réplique pour les routes read_only, sinon le primaire."""
+    replicas = current_app.extensions.get('db_replicas')
+    if replicas is not None and g.get('read_only') and has_request_context() and not _wants_primary():
+        acquired = replicas.acquire()
+        if acquired is not None:
+            replica, conn = acquired
+            g.db_route = replica.name
+            return replica.pool, conn
+    g.db_route = 'primary'
+    pool = get_pool()
+    return pool, pool.acquire()
 
 def get_db():
     """
-    Opens a new database connection if there is none yet for the
+    Borrows a connection from the pool if there is none yet for the
     current application context.
     """
     if 'db' not in g:
-        g.db = pymysql.connect(
-            host=current_app.config['DB_HOST'],
-            user=current_app.config['DB_USER'],
-            password=current_app.config['DB_PASSWORD'],
-            database=current_app.config['DB_NAME'],
-            cursorclass=pymysql.cursors.DictCursor
-        )
+        start = time.perf_counter()
+        g.db_pool, g.db = _acquire()
+        current_queries().pool_wait += time.perf_counter() - start
     return g.db
 
+def shard_count():
+    """Nombre de shards de patients (1 sans DB_SHARDS)."""
+    return 1 + len(current_app.extensions['db_shards'])
+
+def get_shard(index):
+    """
+    Connexion au shard `index` pour le contexte courant : get_db() pour le
+    shard 0 (base principale, répliques comprises), sinon une connexion du
+    pool du shard, rendue comme elle à la fin du contexte.
+    """
+    if index == 0:
+        return get_db()
+    dbs = g.setdefault('shard_dbs', {})
+    if index not in dbs:
+        start = time.perf_counter()
+        dbs[index] = current_app.extensions['db_shards'][index - 1].acquire()
+        current_queries().pool_wait += time.perf_counter() - start
+    return dbs[index]
+
+def get_primary_shard(index):
+    """
+    Comme get_shard, mais jamais sur une réplique : sous @read_only, le shard 0
+    est lu sur une connexion du pool principal, rendue à la fin du contexte.
+    """
+    if index > 0 or not g.get('read_only'):
+        return get_shard(index)
+    if 'primary_db' not in g:
+        start = time.perf_counter()
+        g.primary_db = get_pool().acquire()
+        current_queries().pool_wait += time.perf_counter() - start
+    return g.primary_db
+
+def shard_of(row_id):
+    """Shard d'un patient, ou d'une étude créée depuis la mise en place des shards."""
+    return shards.shard_of(row_id, shard_count())
+
+_placement = itertools.count()
+
+def next_shard():
+    """Shard d'un nouveau patient : à tour de rôle, dans chaque processus."""
+    return next(_placement) % shard_count()
+
+def locate(table, ids):
+    """
+    Shard de chaque ligne `ids` de `table` ({id: indice}). Les patients sont
+    toujours sur le shard de leur id ; une étude suit son patient et peut en
+    être ailleurs après `flask db rebalance` : elle est cherchée d'abord sur
+    le shard de son id, puis sur les autres. Un id introuvable garde le shard
+    de son id.
+    """
+    count = shard_count()
+    placement = {row_id: shards.shard_of(row_id, count) for row_id in ids}
+    if count == 1 or table == 'patients':
+        return placement
+    missing = set(placement)
+    for attempt in (0, 1):
+        for index in range(count):
+            wanted = sorted(row_id for row_id in missing if (placement[row_id] == index) == (attempt == 0))
+            if not wanted:
+                continue
+            placeholders = ', '.join(['%s'] * len(wanted))
+            with get_shard(index).cursor() as cursor:
+                cursor.execute(f"SELECT id FROM {table} WHERE id IN ({placeholders})", wanted)
+                found = {row['id'] for row in cursor.fetchall()}
+            for row_id in found:
+                placement[row_id] = index
+            missing -= found
+        if not missing or attempt:
+            break
+    return placement
+
+def scatter(sql, params=None):
+    """Exécute `sql` sur chaque shard ; renvoie la liste des lignes de chacun, dans l'ordre des shards."""
+    results = []
+    for index in range(shard_count()):
+        with get_shard(index).cursor() as cursor:
+            cursor.execute(sql, params)
+            results.append(cursor.fetchall())
+    return results
+
+class RowStream:
+    """
+    Iterates over the rows of an unbuffered (server-side) query.
+
+    The connection is detached from the request: teardown runs before a
+    streamed response body is consumed, so the stream itself gives the
+    connection back to the pool once exhausted or closed. A stream closed
+    early discards its connection rather than draining the remaining rows.
+    """
+
+    def __init__(self, pool, db, cursor, size=500):
+        self._pool = pool
+        self._db = db
+        self._cursor = cursor
+        self._size = size
+        self._buffer = []
+        self._exhausted = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._buffer:
+            if self._closed:
+                raise StopIteration
+            try:
+                self._buffer = list(self._cursor.fetchmany(self._size))
+            except Exception:
+                self.close()
+                raise
+            if not self._buffer:
+                self._exhausted = True
+                self.close()
+                raise StopIteration
+            self._buffer.reverse()
+        return self._buffer.pop()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._exhausted:
+            self._cursor.close()
+        self._pool.release(self._db, discard=not self._exhausted)
+
+def stream_query(sql, params=None, size=500, shard=0):
+    """
+    Runs `sql` on a server-side cursor and returns a RowStream over its rows,
+    fetched `size` at a time.
+    """
+    if shard:
+        pool = current_app.extensions['db_shards'][shard - 1]
+        db = g.get('shard_dbs', {}).pop(shard, None) or pool.acquire()
+    elif 'db' in g:
+        pool, db = g.pop('db_pool'), g.pop('db')
+    else:
+        pool, db = _acquire()
+    cursor = db.cursor(InstrumentedSSDictCursor)
+    try:
+        cursor.execute(sql, params)
+    except Exception:
+        pool.release(db, discard=True)
+        raise
+    return RowStream(pool, db, cursor, size)
+
+def merged_query(sql, params=None, key=None, reverse=False, size=500):
+    """
+    stream_query sur tous les shards, fusionnés selon `key` (l'ordre du
+    ORDER BY de `sql`). `sql` peut être une liste de requêtes de mêmes
+    colonnes et paramètres (table chaude et archive), exécutées sur chaque
+    shard. Avec un seul flux, c'est celui de stream_query.
+    """
+    statements = [sql] if isinstance(sql, str) else list(sql)
+    count = shard_count()
+    if count == 1 and len(statements) == 1:
+        return stream_query(statements[0], params, size)
+    streams = []
+    try:
+        for index in range(count):
+            for statement in statements:
+                streams.append(stream_query(statement, params, size, shard=index))
+    except Exception:
+        for stream in streams:
+            stream.close()
+        raise
+    return shards.MergedStream(streams, key, reverse)
+
 def close_db(e=None):
-    """Closes the database again at the end of the request."""
+    """Returns the connection to the pool at the end of the request."""
     db = g.pop('db', None)
+    pool = g.pop('db_pool', None)
     if db is not None:
-        db.close()
+        pool.release(db, discard=isinstance(e, pymysql.OperationalError))
+    primary_db = g.pop('primary_db', None)
+    if primary_db is not None:
+        get_pool().release(primary_db, discard=isinstance(e, pymysql.OperationalError))
+    shard_pools = current_app.extensions['db_shards']
+    for index, conn in g.pop('shard_dbs', {}).items():
+        shard_pools[index - 1].release(conn, discard=isinstance(e, pymysql.OperationalError))
+
+def _route_headers(response):
+    """Avec des répliques : indique le serveur utilisé et retient les écritures du client."""
+    if current_app.extensions.get('db_replicas') is None:
+        return response
+    if 'db_route' in g:
+        response.headers['X-DB-Route'] = g.db_route
+    if request.method not in SAFE_METHODS and response.status_code < 400:
+        window = current_app.config['DB_READ_YOUR_WRITES']
+        response.set_cookie(PRIMARY_COOKIE, str(int(time.time() + window)), max_age=window,
+                            httponly=True, samesite='Lax')
+    return response
+
+def reset_pool(app, fill=True):
+    """
+    Replaces the application's pool with a fresh one. Called in each worker
+    after fork: sockets and locks inherited from the master must not be shared.
+    """
+    old = app.extensions.get('db_pool')
+    app.extensions['db_pool'] = pool = create_pool(app)
+    if old is not None:
+        old.close()
+    old_replicas = app.extensions.get('db_replicas')
+    app.extensions['db_replicas'] = create_replicas(app)
+    if old_replicas is not None:
+        old_replicas.close()
+    old_shards = app.extensions.get('db_shards', [])
+    app.extensions['db_shards'] = create_shards(app)
+    for old_shard in old_shards:
+        old_shard.close()
+    if fill:
+        try:
+            pool.fill()
+        except pymysql.MySQLError as e:
+            app.logger.warning("Pré-remplissage du pool impossible: %s", e)
+    return pool
 
 def init_app(app):
     """Register database functions with the Flask app."""
+    app.extensions['db_pool'] = create_pool(app)
+    app.extensions['db_replicas'] = create_replicas(app)
+    app.extensions['db_shards'] = create_shards(app)
+    app.after_request(_route_headers)
     app.teardown_appcontext(close_db)
@@ -0,0 +1,69 @@
+"""
+Configuration Gunicorn du mode production :
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Toutes les valeurs se règlent par variables d'environnement (WEB_*).
+Rechargement gracieux des workers : `kill -HUP <pid du master>` (les requêtes
+en cours se terminent dans la limite de WEB_GRACEFUL_TIMEOUT). Avec
+WEB_PRELOAD=1, le code est chargé par le master : un déploiement de nouveau
+code nécessite un redémarrage du service plutôt qu'un HUP. WEB_RELOAD=1
+(développement) redémarre les workers à chaque modification du code.
+"""
+import multiprocessing
+import os
+
+worker_class = os.environ.get('WEB_WORKER_CLASS', 'gevent')  # gevent, gthread ou sync
+
+if worker_class == 'gevent':
+    # Doit précéder le préchargement de l'application par le master
+    from gevent import monkey
+    monkey.patch_all()
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))  # gevent uniquement
+
+# Développement : workers redémarrés quand un fichier source change
+reload = os.environ.get('WEB_RELOAD', '0') == '1'
+
+# Chargement de l'application avant le fork : la mémoire est partagée en copie sur écriture.
+# Incompatible avec le rechargement, qui doit relire le code dans chaque nouveau worker
+preload_app = os.environ.get('WEB_PRELOAD', '1') == '1' and not reload
+
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+# Recyclage périodique des workers pour borner une éventuelle dérive mémoire
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('WEB_MAX_REQUESTS_JITTER', 0))
+
+accesslog = os.environ.get('WEB_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """Chaque worker ouvre son propre pool : rien n'est hérité du master."""
+    from db import reset_pool
+    app = worker.app.wsgi()
+    reset_pool(app)
+    server.log.info("Worker %s: pool MariaDB initialisé", worker.pid)
+    # Runner de tâches de fond du worker (si JOBS_RUNNER=web)
+    import jobs
+    jobs.ensure_runner(app)
+
+
+def worker_exit(server, worker):
+    app = worker.app.wsgi()
+    # Tâches en cours remises en file pour un autre worker
+    import jobs
+    jobs.stop_runner()
+    pool = app.extensions.get('db_pool')
+    if pool is not None:
+        pool.close()
+    replicas = app.extensions.get('db_replicas')
+    if replicas is not None:
+        replicas.close()
+    for shard in app.extensions.get('db_shards', []):
+        shard.close()
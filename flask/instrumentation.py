@@ -0,0 +1,178 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+import pymysql
+from flask import current_app, g, has_app_context, request
+
+# Bornes supérieures des histogrammes par endpoint
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_WHITESPACE = re.compile(r'\s+')
+_IN_LIST = re.compile(r'IN \((?:\?(?:, ?)?)+\)', re.IGNORECASE)
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+
+
+def normalize(sql):
+    """
+    Forme canonique d'une requête : paramètres et littéraux remplacés par « ? »,
+    listes IN (...) réduites, espaces compactés. Deux exécutions de la même
+    requête avec des valeurs différentes ont ainsi le même texte.
+    """
+    sql = _STRING.sub('?', sql.replace('%s', '?'))
+    sql = _NUMBER.sub('?', sql)
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    return _IN_LIST.sub('IN (...)', sql)
+
+
+class RequestQueries:
+    """Requêtes exécutées pendant une requête HTTP (ou une commande CLI)."""
+
+    def __init__(self):
+        self.statements = []
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+
+    def record(self, sql, duration, rows):
+        self.statements.append((normalize(sql), duration, rows))
+        self.db_time += duration
+
+    def repeated(self, threshold):
+        """Requêtes répétées plus de `threshold` fois : symptôme classique du N+1."""
+        counts = Counter(statement for statement, _, _ in self.statements)
+        return {statement: n for statement, n in counts.items() if n > threshold}
+
+
+def current_queries():
+    if not has_app_context():
+        return None
+    if 'sql_queries' not in g:
+        g.sql_queries = RequestQueries()
+    return g.sql_queries
+
+
+class _InstrumentedMixin:
+    """Chronomètre chaque execute/executemany et l'enregistre pour la requête HTTP en cours."""
+
+    def _timed(self, method, query, args):
+        start = time.perf_counter()
+        try:
+            return method(query, args)
+        finally:
+            queries = current_queries()
+            if queries is not None:
+                queries.record(query, time.perf_counter() - start, self.rowcount)
+
+    def execute(self, query, args=None):
+        return self._timed(super().execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(super().executemany, query, args)
+
+
+class InstrumentedDictCursor(_InstrumentedMixin, pymysql.cursors.DictCursor):
+    pass
+
+
+class InstrumentedSSDictCursor(_InstrumentedMixin, pymysql.cursors.SSDictCursor):
+    """Curseur serveur : seul l'envoi de la requête est chronométré, pas la lecture du flux."""
+
+
+def _histogram(buckets):
+    return {'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1), 'sum': 0.0}
+
+
+def _observe(histogram, value):
+    histogram['counts'][bisect_left(histogram['buckets'], value)] += 1
+    histogram['sum'] += value
+
+
+class EndpointMetrics:
+    """Agrégats par endpoint : histogrammes du nombre de requêtes SQL et du temps base de données."""
+
+    def __init__(self, top_statements=20):
+        self.top_statements = top_statements
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(self._new_endpoint)
+
+    @staticmethod
+    def _new_endpoint():
+        return {
+            'requests': 0,
+            'n_plus_one': 0,
+            'query_count': _histogram(QUERY_COUNT_BUCKETS),
+            'db_time_ms': _histogram(DB_TIME_BUCKETS_MS),
+            'statements': defaultdict(lambda: {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0}),
+        }
+
+    def observe(self, endpoint, queries, n_plus_one):
+        with self._lock:
+            data = self._endpoints[endpoint]
+            data['requests'] += 1
+            data['n_plus_one'] += bool(n_plus_one)
+            _observe(data['query_count'], len(queries.statements))
+            _observe(data['db_time_ms'], queries.db_time * 1000)
+            for statement, duration, _ in queries.statements:
+                stats = data['statements'][statement]
+                stats['count'] += 1
+                stats['total_ms'] += duration * 1000
+                stats['max_ms'] = max(stats['max_ms'], duration * 1000)
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for endpoint, data in self._endpoints.items():
+                statements = sorted(data['statements'].items(), key=lambda item: item[1]['total_ms'], reverse=True)
+                result[endpoint] = {
+                    'requests': data['requests'],
+                    'n_plus_one': data['n_plus_one'],
+                    'query_count': dict(data['query_count']),
+                    'db_time_ms': dict(data['db_time_ms']),
+                    'top_statements': [dict(stats, statement=statement, total_ms=round(stats['total_ms'], 3),
+                                            max_ms=round(stats['max_ms'], 3))
+                                       for statement, stats in statements[:self.top_statements]],
+                }
+            return result
+
+
+metrics = EndpointMetrics()
+
+
+def _start_timer():
+    g.request_started_at = time.perf_counter()
+
+
+def _report(response):
+    queries = current_queries()
+    config = current_app.config
+    endpoint = request.endpoint or 'unknown'
+
+    slow = config['SLOW_QUERY_MS'] / 1000
+    for statement, duration, rows in queries.statements:
+        if duration >= slow:
+            current_app.logger.warning("Requête lente (%.1f ms, %s lignes) sur %s: %s",
+                                       duration * 1000, rows, endpoint, statement)
+
+    n_plus_one = queries.repeated(config['N_PLUS_ONE_THRESHOLD'])
+    for statement, count in n_plus_one.items():
+        current_app.logger.warning("N+1 probable sur %s : %s exécutions de %s", endpoint, count, statement)
+
+    metrics.observe(endpoint, queries, n_plus_one)
+
+    if config['SERVER_TIMING']:
+        total = time.perf_counter() - g.get('request_started_at', time.perf_counter())
+        response.headers.add('Server-Timing', f'db;dur={queries.db_time * 1000:.2f};desc="{len(queries.statements)} queries"')
+        response.headers.add('Server-Timing', f'pool;dur={queries.pool_wait * 1000:.2f}')
+        response.headers.add('Server-Timing', f'app;dur={total * 1000:.2f}')
+        response.headers['X-Query-Count'] = str(len(queries.statements))
+    return response
+
+
+def init_app(app):
+    """Enregistre la mesure des requêtes SQL pour chaque requête HTTP."""
+    app.before_request(_start_timer)
+    app.after_request(_report)
@@ -0,0 +1,663 @@
+# Tâches de fond : opérations longues (exports, recalculs, imports volumineux)
+# exécutées hors requête par un pool de threads, à partir d'une file durable en base.
+# Une requête HTTP ne fait qu'insérer la tâche dans `jobs` ; le runner de chaque
+# processus la prend, l'exécute et publie son avancement.
+
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+import pymysql
+from flask import current_app
+from flask.cli import AppGroup
+
+import archive
+import bulk
+import study_stats
+from db import get_db, get_shard, shard_count
+
+STATUSES = ('queued', 'running', 'succeeded', 'failed', 'cancelled')
+FINISHED = ('succeeded', 'failed', 'cancelled')
+# Verrou nommé sérialisant la prise de tâches entre processus : les limites par type sont globales
+CLAIM_LOCK = 'jobs_claim'
+
+JOB_COLUMNS = ("id, job_type, status, user_id, attempts, max_attempts, cancel_requested, worker, heartbeat_at, "
+               "progress_done, progress_total, progress_message, result, error, created_at, started_at, finished_at")
+
+
+class JobCancelled(Exception):
+    """Levée dans une tâche dont l'annulation a été demandée (ou reprise par un autre worker)."""
+
+
+class JobType:
+    """Type de tâche : fonction exécutée, concurrence maximale et rôle requis pour la soumettre."""
+
+    def __init__(self, name, handler, concurrency, role, max_attempts, validate, submittable):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.role = role
+        self.max_attempts = max_attempts
+        self.validate = validate
+        self.submittable = submittable
+
+
+JOB_TYPES = {}
+
+
+def job_type(name, concurrency=1, role='admin', max_attempts=3, validate=None, submittable=True):
+    """
+    Enregistre `handler(ctx, **params)`, qui renvoie un résultat sérialisable
+    en JSON. Une tâche interrompue par l'arrêt de son worker est relancée
+    jusqu'à `max_attempts` fois : elle doit pouvoir être rejouée.
+    `validate(params)` renvoie les paramètres normalisés ou lève ValueError.
+    """
+    def decorator(handler):
+        JOB_TYPES[name] = JobType(name, handler, concurrency, role, max_attempts, validate, submittable)
+        return handler
+    return decorator
+
+
+class JobContext:
+    """
+    Vue d'une tâche en cours pour son propre code. L'avancement est tenu en
+    mémoire et enregistré par le runner à chaque cycle, avec le heartbeat :
+    la tâche ne fait aucune requête pour le publier, et sa transaction n'est
+    jamais validée par ce biais.
+    """
+
+    def __init__(self, job_id, attempt):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.done = 0
+        self.total = None
+        self.message = None
+        self.lost = False
+        self._cancel = threading.Event()
+
+    def progress(self, done, total=None, message=None):
+        """Publie l'avancement ; lève JobCancelled si l'annulation a été demandée."""
+        self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message[:255]
+        self.check_cancelled()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self, lost=False):
+        self.lost = self.lost or lost
+        self._cancel.set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+
+def _dumps(value):
+    return json.dumps(value, default=str, sort_keys=True)
+
+
+def enqueue(cursor, name, params, user_id=None):
+    """Insère une tâche dans la file (dans la transaction de l'appelant) et renvoie son id."""
+    job = JOB_TYPES[name]
+    cursor.execute("INSERT INTO jobs (job_type, params, user_id, max_attempts) VALUES (%s, %s, %s, %s)",
+                   (name, _dumps(params), user_id, job.max_attempts))
+    return cursor.lastrowid
+
+
+def fetch(cursor, job_id):
+    cursor.execute(f"SELECT {JOB_COLUMNS} FROM jobs WHERE id = %s", (job_id,))
+    return cursor.fetchone()
+
+
+def describe(row):
+    """Représentation d'une tâche pour l'API."""
+    total = row['progress_total']
+    percent = None
+    if total:
+        percent = round(min(100.0, 100.0 * row['progress_done'] / total), 1)
+    elif row['status'] == 'succeeded':
+        percent = 100.0
+    return {
+        'id': row['id'],
+        'type': row['job_type'],
+        'status': row['status'],
+        'user_id': row['user_id'],
+        'attempts': row['attempts'],
+        'max_attempts': row['max_attempts'],
+        'cancel_requested': bool(row['cancel_requested']),
+        'progress': {'done': row['progress_done'], 'total': total, 'percent': percent,
+                     'message': row['progress_message']},
+        'error': row['error'],
+        'has_result': row['status'] == 'succeeded' and row['result'] is not None,
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+        'heartbeat_at': row['heartbeat_at'],
+    }
+
+
+def result_of(row):
+    return json.loads(row['result']) if row['result'] is not None else None
+
+
+def cancel(cursor, job_id):
+    """
+    Annule une tâche : immédiatement si elle est en file, sinon la demande est
+    transmise au worker qui l'exécute (prise en compte à son prochain point
+    d'avancement). Renvoie False si la tâche est déjà terminée.
+    """
+    cursor.execute("UPDATE jobs SET status = 'cancelled', cancel_requested = TRUE, finished_at = NOW() "
+                   "WHERE id = %s AND status = 'queued'", (job_id,))
+    if cursor.rowcount:
+        return True
+    cursor.execute("UPDATE jobs SET cancel_requested = TRUE WHERE id = %s AND status = 'running'", (job_id,))
+    if cursor.rowcount:
+        return True
+    cursor.execute("SELECT 1 FROM jobs WHERE id = %s AND status = 'running' AND cancel_requested", (job_id,))
+    return cursor.fetchone() is not None
+
+
+def release_running(cursor, condition, params):
+    """
+    Reprend les tâches en cours désignées par `condition` dont le worker s'est
+    arrêté : annulées si l'annulation était demandée, en échec une fois leurs
+    tentatives épuisées (un import n'est jamais rejoué), remises en file sinon.
+    Renvoie le nombre de tâches remises en file.
+    """
+    running = f"status = 'running' AND {condition}"
+    cursor.execute(f"UPDATE jobs SET status = 'cancelled', finished_at = NOW() WHERE {running} AND cancel_requested",
+                   params)
+    cursor.execute(f"UPDATE jobs SET status = 'failed', finished_at = NOW(), "
+                   f"error = 'Worker interrompu, nombre maximal de tentatives atteint.' "
+                   f"WHERE {running} AND attempts >= max_attempts", params)
+    cursor.execute(f"UPDATE jobs SET status = 'queued', worker = NULL WHERE {running}", params)
+    return cursor.rowcount
+
+
+def requeue_stale(cursor, stale_after):
+    """Reprend les tâches dont le heartbeat est plus vieux que `stale_after` secondes (worker disparu)."""
+    return release_running(cursor, "heartbeat_at < NOW() - INTERVAL %s SECOND", (stale_after,))
+
+
+class JobRunner:
+    """
+    Exécute les tâches de la file dans un pool de threads du processus.
+
+    Un thread de coordination, toutes les `poll_interval` secondes : enregistre
+    heartbeat et avancement des tâches locales, relaie les annulations, remet
+    en file les tâches des workers disparus, puis prend de nouvelles tâches
+    dans la limite de `limits[type]` tâches en cours par type, tous processus
+    confondus (prise sérialisée par le verrou nommé CLAIM_LOCK).
+    """
+
+    def __init__(self, app, limits, poll_interval=2.0, stale_after=60):
+        self.app = app
+        self.limits = {name: n for name, n in limits.items() if n > 0}
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.pid = os.getpid()
+        self.worker = f"{socket.gethostname()}:{self.pid}"
+        self._executor = ThreadPoolExecutor(max_workers=max(1, sum(self.limits.values())),
+                                            thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._running = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.finished = {status: 0 for status in FINISHED}
+        self.requeued = 0
+        self.errors = 0
+        self.last_tick = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='job-runner', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, requeue=True):
+        """
+        Arrête la prise de tâches. Avec `requeue`, les tâches en cours sont
+        reprises tout de suite (release_running) plutôt qu'après `stale_after` secondes.
+        """
+        self._stop.set()
+        if requeue:
+            with self._lock:
+                running = list(self._running.items())
+            for _, (_, ctx) in running:
+                ctx.cancel(lost=True)
+            if running:
+                try:
+                    with self.app.app_context():
+                        db = get_db()
+                        with db.cursor() as cursor:
+                            requeued = release_running(cursor, "worker = %s", (self.worker,))
+                        db.commit()
+                    self.requeued += requeued
+                except pymysql.MySQLError as e:
+                    self.app.logger.warning("Remise en file des tâches de %s impossible: %s", self.worker, e)
+        self._executor.shutdown(wait=False)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self.tick()
+            except Exception:
+                self.errors += 1
+                self.app.logger.exception("Échec d'un cycle du runner de tâches")
+            self._stop.wait(self.poll_interval)
+
+    def tick(self):
+        db = get_db()
+        self._heartbeat(db)
+        with db.cursor() as cursor:
+            self.requeued += requeue_stale(cursor, self.stale_after)
+        db.commit()
+        with self._lock:
+            running = [name for name, _ in self._running.values()]
+        free = {name: limit - running.count(name) for name, limit in self.limits.items()}
+        if not self._stop.is_set() and any(n > 0 for n in free.values()):
+            for job in self._claim(db, free):
+                self._submit(job)
+        self.last_tick = time.time()
+
+    def _heartbeat(self, db):
+        with self._lock:
+            running = {job_id: ctx for job_id, (_, ctx) in self._running.items()}
+        if not running:
+            return
+        with db.cursor() as cursor:
+            for job_id, ctx in running.items():
+                cursor.execute("UPDATE jobs SET heartbeat_at = NOW(), progress_done = %s, progress_total = %s, "
+                               "progress_message = %s WHERE id = %s AND worker = %s AND attempts = %s",
+                               (ctx.done, ctx.total, ctx.message, job_id, self.worker, ctx.attempt))
+            placeholders = ', '.join(['%s'] * len(running))
+            cursor.execute(f"SELECT id, status, worker, attempts, cancel_requested FROM jobs "
+                           f"WHERE id IN ({placeholders})", list(running))
+            rows = {row['id']: row for row in cursor.fetchall()}
+        db.commit()
+        for job_id, ctx in running.items():
+            row = rows.get(job_id)
+            if (row is None or row['status'] != 'running' or row['worker'] != self.worker
+                    or row['attempts'] != ctx.attempt):
+                # Reprise par un autre worker (heartbeat trop ancien) : on abandonne sans rien écrire
+                ctx.cancel(lost=True)
+            elif row['cancel_requested']:
+                ctx.cancel()
+
+    def _claim(self, db, free):
+        """Prend des tâches en file sous le verrou CLAIM_LOCK ; renvoie leurs lignes."""
+        claimed = []
+        with db.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, 0) AS locked", (CLAIM_LOCK,))
+            if not cursor.fetchone()['locked']:
+                return claimed
+            try:
+                cursor.execute("SELECT job_type, COUNT(*) AS n FROM jobs WHERE status = 'running' GROUP BY job_type")
+                running = {row['job_type']: row['n'] for row in cursor.fetchall()}
+                for name, local in free.items():
+                    slots = min(local, self.limits[name] - running.get(name, 0))
+                    if slots <= 0:
+                        continue
+                    cursor.execute("SELECT id FROM jobs WHERE status = 'queued' AND job_type = %s ORDER BY id LIMIT %s",
+                                   (name, slots))
+                    ids = [row['id'] for row in cursor.fetchall()]
+                    if not ids:
+                        continue
+                    placeholders = ', '.join(['%s'] * len(ids))
+                    cursor.execute(f"UPDATE jobs SET status = 'running', worker = %s, attempts = attempts + 1, "
+                                   f"started_at = NOW(), heartbeat_at = NOW(), progress_done = 0, "
+                                   f"progress_total = NULL, progress_message = NULL "
+                                   f"WHERE id IN ({placeholders}) AND status = 'queued'", [self.worker, *ids])
+                    cursor.execute(f"SELECT id, job_type, params, attempts FROM jobs "
+                                   f"WHERE id IN ({placeholders}) AND status = 'running' AND worker = %s",
+                                   [*ids, self.worker])
+                    claimed.extend(cursor.fetchall())
+                db.commit()
+            except pymysql.MySQLError:
+                db.rollback()
+                raise
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (CLAIM_LOCK,))
+        return claimed
+
+    def _submit(self, job):
+        ctx = JobContext(job['id'], job['attempts'])
+        with self._lock:
+            self._running[job['id']] = (job['job_type'], ctx)
+        self._executor.submit(self._execute, job, ctx)
+
+    def _execute(self, job, ctx):
+        logger = self.app.logger
+        result, error = None, None
+        try:
+            with self.app.app_context():
+                try:
+                    definition = JOB_TYPES.get(job['job_type'])
+                    if definition is None:
+                        raise ValueError(f"Type de tâche inconnu: {job['job_type']}.")
+                    result = definition.handler(ctx, **json.loads(job['params']))
+                    status = 'succeeded'
+                except JobCancelled:
+                    status = 'cancelled'
+                except Exception as e:
+                    logger.exception("Échec de la tâche %s (%s)", job['id'], job['job_type'])
+                    status, error = 'failed', str(e) or e.__class__.__name__
+            if ctx.lost:
+                return
+            with self.app.app_context():
+                self._finish(get_db(), job['id'], ctx, status, result, error)
+            with self._lock:
+                self.finished[status] += 1
+            logger.info("Tâche %s (%s) : %s", job['id'], job['job_type'], status)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            logger.exception("Impossible d'enregistrer la fin de la tâche %s", job['id'])
+        finally:
+            with self._lock:
+                self._running.pop(job['id'], None)
+
+    def _finish(self, db, job_id, ctx, status, result, error):
+        done = ctx.total if status == 'succeeded' and ctx.total is not None else ctx.done
+        with db.cursor() as cursor:
+            cursor.execute("UPDATE jobs SET status = %s, result = %s, error = %s, finished_at = NOW(), "
+                           "heartbeat_at = NOW(), progress_done = %s, progress_total = %s, progress_message = %s "
+                           "WHERE id = %s AND worker = %s AND attempts = %s AND status = 'running'",
+                           (status, None if result is None else _dumps(result), error, done, ctx.total,
+                            ctx.message, job_id, self.worker, ctx.attempt))
+        db.commit()
+
+    def stats(self):
+        with self._lock:
+            running = [{'id': job_id, 'type': name, 'done': ctx.done, 'total': ctx.total}
+                       for job_id, (name, ctx) in self._running.items()]
+            finished = dict(self.finished)
+        return {
+            'worker': self.worker,
+            'limits': self.limits,
+            'running': running,
+            'finished': finished,
+            'requeued': self.requeued,
+            'errors': self.errors,
+            'last_tick': self.last_tick,
+        }
+
+
+def parse_limits(value):
+    """Concurrence par type : celle des JOB_TYPES, modifiée par « type=n,... » (JOBS_CONCURRENCY)."""
+    limits = {name: job.concurrency for name, job in JOB_TYPES.items()}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, count = item.partition('=')
+        if name.strip() not in JOB_TYPES or not count.strip().isdigit():
+            raise ValueError(f"JOBS_CONCURRENCY invalide: {item} (types : {', '.join(JOB_TYPES)}).")
+        limits[name.strip()] = int(count)
+    return limits
+
+
+def create_runner(app):
+    return JobRunner(app, parse_limits(app.config['JOBS_CONCURRENCY']),
+                     poll_interval=app.config['JOBS_POLL_INTERVAL'], stale_after=app.config['JOBS_STALE_AFTER'])
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def ensure_runner(app):
+    """
+    Démarre le runner de ce processus, une fois par pid (après le fork de
+    Gunicorn), si JOBS_RUNNER=web. Avec JOBS_RUNNER=off, les tâches sont
+    exécutées par `flask jobs worker`.
+    """
+    global _runner
+    if app.config['JOBS_RUNNER'] != 'web':
+        return None
+    if _runner is not None and _runner.pid == os.getpid():
+        return _runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid():
+            _runner = create_runner(app).start()
+    return _runner
+
+
+def current_runner():
+    if _runner is not None and _runner.pid == os.getpid():
+        return _runner
+    return None
+
+
+def stop_runner():
+    runner = current_runner()
+    if runner is not None:
+        runner.stop()
+
+
+def init_app(app):
+    """
+    Avec JOBS_RUNNER=web, démarre le runner à la première requête de chaque
+    processus (serveur de développement ; Gunicorn le démarre dès post_fork).
+    """
+    if app.config['JOBS_RUNNER'] not in ('web', 'off'):
+        raise ValueError(f"JOBS_RUNNER inconnu: {app.config['JOBS_RUNNER']} (parmi : web, off).")
+    parse_limits(app.config['JOBS_CONCURRENCY'])
+
+    if app.config['JOBS_RUNNER'] == 'web':
+        @app.before_request
+        def start_runner():
+            ensure_runner(app)
+
+
+def jobs_dir():
+    path = current_app.config['JOBS_DIR']
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def save_upload(stream, prefix, extension):
+    """Copie un corps de requête dans JOBS_DIR, par blocs ; renvoie le nom du fichier."""
+    name = f"{prefix}-{uuid.uuid4().hex}.{extension}"
+    with open(os.path.join(jobs_dir(), name), 'wb') as f:
+        while True:
+            block = stream.read(1024 * 1024)
+            if not block:
+                break
+            f.write(block)
+    return name
+
+
+# --- Types de tâches ---
+
+@job_type('stats_rebuild', concurrency=1, role='admin')
+def rebuild_stats(ctx):
+    """Recalcul des tables de synthèse des études (voir study_stats.rebuild)."""
+    ctx.progress(0, 1, "Recalcul des synthèses")
+    daily, cohort = study_stats.rebuild_all()
+    return {'daily': daily, 'cohort': cohort}
+
+
+# Tables dont les index (dont FULLTEXT) peuvent être reconstruits par la tâche reindex
+REINDEX_TABLES = ('patients', 'studies', 'study_stats_daily', 'study_stats_cohort')
+
+
+def validate_reindex(params):
+    tables = params.get('tables') or list(REINDEX_TABLES)
+    if not isinstance(tables, list) or any(table not in REINDEX_TABLES for table in tables):
+        raise ValueError(f"'tables' doit être une liste parmi : {', '.join(REINDEX_TABLES)}.")
+    return {'tables': list(dict.fromkeys(tables))}
+
+
+@job_type('reindex', concurrency=1, role='admin', validate=validate_reindex)
+def reindex(ctx, tables):
+    """Reconstruit tables et index (OPTIMIZE TABLE), une table après l'autre, sur chaque shard."""
+    messages = {}
+    for i, table in enumerate(tables):
+        ctx.progress(i, len(tables), f"OPTIMIZE TABLE {table}")
+        messages[table] = []
+        for index in range(shard_count()):
+            with get_shard(index).cursor() as cursor:
+                cursor.execute(f"OPTIMIZE TABLE {table}")
+                messages[table].extend(row['Msg_text'] for row in cursor.fetchall())
+    ctx.progress(len(tables), len(tables), "Terminé")
+    return {'tables': messages}
+
+
+def validate_archive(params):
+    days = params.get('days', current_app.config['STUDIES_HOT_DAYS'])
+    if isinstance(days, bool) or not isinstance(days, int) or days < 0:
+        raise ValueError("'days' doit être un entier positif.")
+    return {'days': days}
+
+
+@job_type('studies_archive', concurrency=1, role='admin', validate=validate_archive)
+def archive_studies(ctx, days):
+    """Archivage des études de plus de `days` jours (voir archive.archive_shards), annulable entre deux lots."""
+    before = archive.cutoff(days)
+    ctx.progress(0, archive.pending(before), f"Archivage des études antérieures au {before:%Y-%m-%d}")
+    config = current_app.config
+    moved = archive.archive_shards(before, config['ARCHIVE_BATCH_SIZE'], config['ARCHIVE_PAUSE'], progress=ctx.progress)
+    return {'before': before.date().isoformat(), 'moved': moved}
+
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+
+def validate_export(params):
+    fmt = params.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu: {fmt}.")
+    cleaned = {'format': fmt, 'include_studies': bool(params.get('include_studies')),
+               'gzip': bool(params.get('gzip', True)), 'include_archive': bool(params.get('include_archive'))}
+    for key in ('since_id', 'until_id'):
+        value = params.get(key)
+        if value is not None and (isinstance(value, bool) or not isinstance(value, int)):
+            raise ValueError(f"'{key}' doit être un entier.")
+        cleaned[key] = value
+    updated_since = params.get('updated_since')
+    if updated_since is not None:
+        try:
+            datetime.fromisoformat(updated_since)
+        except (TypeError, ValueError):
+            raise ValueError("'updated_since' doit être une date ISO 8601.")
+    cleaned['updated_since'] = updated_since
+    return cleaned
+
+
+@job_type('export_patients', concurrency=2, role=None, validate=validate_export)
+def export_patients(ctx, format='ndjson', include_studies=False, gzip=True, since_id=None, until_id=None,
+                    updated_since=None, include_archive=False):
+    """Export des patients (et de leurs études) dans un fichier de JOBS_DIR, servi par /api/jobs/<id>/result."""
+    chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+    name = f"export-{ctx.job_id}.{format}" + ('.gz' if gzip else '')
+    path = os.path.join(jobs_dir(), name)
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            if count % chunk_size == 0:
+                ctx.progress(count, message=f"{count} lignes exportées")
+            yield row
+
+    rows = bulk.export_rows(include_studies, since_id, until_id,
+                            datetime.fromisoformat(updated_since) if updated_since else None, size=chunk_size,
+                            include_archive=include_archive)
+    try:
+        rows_out = counted(rows)
+        if include_studies and format == 'ndjson':
+            rows_out = bulk.nest_studies(rows_out)
+        chunks = bulk.encode_rows(rows_out, format, current_app.json.dumps, chunk_size)
+        data = bulk.gzip_chunks(chunks) if gzip else (chunk.encode('utf-8') for chunk in chunks)
+        with open(path + '.part', 'wb') as f:
+            for block in data:
+                f.write(block)
+        os.replace(path + '.part', path)
+    finally:
+        rows.close()
+        if os.path.exists(path + '.part'):
+            os.remove(path + '.part')
+    ctx.done, ctx.message = count, f"{count} lignes exportées"
+    return {'file': name, 'format': format, 'gzip': gzip, 'rows': count, 'bytes': os.path.getsize(path)}
+
+
+# Un import interrompu n'est pas rejoué : les lots déjà validés seraient insérés deux fois
+@job_type('import', concurrency=1, role='modification', max_attempts=1, submittable=False)
+def import_upload(ctx, kind, file, fmt, delimiter=',', chunk_size=None):
+    """Import en masse d'un fichier déposé par POST /api/import/<kind>?async=1."""
+    path = os.path.join(jobs_dir(), file)
+    total = os.path.getsize(path)
+    try:
+        with open(path, 'rb') as f:
+            def progress(report):
+                # read_rows ferme le fichier une fois lu
+                ctx.progress(total if f.closed else min(f.tell(), total), total,
+                             f"{report.inserted} lignes insérées, {report.failed} rejetées")
+
+            report = bulk.import_rows(kind, bulk.read_rows(f, fmt, delimiter=delimiter),
+                                      chunk_size=chunk_size, progress=progress)
+    finally:
+        os.remove(path)
+    if kind == 'patients' and report.inserted:
+        current_app.extensions['count_cache'].invalidate('patients')
+    return report.as_dict()
+
+
+# --- CLI ---
+
+jobs_cli = AppGroup('jobs', help="Tâches de fond.")
+
+
+@jobs_cli.command('worker')
+def worker_command():
+    """Exécuter les tâches de fond dans ce processus (quel que soit JOBS_RUNNER)."""
+    runner = create_runner(current_app._get_current_object()).start()
+    click.echo(f"Worker {runner.worker} : {', '.join(f'{k}={v}' for k, v in runner.limits.items())}")
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    try:
+        while not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+    runner.stop()
+
+
+@jobs_cli.command('purge')
+@click.option('--days', type=int, default=7, show_default=True, help="Âge minimal des tâches terminées.")
+def purge_command(days):
+    """Supprimer les tâches terminées depuis plus de `days` jours et leurs fichiers."""
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute("SELECT id, params, result FROM jobs WHERE status IN ('succeeded', 'failed', 'cancelled') "
+                       "AND finished_at < NOW() - INTERVAL %s DAY", (days,))
+        rows = cursor.fetchall()
+        if rows:
+            placeholders = ', '.join(['%s'] * len(rows))
+            cursor.execute(f"DELETE FROM jobs WHERE id IN ({placeholders})", [row['id'] for row in rows])
+    db.commit()
+    # Fichiers produits (exports) ou déposés et jamais consommés (imports interrompus)
+    files = []
+    for row in rows:
+        for data in (json.loads(row['params']), result_of(row)):
+            if isinstance(data, dict) and data.get('file'):
+                files.append(data['file'])
+    removed = 0
+    for name in files:
+        try:
+            os.remove(os.path.join(current_app.config['JOBS_DIR'], os.path.basename(name)))
+            removed += 1
+        except FileNotFoundError:
+            pass
+    click.echo(f"{len(rows)} tâche(s) et {removed} fichier(s) supprimé(s).")
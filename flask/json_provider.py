@@ -0,0 +1,81 @@
+from datetime import date, datetime
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # dépendance optionnelle : repli sur le fournisseur JSON de Flask
+    orjson = None
+
+_WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def _http_date(value):
+    """
+    Même format que `werkzeug.http.http_date` (celui de Flask pour les dates),
+    sans passer par `email.utils` pour les dates naïves, les plus courantes ici.
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            return http_date(value)
+        return (f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} "
+                f"{value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+    return f"{_WEEKDAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} {value.year:04d} 00:00:00 GMT"
+
+
+def _default(value):
+    if isinstance(value, date):
+        return _http_date(value)
+    # Decimal, UUID, dataclasses... : mêmes conversions que Flask
+    return DefaultJSONProvider.default(value)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Fournisseur JSON basé sur orjson, à sortie équivalente à celle de Flask
+    (clés triées, dates au format HTTP, Decimal en chaîne) pour ne rien changer
+    pour les clients. Seuls les caractères non ASCII sont émis en UTF-8 au lieu
+    d'échappements \\uXXXX.
+    """
+
+    options = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def dumpb(self, obj):
+        return orjson.dumps(obj, default=_default, option=self.options)
+
+    def dumps(self, obj, **kwargs):
+        # Options propres au module json (indent, cls...) : on laisse faire Flask
+        if kwargs.keys() - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        return self.dumpb(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumpb(obj) + b'\n', mimetype=self.mimetype)
+
+
+PROVIDERS = {
+    'default': DefaultJSONProvider,
+    'orjson': OrjsonProvider,
+}
+
+
+def init_app(app):
+    """Installe le fournisseur JSON choisi par JSON_PROVIDER (auto : orjson s'il est installé)."""
+    name = app.config['JSON_PROVIDER']
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'default'
+    if name not in PROVIDERS:
+        raise ValueError(f"JSON_PROVIDER inconnu: {name} (parmi : auto, {', '.join(PROVIDERS)}).")
+    if name == 'orjson' and orjson is None:
+        raise RuntimeError("JSON_PROVIDER=orjson mais le module orjson n'est pas installé.")
+    app.json = PROVIDERS[name](app)
@@ -0,0 +1,88 @@
+# Chargement groupé des patients et de leurs relations : une requête IN (...)
+# par relation, quel que soit le nombre d'ids, au lieu d'une requête par patient.
+# Avec des shards, une par shard concerné : un patient et ses études sont sur le même.
+
+from db import get_shard, shard_of
+
+# Relations accessibles par le paramètre `include`
+INCLUDES = ('studies',)
+
+
+def parse_ids(value, max_ids):
+    """Liste d'ids « 1,2,3 » sans doublons, dans l'ordre demandé ; lève ValueError."""
+    parts = [part.strip() for part in value.split(',') if part.strip()]
+    invalid = [part for part in parts if not part.isdigit()]
+    if invalid:
+        raise ValueError(f"Id invalide: {invalid[0]}.")
+    ids = list(dict.fromkeys(int(part) for part in parts))
+    if not ids:
+        raise ValueError("Le paramètre 'ids' est vide.")
+    if len(ids) > max_ids:
+        raise ValueError(f"Trop d'ids ({len(ids)}), maximum {max_ids} par appel.")
+    return ids
+
+
+def parse_include(value):
+    """Ensemble des relations demandées par `include=studies,...` ; lève ValueError."""
+    includes = {part.strip() for part in (value or '').split(',') if part.strip()}
+    unknown = includes.difference(INCLUDES)
+    if unknown:
+        raise ValueError(f"Relation inconnue: {', '.join(sorted(unknown))} (parmi : {', '.join(INCLUDES)}).")
+    return includes
+
+
+def fetch_patients(cursor, ids):
+    """Patients demandés, dans l'ordre de `ids`, et liste des ids introuvables."""
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"SELECT * FROM patients WHERE id IN ({placeholders})", ids)
+    found = {row['id']: row for row in cursor.fetchall()}
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+
+def attach_studies(cursor, patients, tables=('studies',)):
+    """
+    Ajoute à chaque patient la liste `studies` de ses études, plus récentes
+    d'abord, lues dans `tables` (l'archive à la suite de la table chaude).
+    """
+    if not patients:
+        return patients
+    by_patient = {patient['id']: patient for patient in patients}
+    for patient in patients:
+        patient['studies'] = []
+    placeholders = ', '.join(['%s'] * len(by_patient))
+    for table in tables:
+        cursor.execute(f"SELECT * FROM {table} WHERE patient_id IN ({placeholders}) "
+                       f"ORDER BY patient_id, study_date DESC", list(by_patient))
+        for study in cursor.fetchall():
+            by_patient[study['patient_id']]['studies'].append(study)
+    return patients
+
+
+def by_shard(ids):
+    """Regroupe des ids de patients par shard ({indice: [ids]})."""
+    groups = {}
+    for patient_id in ids:
+        groups.setdefault(shard_of(patient_id), []).append(patient_id)
+    return groups
+
+
+def load_patients(ids, includes=()):
+    """fetch_patients (et attach_studies si `includes` le demande) sur les shards des patients."""
+    found = {}
+    for index, shard_ids in by_shard(ids).items():
+        with get_shard(index).cursor() as cursor:
+            patients, _ = fetch_patients(cursor, shard_ids)
+            if 'studies' in includes:
+                attach_studies(cursor, patients)
+        found.update((patient['id'], patient) for patient in patients)
+    return [found[i] for i in ids if i in found], [i for i in ids if i not in found]
+
+
+def attach_all_studies(patients):
+    """attach_studies pour des patients lus sur plusieurs shards."""
+    groups = by_shard(patient['id'] for patient in patients)
+    by_id = {patient['id']: patient for patient in patients}
+    for index, shard_ids in groups.items():
+        with get_shard(index).cursor() as cursor:
+            attach_studies(cursor, [by_id[i] for i in shard_ids])
+    return patients
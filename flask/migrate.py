@@ -0,0 +1,308 @@
+import hashlib
+import os
+import re
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from db import get_db, get_shard, shard_count
+import changes
+import shards
+import study_stats
+import versioning
+
+# Fichiers de migration : NNNN_description.sql, appliqués dans l'ordre de NNNN
+MIGRATION_FILE = re.compile(r'^(\d{4})_([\w-]+)\.sql$')
+
+TRACKING_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(16) PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        checksum CHAR(40) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    @property
+    def sql(self):
+        with open(self.path, encoding='utf-8') as f:
+            return f.read()
+
+    @property
+    def checksum(self):
+        return hashlib.sha1(self.sql.encode('utf-8')).hexdigest()
+
+    def statements(self):
+        """Découpe le fichier en instructions terminées par « ; » en fin de ligne, sans les commentaires."""
+        lines = [line for line in self.sql.splitlines() if not line.strip().startswith('--')]
+        return [stmt.strip() for stmt in re.split(r';\s*$', '\n'.join(lines), flags=re.MULTILINE) if stmt.strip()]
+
+
+def discover(directory):
+    """Liste les migrations du répertoire, triées par version."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append(Migration(match.group(1), match.group(2), os.path.join(directory, filename)))
+    versions = [m.version for m in migrations]
+    duplicates = {v for v in versions if versions.count(v) > 1}
+    if duplicates:
+        raise click.ClickException(f"Versions de migration en double: {', '.join(sorted(duplicates))}.")
+    return sorted(migrations, key=lambda m: m.version)
+
+
+def applied_migrations(cursor):
+    cursor.execute(TRACKING_TABLE_SQL)
+    cursor.execute("SELECT version, name, checksum, applied_at FROM schema_migrations ORDER BY version")
+    return {row['version']: row for row in cursor.fetchall()}
+
+
+def upgrade(db, directory, target=None, log=click.echo):
+    """
+    Applique les migrations non encore enregistrées, jusqu'à `target` inclus.
+    Les instructions DDL étant validées implicitement par MariaDB, chaque
+    migration est écrite de manière idempotente (IF NOT EXISTS...) pour pouvoir
+    être rejouée après un échec partiel.
+    """
+    applied_count = 0
+    with db.cursor() as cursor:
+        applied = applied_migrations(cursor)
+        for migration in discover(directory):
+            if target is not None and migration.version > target:
+                break
+            if migration.version in applied:
+                if applied[migration.version]['checksum'] != migration.checksum:
+                    log(f"Attention : {migration.version}_{migration.name} a été modifiée depuis son application.")
+                continue
+            log(f"Application de {migration.version}_{migration.name}...")
+            for statement in migration.statements():
+                cursor.execute(statement)
+            cursor.execute("INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+                           (migration.version, migration.name, migration.checksum))
+            db.commit()
+            applied_count += 1
+    return applied_count
+
+
+# Requêtes critiques des routes, avec des paramètres représentatifs, et l'index attendu
+HOT_QUERIES = [
+    ("frontend.dashboard",
+     "SELECT p.id, s.id FROM studies s JOIN patients p ON s.patient_id = p.id "
+     "ORDER BY s.study_date DESC, s.id DESC LIMIT 51", ()),
+    ("frontend.dashboard (page suivante)",
+     "SELECT p.id, s.id FROM studies s JOIN patients p ON s.patient_id = p.id "
+     "WHERE ((s.study_date < %s OR (s.study_date = %s AND (s.id < %s))) OR s.study_date IS NULL) "
+     "ORDER BY s.study_date DESC, s.id DESC LIMIT 51", ('2024-01-01', '2024-01-01', 1000)),
+    ("frontend.patient_detail",
+     "SELECT * FROM studies WHERE patient_id = %s ORDER BY study_date DESC", (1,)),
+    ("frontend.edit_study",
+     "SELECT s.*, p.lastname, p.firstname FROM studies s JOIN patients p ON p.id = s.patient_id WHERE s.id = %s", (1,)),
+    ("api.suggest_patients (rafraîchissement de l'index)",
+     "SELECT id, lastname, firstname, birthdate, updated_at FROM patients "
+     "WHERE updated_at >= %s - INTERVAL %s SECOND LIMIT %s", ('2024-01-01', 60, 50001)),
+    ("frontend.study_detail",
+     "SELECT s.*, p.lastname FROM studies s JOIN patients p ON s.patient_id = p.id WHERE s.id = %s", (1,)),
+    ("api.get_patient", "SELECT * FROM patients WHERE id = %s", (1,)),
+    ("api.get_patients (curseur id)", "SELECT * FROM patients WHERE (id > %s) ORDER BY id LIMIT 11", (1000,)),
+    ("api.get_patients (curseur nom)",
+     "SELECT * FROM patients WHERE (lastname > %s OR (lastname = %s AND (firstname > %s OR "
+     "(firstname = %s AND (id > %s))))) ORDER BY lastname, firstname, id LIMIT 11",
+     ('Martin', 'Martin', 'Jean', 'Jean', 1000)),
+    ("api.get_patients (ids, include=studies)",
+     "SELECT * FROM studies WHERE patient_id IN (%s, %s, %s) ORDER BY patient_id, study_date DESC", (1, 2, 3)),
+    ("api.create_study (existence du patient)", "SELECT id FROM patients WHERE id = %s", (1,)),
+    ("api.search (nom)",
+     "SELECT p.id FROM patients p LEFT JOIN studies s ON p.id = s.patient_id "
+     "WHERE MATCH(p.lastname, p.firstname) AGAINST (%s IN BOOLEAN MODE)", ('+dupont*',)),
+    ("api.search (description)",
+     "SELECT s.id FROM studies s JOIN patients p ON p.id = s.patient_id "
+     "WHERE MATCH(s.study_description) AGAINST (%s IN BOOLEAN MODE)", ('+genou*',)),
+    ("api.search (modalité)",
+     "SELECT s.id FROM studies s JOIN patients p ON p.id = s.patient_id "
+     "WHERE s.modality LIKE %s ORDER BY s.study_date DESC LIMIT 50", ('IRM%',)),
+    ("api.get_stats",
+     "SELECT modality, SUM(study_count) FROM study_stats_daily WHERE stat_date >= %s AND stat_date <= %s "
+     "GROUP BY modality", ('2024-01-01', '2024-12-31')),
+    ("jobs (prise de tâches)",
+     "SELECT id FROM jobs WHERE status = 'queued' AND job_type = %s ORDER BY id LIMIT 2", ('export_patients',)),
+    ("api.get_jobs", "SELECT id FROM jobs WHERE user_id = %s ORDER BY id DESC LIMIT 50", (1,)),
+    ("studies archive (lot à archiver)",
+     "SELECT id FROM studies WHERE study_date < %s ORDER BY study_date, id LIMIT 1000", ('2020-01-01',)),
+    ("api.get_studies (archive, période)",
+     "SELECT id FROM studies_archive WHERE study_date >= %s AND study_date < %s", ('2015-01-01', '2015-02-01')),
+    ("changes (lecture du journal)",
+     "SELECT id, table_name, row_id, op FROM change_log WHERE id > %s ORDER BY id LIMIT 500", (0,)),
+]
+
+
+def full_scans(plan):
+    """Lignes d'un plan EXPLAIN qui parcourent une table entière sans index."""
+    return [row for row in plan if row['type'] == 'ALL' or (row['type'] == 'index' and not row['key'])]
+
+
+db_cli = AppGroup('db', help="Gestion du schéma de la base de données.")
+
+
+def _directory():
+    return current_app.config['MIGRATIONS_DIR']
+
+
+def _shard_label(index):
+    return f"Shard {index} : " if shard_count() > 1 else ""
+
+
+@db_cli.command('upgrade')
+@click.option('--to', 'target', help="Version cible (incluse), par défaut la dernière.")
+def upgrade_command(target):
+    """Appliquer les migrations en attente, sur chaque shard."""
+    for index in range(shard_count()):
+        count = upgrade(get_shard(index), _directory(), target)
+        click.echo(_shard_label(index) + (f"{count} migration(s) appliquée(s)." if count else "Schéma à jour."))
+
+
+@db_cli.command('status')
+def status_command():
+    """Lister les migrations appliquées et en attente, sur chaque shard."""
+    for index in range(shard_count()):
+        with get_shard(index).cursor() as cursor:
+            applied = applied_migrations(cursor)
+        for migration in discover(_directory()):
+            row = applied.get(migration.version)
+            state = f"appliquée le {row['applied_at']}" if row else "en attente"
+            click.echo(f"{_shard_label(index)}{migration.version}_{migration.name}: {state}")
+
+
+@db_cli.command('explain')
+def explain_command():
+    """
+    Vérifier par EXPLAIN que les requêtes critiques des routes utilisent un index.
+    À lancer sur un volume de données représentatif : sur de petites tables,
+    l'optimiseur préfère légitimement un parcours complet.
+    """
+    failures = 0
+    with get_db().cursor() as cursor:
+        for label, sql, params in HOT_QUERIES:
+            cursor.execute("EXPLAIN " + sql, params)
+            plan = cursor.fetchall()
+            scans = full_scans(plan)
+            failures += bool(scans)
+            click.echo(f"{'SCAN' if scans else 'OK  '} {label}")
+            for row in plan:
+                click.echo(f"       {row['table']}: type={row['type']} key={row['key']} "
+                           f"rows={row['rows']} {row['Extra'] or ''}")
+    if failures:
+        raise click.ClickException(f"{failures} requête(s) en parcours complet.")
+
+
+# --- Rééquilibrage des shards ---
+
+def _insert_rows(cursor, table, rows):
+    """Recopie des lignes lues par SELECT *, ids et versions compris."""
+    if rows:
+        columns = list(rows[0])
+        cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                           [[row[c] for c in columns] for row in rows])
+
+
+def _discard_patients(cursor, patient_ids):
+    """Supprime des patients et leurs études, archivées comprises (ON DELETE CASCADE), synthèses comprises."""
+    placeholders = ', '.join(['%s'] * len(patient_ids))
+    for table in study_stats.STUDY_TABLES:
+        cursor.execute(f"SELECT id FROM {table} WHERE patient_id IN ({placeholders})", patient_ids)
+        study_stats.remove(cursor, table, [row['id'] for row in cursor.fetchall()])
+    cursor.execute(f"DELETE FROM patients WHERE id IN ({placeholders})", patient_ids)
+
+
+def move_patients(source, target, patient_ids):
+    """
+    Déplace des patients et leurs études (archivées comprises) du shard
+    `source` vers `target`. La copie est validée avant la suppression à la
+    source ; après une interruption, relancer remplace la copie partielle éventuelle.
+    Le journal (change_log) de chaque shard enregistre l'arrivée ou le départ
+    des lignes de la table chaude.
+    """
+    placeholders = ', '.join(['%s'] * len(patient_ids))
+    source_db, target_db = get_shard(source), get_shard(target)
+    studies = {}
+    with source_db.cursor() as cursor:
+        cursor.execute(f"SELECT * FROM patients WHERE id IN ({placeholders}) ORDER BY id", patient_ids)
+        patients = cursor.fetchall()
+        for table in study_stats.STUDY_TABLES:
+            cursor.execute(f"SELECT * FROM {table} WHERE patient_id IN ({placeholders}) ORDER BY id", patient_ids)
+            studies[table] = cursor.fetchall()
+    try:
+        with target_db.cursor() as cursor:
+            _discard_patients(cursor, patient_ids)
+            _insert_rows(cursor, 'patients', patients)
+            for table, rows in studies.items():
+                _insert_rows(cursor, table, rows)
+                study_stats.add(cursor, table, [study['id'] for study in rows])
+            changes.record(cursor, 'patients', patient_ids, 'insert')
+            changes.record(cursor, 'studies', [study['id'] for study in studies['studies']], 'insert')
+            versioning.touch(cursor, 'patients', 'studies')
+        target_db.commit()
+    except Exception:
+        target_db.rollback()
+        raise
+    try:
+        with source_db.cursor() as cursor:
+            _discard_patients(cursor, patient_ids)
+            changes.record(cursor, 'patients', patient_ids, 'delete')
+            changes.record(cursor, 'studies', [study['id'] for study in studies['studies']], 'delete')
+            versioning.touch(cursor, 'patients', 'studies')
+        source_db.commit()
+    except Exception:
+        source_db.rollback()
+        raise
+    return len(patients), sum(len(rows) for rows in studies.values())
+
+
+@db_cli.command('rebalance')
+@click.option('--batch-size', type=int, default=500, show_default=True, help="Patients déplacés par transaction.")
+def rebalance_command(batch_size):
+    """
+    Déplacer chaque patient (avec ses études) sur le shard de son id, après
+    l'ajout de shards à DB_SHARDS, puis relever les auto-incréments au-delà
+    du plus grand id de tous les shards. À lancer écritures arrêtées.
+    """
+    count = shard_count()
+    moved = moved_studies = 0
+    for source in range(count):
+        while True:
+            with get_shard(source).cursor() as cursor:
+                cursor.execute("SELECT id FROM patients WHERE MOD(id - 1, %s) <> %s ORDER BY id LIMIT %s",
+                               (count, source, batch_size))
+                patient_ids = [row['id'] for row in cursor.fetchall()]
+            get_shard(source).rollback()
+            if not patient_ids:
+                break
+            targets = {}
+            for patient_id in patient_ids:
+                targets.setdefault(shards.shard_of(patient_id, count), []).append(patient_id)
+            for target, ids in sorted(targets.items()):
+                patients, studies = move_patients(source, target, ids)
+                moved += patients
+                moved_studies += studies
+            click.echo(f"Shard {source} : {moved} patient(s) déplacé(s)...")
+
+    # Une étude déplacée garde son id : aucun shard ne doit plus attribuer un id déjà pris ailleurs,
+    # y compris dans l'archive
+    for table, sources in (('patients', ('patients',)), ('studies', study_stats.STUDY_TABLES)):
+        top = 0
+        for index in range(count):
+            with get_shard(index).cursor() as cursor:
+                for source in sources:
+                    cursor.execute(f"SELECT COALESCE(MAX(id), 0) AS id FROM {source}")
+                    top = max(top, cursor.fetchone()['id'])
+        for index in range(count):
+            with get_shard(index).cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {table} AUTO_INCREMENT = {top + 1}")
+    click.echo(f"{moved} patient(s) et {moved_studies} étude(s) déplacés sur {count} shard(s).")
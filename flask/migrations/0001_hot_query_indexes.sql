@@ -0,0 +1,11 @@
+-- Index des chemins d'accès les plus fréquents
+
+-- Tableau de bord : ORDER BY study_date DESC, id DESC et pagination par (study_date, id)
+CREATE INDEX IF NOT EXISTS idx_studies_study_date ON studies (study_date, id);
+
+-- Listes déroulantes des formulaires d'étude et tri par nom de l'API :
+-- (lastname, firstname) + la clé primaire implicite couvre SELECT id, lastname, firstname
+CREATE INDEX IF NOT EXISTS idx_patients_name ON patients (lastname, firstname, id);
+
+-- Fiche patient : études d'un patient triées par date
+CREATE INDEX IF NOT EXISTS idx_studies_patient_date ON studies (patient_id, study_date);
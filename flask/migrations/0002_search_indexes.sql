@@ -0,0 +1,9 @@
+-- Recherche plein texte (bases créées avant l'ajout des index dans init.sql)
+
+-- Collation insensible aux accents pour la recherche sur les noms français
+ALTER TABLE patients CONVERT TO CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+ALTER TABLE studies CONVERT TO CHARACTER SET utf8mb4 COLLATE utf8mb4_unicode_ci;
+
+CREATE FULLTEXT INDEX IF NOT EXISTS ft_patients_name ON patients (lastname, firstname);
+CREATE FULLTEXT INDEX IF NOT EXISTS ft_studies_description ON studies (study_description);
+CREATE INDEX IF NOT EXISTS idx_studies_modality ON studies (modality);
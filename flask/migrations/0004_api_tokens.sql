@@ -0,0 +1,15 @@
+-- Jetons d'API signés : registre des jetons émis, pour la liste et la révocation.
+-- La vérification d'un jeton ne lit pas cette table (signature HMAC seule).
+
+CREATE TABLE IF NOT EXISTS api_tokens (
+    jti CHAR(32) PRIMARY KEY,
+    user_id INT NOT NULL,
+    role VARCHAR(50) NOT NULL,
+    scopes VARCHAR(255) NOT NULL,
+    issued_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at DATETIME NOT NULL,
+    revoked_at DATETIME NULL,
+    KEY idx_api_tokens_user (user_id),
+    KEY idx_api_tokens_revoked (revoked_at, expires_at),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
@@ -0,0 +1,36 @@
+-- Statistiques des études tenues à jour par les écritures (flask stats rebuild pour tout recalculer).
+-- Les études sans date ne sont pas comptées.
+
+-- Nombre d'études par jour et par modalité ('' si la modalité est vide)
+CREATE TABLE IF NOT EXISTS study_stats_daily (
+    stat_date DATE NOT NULL,
+    modality VARCHAR(50) NOT NULL,
+    study_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, modality)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- Nombre d'études par jour, sexe (U si inconnu) et tranche d'âge du patient à la date de l'étude
+-- (borne basse de la tranche de 10 ans, 90 pour 90 ans et plus, -1 si date de naissance inconnue)
+CREATE TABLE IF NOT EXISTS study_stats_cohort (
+    stat_date DATE NOT NULL,
+    gender CHAR(1) NOT NULL,
+    age_band TINYINT NOT NULL,
+    study_count INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (stat_date, gender, age_band)
+);
+
+-- Remplissage initial ; INSERT IGNORE pour pouvoir rejouer la migration
+INSERT IGNORE INTO study_stats_daily (stat_date, modality, study_count)
+SELECT DATE(s.study_date), COALESCE(s.modality, ''), COUNT(*)
+FROM studies s
+WHERE s.study_date IS NOT NULL
+GROUP BY DATE(s.study_date), COALESCE(s.modality, '');
+
+INSERT IGNORE INTO study_stats_cohort (stat_date, gender, age_band, study_count)
+SELECT DATE(s.study_date), COALESCE(p.gender, 'U'),
+       COALESCE(GREATEST(LEAST(TIMESTAMPDIFF(YEAR, p.birthdate, s.study_date) DIV 10 * 10, 90), 0), -1),
+       COUNT(*)
+FROM studies s
+JOIN patients p ON p.id = s.patient_id
+WHERE s.study_date IS NOT NULL
+GROUP BY 1, 2, 3;
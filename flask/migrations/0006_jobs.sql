@@ -0,0 +1,27 @@
+-- File durable des tâches de fond (exports, recalculs, imports volumineux).
+-- Une tâche « running » dont le heartbeat n'est plus mis à jour est reprise par un autre worker.
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    params TEXT NOT NULL,
+    status ENUM('queued', 'running', 'succeeded', 'failed', 'cancelled') NOT NULL DEFAULT 'queued',
+    user_id INT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 1,
+    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+    -- Processus (« hôte:pid ») qui exécute ou a exécuté la tâche
+    worker VARCHAR(100) NULL,
+    heartbeat_at DATETIME NULL,
+    progress_done BIGINT NOT NULL DEFAULT 0,
+    progress_total BIGINT NULL,
+    progress_message VARCHAR(255) NULL,
+    result MEDIUMTEXT NULL,
+    error TEXT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at DATETIME NULL,
+    finished_at DATETIME NULL,
+    KEY idx_jobs_queue (status, job_type, id),
+    KEY idx_jobs_user (user_id, id),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
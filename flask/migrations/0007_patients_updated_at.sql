@@ -0,0 +1,4 @@
+-- Lecture des patients modifiés depuis une date : rafraîchissement de l'index
+-- de /api/patients/suggest et exports incrémentaux (updated_since).
+
+CREATE INDEX IF NOT EXISTS idx_patients_updated_at ON patients (updated_at, id);
@@ -0,0 +1,12 @@
+-- Journal des modifications de patients et d'études, lu par le flux /api/changes.
+-- Une ligne par ligne modifiée (row_id NULL pour un import en masse), ajoutée dans la
+-- transaction de l'écriture ; `flask changes purge` supprime les entrées anciennes.
+
+CREATE TABLE IF NOT EXISTS change_log (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    table_name VARCHAR(50) NOT NULL,
+    row_id INT NULL,
+    op ENUM('insert', 'update', 'delete', 'bulk') NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_change_log_created (created_at)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,19 @@
+-- Archive des études sorties de la fenêtre chaude, remplie par `flask studies archive`.
+-- Mêmes colonnes que `studies` (les ids sont conservés, sans auto-incrément) et mêmes
+-- index, lus seulement quand une requête demande l'archive (archive=1).
+
+CREATE TABLE IF NOT EXISTS studies_archive (
+    id INT PRIMARY KEY,
+    patient_id INT,
+    study_date DATETIME,
+    study_description VARCHAR(255),
+    modality VARCHAR(50),
+    version INT NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (patient_id) REFERENCES patients(id) ON DELETE CASCADE,
+    FULLTEXT KEY ft_studies_archive_description (study_description),
+    KEY idx_studies_archive_study_date (study_date, id),
+    KEY idx_studies_archive_patient_date (patient_id, study_date),
+    KEY idx_studies_archive_modality (modality)
+) DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,4 @@
+-- Compteur de la table `users` : incrémenté à chaque changement de rôle ou de statut,
+-- il signale aux autres workers que leur cache d'utilisateurs est périmé.
+
+INSERT IGNORE INTO table_versions (table_name) VALUES ('users');
@@ -1,14 +1,56 @@
+import threading
+import time
+
+from flask import current_app
 from flask_login import UserMixin
 from werkzeug.security import check_password_hash, generate_password_hash
 from db import get_db
 
+# Le nom du rôle est résolu par jointure au chargement de l'utilisateur
+USER_SELECT = """
+    SELECT u.id, u.username, u.password_hash, u.role_id, u.is_active, r.name AS role_name
+    FROM users u
+    LEFT JOIN roles r ON u.role_id = r.id
+"""
+
+
+class UsersVersion:
+    """
+    Version de la table `users` (table_versions) vue par ce processus. Relue au
+    plus toutes les `interval` secondes : quand un autre worker a modifié un
+    utilisateur, le cache local est vidé au plus `interval` secondes après.
+    """
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.version = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def check(self, cache):
+        now = time.monotonic()
+        with self._lock:
+            if self.checked_at is not None and now - self.checked_at < self.interval:
+                return
+            self.checked_at = now
+        with get_db().cursor() as cursor:
+            cursor.execute("SELECT version FROM table_versions WHERE table_name = 'users'")
+            row = cursor.fetchone()
+        version = row['version'] if row else None
+        with self._lock:
+            changed, self.version = version != self.version, version
+        if changed:
+            cache.clear()
+
+
 class User(UserMixin):
-    def __init__(self, id, username, password_hash, role_id, is_active=True):
+    def __init__(self, id, username, password_hash, role_id, is_active=True, role=None):
         self.id = id
         self.username = username
         self.password_hash = password_hash
         self.role_id = role_id
         self._is_active = is_active
+        self.role = role
 
     @property
     def is_active(self):
@@ -17,30 +59,50 @@ class User(UserMixin):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+    @staticmethod
+    def _from_row(user_data):
+        return User(user_data['id'], user_data['username'], user_data['password_hash'], user_data['role_id'],
+                    user_data['is_active'], user_data['role_name'])
+
     @staticmethod
     def get(user_id):
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
+        cursor.execute(USER_SELECT + " WHERE u.id = %s", (user_id,))
         user_data = cursor.fetchone()
         if user_data:
-            return User(user_data['id'], user_data['username'], user_data['password_hash'], user_data['role_id'], user_data['is_active'])
+            return User._from_row(user_data)
         return None
 
+    @staticmethod
+    def get_cached(user_id):
+        """
+        Charge l'utilisateur depuis le cache du processus, ou depuis la base en cas d'absence.
+        """
+        cache = current_app.extensions['user_cache']
+        current_app.extensions['users_version'].check(cache)
+        key = str(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = User.get(user_id)
+            if user is not None:
+                cache.set(key, user)
+        return user
+
+    @staticmethod
+    def invalidate(user_id):
+        """
+        À appeler après toute modification du rôle ou du statut d'un utilisateur,
+        dont la transaction a fait versioning.touch(cursor, 'users') pour les autres workers.
+        """
+        current_app.extensions['user_cache'].invalidate(str(user_id))
+
     @staticmethod
     def get_by_username(username):
         db = get_db()
         cursor = db.cursor()
-        cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
+        cursor.execute(USER_SELECT + " WHERE u.username = %s", (username,))
         user_data = cursor.fetchone()
         if user_data:
-            return User(user_data['id'], user_data['username'], user_data['password_hash'], user_data['role_id'], user_data['is_active'])
+            return User._from_row(user_data)
         return None
-
-    @property
-    def role(self):
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute("SELECT name FROM roles WHERE id = %s", (self.role_id,))
-        role_data = cursor.fetchone()
-        return role_data['name'] if role_data else None
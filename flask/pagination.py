@@ -0,0 +1,49 @@
+import base64
+import json
+
+
+class InvalidCursor(ValueError):
+    """Curseur de pagination illisible ou incohérent avec le tri demandé."""
+
+
+def encode_cursor(sort, values):
+    """Encode la position de la dernière ligne servie en un jeton opaque."""
+    payload = json.dumps({'s': sort, 'v': values}, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, sort, size):
+    """Décode un jeton produit par `encode_cursor` et renvoie les valeurs de la clé de tri."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = payload['v']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursor("Curseur de pagination invalide.")
+    if payload.get('s') != sort or not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Curseur de pagination incompatible avec le tri demandé.")
+    return values
+
+
+def seek_condition(columns, descending=False):
+    """
+    Construit la condition « après cette ligne » pour une clé de tri composée,
+    sous une forme développée que l'optimiseur sait transformer en parcours d'index :
+    a > %s OR (a = %s AND (b > %s OR (b = %s AND c > %s))).
+
+    Renvoie le fragment SQL et une fonction qui mappe les valeurs du curseur
+    vers la liste de paramètres correspondante.
+    """
+    op = '<' if descending else '>'
+    sql = f"{columns[-1]} {op} %s"
+    for column in reversed(columns[:-1]):
+        sql = f"{column} {op} %s OR ({column} = %s AND ({sql}))"
+
+    def params(values):
+        out = []
+        for value in values[:-1]:
+            out.extend([value, value])
+        out.append(values[-1])
+        return out
+
+    return f"({sql})", params
@@ -0,0 +1,439 @@
+# Index en mémoire des noms de patients pour la saisie semi-automatique
+# (/api/patients/suggest) : recherche par préfixe sur les noms normalisés
+# (minuscules, sans accents), sans requête SQL par frappe.
+
+import bisect
+import itertools
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime
+
+import pymysql
+from flask import current_app
+
+import search
+import versioning
+from db import get_primary_shard, get_shard, merged_query, shard_count
+
+PATIENTS_SQL = "SELECT id, lastname, firstname, birthdate FROM patients ORDER BY id"
+CHANGED_SQL = ("SELECT id, lastname, firstname, birthdate, updated_at FROM patients "
+               "WHERE updated_at >= %s - INTERVAL %s SECOND LIMIT %s")
+# Suppressions journalisées par change_log (patients déplacés par `flask db rebalance` compris)
+DELETED_SQL = ("SELECT row_id, created_at FROM change_log WHERE table_name = 'patients' AND op = 'delete' "
+               "AND created_at >= %s - INTERVAL %s SECOND")
+# Séparateur des champs affichés dans le bloc de noms du segment compact
+_SEP = '\x1f'
+# Id des patients dans les entrées du segment (gros-boutiste : n'influe pas sur l'ordre des clés)
+_ID = struct.Struct('>i')
+
+
+def name_keys(lastname, firstname):
+    """
+    Clés d'index d'un patient : les mots normalisés de « nom prénom », une
+    rotation par mot pour que la saisie puisse commencer par n'importe lequel
+    (« dupont jean » et « jean dupont »).
+    """
+    words = search.tokenize(f"{lastname or ''} {firstname or ''}")
+    return {' '.join(words[i:] + words[:i]).encode('utf-8') for i in range(len(words))}
+
+
+def _has_words(key, needles):
+    """Chaque mot saisi (needle : « b' ' + mot ») commence un mot de la clé autre que le premier."""
+    space = key.find(b' ')
+    if space < 0:
+        return False
+    tail = key[space:]
+    for needle in needles:
+        if needle not in tail:
+            return False
+    return True
+
+
+def _display(row):
+    birthdate = row['birthdate']
+    return (row['lastname'] or '', row['firstname'] or '', birthdate.isoformat() if birthdate else '')
+
+
+class _KeyView:
+    """Séquence des clés d'un segment, pour `bisect`."""
+
+    def __init__(self, segment):
+        self._segment = segment
+
+    def __len__(self):
+        return len(self._segment)
+
+    def __getitem__(self, i):
+        return self._segment.entry(i)
+
+
+class Segment:
+    """
+    Clés triées et noms affichés de tous les patients, sous forme compacte :
+    deux `bytes` et des `array` d'entiers pour les positions et les ids, soit
+    quelques objets Python au total au lieu de plusieurs par patient.
+    Chaque entrée est la clé suivie de \x00 et de l'id sur 4 octets : le tri
+    des entrées est celui des clés. Immuable une fois construit.
+    """
+
+    def __init__(self, entries, name_ids, names, name_offsets):
+        entries.sort()
+        self._entries = b''.join(entries)
+        self._offsets = array('I', [0])
+        position = 0
+        for entry in entries:
+            position += len(entry)
+            self._offsets.append(position)
+        self._name_ids = name_ids
+        self._names = names
+        self._name_offsets = name_offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def entry(self, i):
+        return self._entries[self._offsets[i]:self._offsets[i + 1]]
+
+    def find(self, prefix, needles, exclude, seen, limit, max_scan, skip=None):
+        """
+        (clé, id) des clés commençant par `prefix` et contenant les `needles`
+        (voir `_has_words`), dans l'ordre des clés, hors ids de `exclude` et de
+        `seen` (complété au passage), et hors clés commençant par `skip`.
+        Au plus `max_scan` clés examinées.
+        """
+        entries, offsets = self._entries, self._offsets
+        keys = _KeyView(self)
+        start = bisect.bisect_left(keys, prefix)
+        indexes = range(start, len(offsets) - 1)
+        if skip is not None:
+            # Aucun octet UTF-8 ne vaut 0xff : borne haute des clés commençant par `skip`
+            skip_start = bisect.bisect_left(keys, skip, start)
+            skip_end = bisect.bisect_left(keys, skip + b'\xff', skip_start)
+            indexes = itertools.chain(range(start, skip_start), range(skip_end, len(offsets) - 1))
+        found = []
+        for i in itertools.islice(indexes, max_scan):
+            end = offsets[i + 1] - 5
+            key = entries[offsets[i]:end]
+            if not key.startswith(prefix):
+                break
+            if needles and not _has_words(key, needles):
+                continue
+            patient_id = _ID.unpack_from(entries, end + 1)[0]
+            if patient_id in exclude or patient_id in seen:
+                continue
+            seen.add(patient_id)
+            found.append((key, patient_id))
+            if len(found) >= limit:
+                break
+        return found
+
+    def name(self, patient_id):
+        i = bisect.bisect_left(self._name_ids, patient_id)
+        if i == len(self._name_ids) or self._name_ids[i] != patient_id:
+            return None
+        data = self._names[self._name_offsets[i]:self._name_offsets[i + 1]]
+        return tuple(data.decode('utf-8').split(_SEP))
+
+    @property
+    def patients(self):
+        return len(self._name_ids)
+
+    def nbytes(self):
+        return len(self._entries) + len(self._names) + sum(
+            a.itemsize * len(a) for a in (self._offsets, self._name_ids, self._name_offsets))
+
+
+def build_segment(rows):
+    """Segment des lignes (id, lastname, firstname, birthdate) de patients, triées par id."""
+    entries = []
+    name_ids, names, name_offsets = array('i'), bytearray(), array('I', [0])
+    for row in rows:
+        patient_id = row['id']
+        if name_ids and patient_id <= name_ids[-1]:
+            raise ValueError("Les patients doivent être lus par id croissant.")
+        suffix = b'\x00' + _ID.pack(patient_id)
+        entries.extend(key + suffix for key in name_keys(row['lastname'], row['firstname']))
+        name_ids.append(patient_id)
+        names += _SEP.join(_display(row)).encode('utf-8')
+        name_offsets.append(len(names))
+    return Segment(entries, name_ids, bytes(names), name_offsets)
+
+
+class Delta:
+    """
+    Patients créés, modifiés ou supprimés depuis la construction du segment :
+    liste triée de (clé, id) et noms par id (None pour un patient supprimé) ;
+    les clés du segment pour ces ids sont ignorées. Remplacé (copie) à chaque rafraîchissement, jamais modifié
+    une fois publié : les lectures se font sans verrou.
+    """
+
+    def __init__(self, entries=(), names=None):
+        self.entries = list(entries)
+        self.names = dict(names or {})
+
+    def find(self, prefix, needles, seen, limit, max_scan, skip=None):
+        start = bisect.bisect_left(self.entries, (prefix,))
+        found = []
+        for key, patient_id in self.entries[start:start + max_scan]:
+            if not key.startswith(prefix):
+                break
+            if ((needles and not _has_words(key, needles)) or patient_id in seen
+                    or (skip is not None and key.startswith(skip))):
+                continue
+            seen.add(patient_id)
+            found.append((key, patient_id))
+            if len(found) >= limit:
+                break
+        return found
+
+    def updated(self, changes):
+        """Nouveau Delta avec `changes` ({id: (nom, prénom, naissance), ou None si supprimé}) appliqués."""
+        delta = Delta(self.entries, self.names)
+        replaced = {patient_id for patient_id in changes if patient_id in delta.names}
+        if replaced:
+            delta.entries = [entry for entry in delta.entries if entry[1] not in replaced]
+        for patient_id, name in changes.items():
+            delta.names[patient_id] = name
+            if name is not None:
+                delta.entries.extend((key, patient_id) for key in name_keys(name[0], name[1]))
+        delta.entries.sort()
+        return delta
+
+
+class PatientIndex:
+    """
+    Index des noms de patients d'un processus.
+
+    Chargé en entier à la première recherche (puis toutes les `rebuild_interval`
+    secondes, ou quand le delta dépasse `merge_threshold` patients, par un
+    thread qui remplace le segment sans bloquer les recherches). Entre deux,
+    au plus toutes les `refresh_interval` secondes, une recherche vérifie le
+    compteur de la table patients (table_versions) et, s'il a bougé, relit les
+    patients modifiés depuis le dernier `updated_at` vu (moins `overlap`
+    secondes, pour les transactions validées après coup) dans le delta, et
+    en retire les patients supprimés (change_log) depuis la dernière
+    suppression vue. Compteurs et dates sont suivis shard par shard, et relus
+    sur le primaire : une réplique en retard ferait avancer les dates
+    au-delà de lignes qu'elle n'a pas encore reçues.
+    """
+
+    def __init__(self, refresh_interval=2, rebuild_interval=3600, merge_threshold=50000, overlap=60, max_scan=500):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.merge_threshold = merge_threshold
+        self.overlap = overlap
+        self.max_scan = max_scan
+        self._refresh_lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._pid = None
+        self._state = None
+        self._version = None
+        self._watermark = None
+        self._deleted_at = None
+        self._checked_at = 0.0
+        self._built_at = 0.0
+        self._rebuilding = False
+        self.builds = 0
+        self.refreshes = 0
+        self.build_seconds = None
+        self.errors = 0
+
+    # --- Chargement ---
+
+    def _build(self, app):
+        """Lit tous les patients et renvoie (segment, versions de la table, derniers updated_at), par shard."""
+        with app.app_context():
+            versions, watermarks = [], []
+            for index in range(shard_count()):
+                db = get_shard(index)
+                with db.cursor() as cursor:
+                    shard_versions, _ = versioning.table_versions(cursor, ['patients'])
+                    cursor.execute("SELECT MAX(updated_at) AS watermark FROM patients")
+                    versions.append(shard_versions.get('patients'))
+                    watermarks.append(cursor.fetchone()['watermark'] or datetime(1970, 1, 1))
+                db.rollback()
+            # Flux des shards fusionnés par id, comme l'exige build_segment
+            rows = merged_query(PATIENTS_SQL, key=lambda row: row['id'], size=app.config['STREAM_CHUNK_SIZE'])
+            try:
+                segment = build_segment(rows)
+            finally:
+                rows.close()
+        return segment, versions, watermarks
+
+    def _load(self, app):
+        start = time.perf_counter()
+        segment, version, watermark = self._build(app)
+        with self._refresh_lock:
+            self._state = (segment, Delta())
+            # Écritures validées pendant la lecture : rattrapées par le rafraîchissement suivant
+            self._version = version
+            self._watermark = watermark
+            # Suppressions antérieures à la lecture : déjà absentes du segment
+            self._deleted_at = list(watermark)
+            self._built_at = self._checked_at = time.monotonic()
+        self.builds += 1
+        self.build_seconds = round(time.perf_counter() - start, 3)
+
+    def _rebuild_in_background(self, app):
+        def run():
+            try:
+                self._load(app)
+            except Exception:
+                self.errors += 1
+                app.logger.exception("Échec de la reconstruction de l'index des patients")
+            finally:
+                self._rebuilding = False
+
+        self._rebuilding = True
+        threading.Thread(target=run, name='patient-index', daemon=True).start()
+
+    def _ensure_loaded(self, app):
+        if self._pid != os.getpid():
+            with self._build_lock:
+                if self._pid != os.getpid():
+                    self._state = None
+                    self._pid = os.getpid()
+        if self._state is None:
+            with self._build_lock:
+                if self._state is None:
+                    self._load(app)
+
+    def _refresh(self, app):
+        """Applique au delta les patients modifiés des shards dont le compteur de la table a bougé."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self._checked_at = time.monotonic()
+            for index in range(len(self._version)):
+                if self._rebuilding:
+                    break
+                with get_primary_shard(index).cursor() as cursor:
+                    versions, _ = versioning.table_versions(cursor, ['patients'])
+                    version = versions.get('patients')
+                    if version == self._version[index]:
+                        continue
+                    cursor.execute(CHANGED_SQL, (self._watermark[index], self.overlap, self.merge_threshold + 1))
+                    rows = cursor.fetchall()
+                    cursor.execute(DELETED_SQL, (self._deleted_at[index], self.overlap))
+                    deletions = cursor.fetchall()
+                if len(rows) > self.merge_threshold:
+                    # Import en masse : rechargement complet plutôt qu'un delta démesuré
+                    self._rebuild_in_background(app)
+                    return
+                segment, delta = self._state
+                changes = {}
+                for row in rows:
+                    name = _display(row)
+                    current = delta.names[row['id']] if row['id'] in delta.names else segment.name(row['id'])
+                    if current != name:
+                        changes[row['id']] = name
+                for patient_id in self._removed(deletions, changes):
+                    changes[patient_id] = None
+                if changes:
+                    self._state = (segment, delta.updated(changes))
+                self._watermark[index] = max([self._watermark[index]] + [row['updated_at'] for row in rows])
+                self._deleted_at[index] = max([self._deleted_at[index]] + [row['created_at'] for row in deletions])
+                self._version[index] = version
+                self.refreshes += 1
+            segment, delta = self._state
+            if not self._rebuilding and (len(delta.names) > self.merge_threshold
+                                         or time.monotonic() - self._built_at > self.rebuild_interval):
+                self._rebuild_in_background(app)
+        finally:
+            self._refresh_lock.release()
+
+    def _removed(self, deletions, changes):
+        """
+        Ids des entrées `deletions` de change_log à retirer de l'index : ni relus
+        dans `changes`, ni présents sur un shard (patient déplacé par un rééquilibrage).
+        """
+        deleted = {row['row_id'] for row in deletions if row['row_id'] not in changes}
+        if not deleted:
+            return set()
+        placeholders = ', '.join(['%s'] * len(deleted))
+        for index in range(len(self._version)):
+            with get_primary_shard(index).cursor() as cursor:
+                cursor.execute(f"SELECT id FROM patients WHERE id IN ({placeholders})", list(deleted))
+                deleted -= {row['id'] for row in cursor.fetchall()}
+        return deleted
+
+    # --- Recherche ---
+
+    def suggest(self, query, limit=10):
+        """Au plus `limit` patients correspondant à la saisie (voir `lookup`), index chargé et à jour."""
+        app = current_app._get_current_object()
+        self._ensure_loaded(app)
+        if time.monotonic() - self._checked_at >= self.refresh_interval:
+            try:
+                self._refresh(app)
+            except pymysql.MySQLError as e:
+                # L'index reste utilisable, un peu en retard
+                self.errors += 1
+                app.logger.warning("Rafraîchissement de l'index des patients impossible: %s", e)
+
+        return self.lookup(query, limit)
+
+    def lookup(self, query, limit=10):
+        """
+        Recherche dans l'état courant, sans accès à la base. Les noms commençant
+        par la saisie telle quelle (« dupont je ») viennent d'abord ; puis, si
+        besoin, ceux dont un mot commence par le premier mot saisi et qui ont un
+        mot commençant par chacun des suivants (« je dup » ; à deux mots saisis,
+        seulement si le premier mot n'est pas complet). Au plus `max_scan` clés sont examinées par passe.
+        """
+        tokens = search.tokenize(query)
+        if not tokens:
+            return []
+        segment, delta = self._state
+        found, seen = [], set()
+        passes = [(' '.join(tokens).encode('utf-8'), (), None)]
+        if len(tokens) > 1:
+            first = tokens[0].encode('utf-8')
+            # À deux mots, les clés commençant par le premier mot entier ont été vues par la première passe
+            passes.append((first, [b' ' + token.encode('utf-8') for token in tokens[1:]],
+                           first + b' ' if len(tokens) == 2 else None))
+        for prefix, needles, skip in passes:
+            wanted = limit - len(found)
+            if wanted <= 0:
+                break
+            matches = (segment.find(prefix, needles, delta.names, seen, wanted, self.max_scan, skip)
+                       + delta.find(prefix, needles, seen, wanted, self.max_scan, skip))
+            matches.sort()
+            found.extend(patient_id for _, patient_id in matches[:wanted])
+
+        results = []
+        for patient_id in found:
+            lastname, firstname, birthdate = delta.names.get(patient_id) or segment.name(patient_id)
+            results.append({'id': patient_id, 'lastname': lastname, 'firstname': firstname,
+                            'birthdate': birthdate or None})
+        return results
+
+    def stats(self):
+        if self._state is None or self._pid != os.getpid():
+            return {'loaded': False}
+        segment, delta = self._state
+        return {
+            'loaded': True,
+            'patients': segment.patients,
+            'keys': len(segment),
+            'segment_bytes': segment.nbytes(),
+            'delta_patients': len(delta.names),
+            'version': sum(version or 0 for version in self._version),
+            'builds': self.builds,
+            'build_seconds': self.build_seconds,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+        }
+
+
+def init_app(app):
+    app.extensions['patient_index'] = PatientIndex(
+        refresh_interval=app.config['SUGGEST_REFRESH_INTERVAL'],
+        rebuild_interval=app.config['SUGGEST_REBUILD_INTERVAL'],
+        merge_threshold=app.config['SUGGEST_MERGE_THRESHOLD'],
+        overlap=app.config['SUGGEST_OVERLAP'],
+        max_scan=app.config['SUGGEST_MAX_SCAN'],
+    )
@@ -0,0 +1,225 @@
+import threading
+import time
+from collections import deque
+
+import pymysql
+
+
+class PoolTimeout(Exception):
+    """Levée quand aucune connexion n'a pu être obtenue dans le délai imparti."""
+
+
+class PoolClosed(PoolTimeout):
+    """Levée par acquire() sur un pool fermé (traitée comme une indisponibilité)."""
+
+
+class _PooledConnection:
+    """Connexion PyMySQL et ses métadonnées de cycle de vie."""
+
+    __slots__ = ('conn', 'created_at', 'last_used')
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Pool de connexions MariaDB borné et thread-safe.
+
+    Les connexions inactives sont vérifiées (ping) avant d'être prêtées si elles
+    n'ont pas servi depuis `ping_interval` secondes, et recyclées au-delà de
+    `recycle` secondes d'âge. Au retour dans le pool, la transaction en cours
+    est annulée pour ne rien laisser fuiter d'une requête à l'autre.
+    """
+
+    # Fenêtre du débit d'emprunts de stats(), en secondes (un compteur par seconde)
+    RATE_WINDOW = 60
+
+    def __init__(self, connect_kwargs, min_size=1, max_size=10, timeout=5.0,
+                 recycle=3600, ping_interval=30):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Tailles de pool invalides (min=%s, max=%s)." % (min_size, max_size))
+        self._connect_kwargs = connect_kwargs
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_interval = ping_interval
+
+        self._lock = threading.Condition()
+        self._idle = deque()
+        self._in_use = {}
+        self._size = 0
+        self._closed = False
+
+        # Statistiques
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._recent_checkouts = deque()  # [seconde, emprunts], au plus RATE_WINDOW entrées
+        self._started_at = time.monotonic()
+
+    def _connect(self):
+        return _PooledConnection(pymysql.connect(**self._connect_kwargs))
+
+    def _is_usable(self, pooled):
+        now = time.monotonic()
+        if self.recycle and now - pooled.created_at > self.recycle:
+            return False
+        if self.ping_interval is not None and now - pooled.last_used > self.ping_interval:
+            try:
+                pooled.conn.ping(reconnect=False)
+            except pymysql.MySQLError:
+                return False
+        return True
+
+    def _discard(self, pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+        self._discarded += 1
+
+    def acquire(self, timeout=None):
+        """Emprunte une connexion au pool, en attendant au plus `timeout` secondes."""
+        timeout = self.timeout if timeout is None else timeout
+        start = time.monotonic()
+        deadline = start + timeout
+
+        while True:
+            pooled = None
+            create = False
+            with self._lock:
+                if self._closed:
+                    raise PoolClosed("Pool de connexions fermé.")
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            "Aucune connexion disponible après %.1fs (max_size=%s)." % (timeout, self.max_size))
+                    self._lock.wait(remaining)
+                    if self._closed:
+                        raise PoolClosed("Pool de connexions fermé.")
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    # On réserve la place avant de se connecter hors du verrou
+                    self._size += 1
+                    create = True
+
+            if create:
+                try:
+                    pooled = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._is_usable(pooled):
+                with self._lock:
+                    self._size -= 1
+                    self._discard(pooled)
+                    self._lock.notify()
+                continue
+
+            waited = time.monotonic() - start
+            with self._lock:
+                self._in_use[id(pooled.conn)] = pooled
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+                self._count_checkout(time.monotonic())
+            return pooled.conn
+
+    def _count_checkout(self, now):
+        """Compte un emprunt dans le compteur de la seconde courante (sous le verrou)."""
+        second = int(now)
+        if self._recent_checkouts and self._recent_checkouts[-1][0] == second:
+            self._recent_checkouts[-1][1] += 1
+        else:
+            self._recent_checkouts.append([second, 1])
+        while second - self._recent_checkouts[0][0] >= self.RATE_WINDOW:
+            self._recent_checkouts.popleft()
+
+    def release(self, conn, discard=False):
+        """Rend une connexion au pool après avoir réinitialisé son état transactionnel."""
+        with self._lock:
+            pooled = self._in_use.pop(id(conn), None)
+        if pooled is None:
+            return
+
+        if not discard:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+
+        with self._lock:
+            if discard or self._closed or not conn.open:
+                self._size -= 1
+                self._discard(pooled)
+            else:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+            self._lock.notify()
+
+    def fill(self):
+        """Ouvre des connexions jusqu'à atteindre `min_size`."""
+        while True:
+            with self._lock:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                pooled = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                raise
+            with self._lock:
+                self._idle.append(pooled)
+                self._lock.notify()
+
+    def close(self):
+        """
+        Ferme toutes les connexions inactives. Les connexions en cours d'usage
+        sont fermées à leur retour, et acquire() lève PoolClosed ensuite.
+        """
+        with self._lock:
+            self._closed = True
+            while self._idle:
+                self._size -= 1
+                self._discard(self._idle.pop())
+            self._lock.notify_all()
+
+    @property
+    def in_use(self):
+        """Nombre de connexions empruntées (répartition `least_loaded` entre répliques)."""
+        return len(self._in_use)
+
+    def stats(self, window=60):
+        """Instantané des compteurs du pool, utilisé pour le dimensionner sous charge."""
+        now = time.monotonic()
+        window = min(window, self.RATE_WINDOW)
+        with self._lock:
+            recent = sum(count for second, count in self._recent_checkouts if int(now) - second < window)
+            elapsed = min(window, now - self._started_at) or 1.0
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': len(self._in_use),
+                'idle': len(self._idle),
+                'checkouts': self._checkouts,
+                'checkouts_per_sec': round(recent / elapsed, 3),
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'wait_avg_ms': round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                'wait_max_ms': round(self._wait_max * 1000, 3),
+            }
@@ -0,0 +1,139 @@
+import itertools
+import math
+import threading
+import time
+
+import pymysql
+from pool import PoolTimeout
+
+STRATEGIES = ('round_robin', 'least_loaded')
+
+# Privilège REPLICATION CLIENT (REPLICA MONITOR depuis MariaDB 10.5) manquant pour SHOW SLAVE STATUS
+ER_SPECIFIC_ACCESS_DENIED = 1227
+
+
+class Replica:
+    """Réplique en lecture : son pool et son état vu par ce processus."""
+
+    def __init__(self, name, pool):
+        self.name = name
+        self.pool = pool
+        self.lag = None
+        self.lag_unknown = False
+        self.checked_at = None
+        self.down_until = 0.0
+        self.failures = 0
+        self.reads = 0
+
+
+class ReplicaSet:
+    """
+    Répliques en lecture d'un processus, choisies à tour de rôle ou selon le
+    nombre de connexions empruntées (`least_loaded`).
+
+    Le retard de réplication est mesuré au plus toutes les `check_interval`
+    secondes, sur la connexion qui vient d'être empruntée : aucun thread, et
+    une seule requête supplémentaire par intervalle et par réplique. Une
+    réplique injoignable, arrêtée ou en retard de plus de `max_lag` secondes
+    est écartée jusqu'à la vérification suivante ; `acquire` renvoie alors
+    None et l'appelant lit sur le primaire. Sans le privilège de lire
+    SHOW SLAVE STATUS, la réplique reste utilisée, avec un retard inconnu.
+    """
+
+    def __init__(self, replicas, strategy='round_robin', max_lag=5, check_interval=5, acquire_timeout=0.5):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Stratégie de répartition inconnue: {strategy} (parmi : {', '.join(STRATEGIES)}).")
+        self.replicas = replicas
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self.fallbacks = 0
+
+    def _candidates(self):
+        now = time.monotonic()
+        eligible = [r for r in self.replicas if r.down_until <= now]
+        if self.strategy == 'least_loaded':
+            return sorted(eligible, key=lambda r: r.pool.in_use)
+        start = next(self._counter) % len(eligible) if eligible else 0
+        return eligible[start:] + eligible[:start]
+
+    def _check_due(self, replica):
+        with self._lock:
+            now = time.monotonic()
+            if replica.checked_at is not None and now - replica.checked_at < self.check_interval:
+                return False
+            replica.checked_at = now
+            return True
+
+    @staticmethod
+    def replication_lag(conn):
+        """
+        Retard en secondes d'après SHOW SLAVE STATUS ; infini si la réplication
+        est arrêtée. Un serveur sans réplication configurée (instance de test
+        servant de réplique) est considéré à jour.
+        """
+        with conn.cursor() as cursor:
+            cursor.execute("SHOW SLAVE STATUS")
+            status = cursor.fetchone()
+        if status is None:
+            return 0
+        lag = status.get('Seconds_Behind_Master')
+        return math.inf if lag is None else lag
+
+    def _mark_down(self, replica):
+        replica.failures += 1
+        replica.down_until = time.monotonic() + self.check_interval
+
+    def acquire(self):
+        """Renvoie (réplique, connexion) ou None si aucune réplique n'est utilisable."""
+        for replica in self._candidates():
+            try:
+                conn = replica.pool.acquire(timeout=self.acquire_timeout)
+            except (PoolTimeout, pymysql.MySQLError):
+                self._mark_down(replica)
+                continue
+            if self._check_due(replica):
+                try:
+                    replica.lag = self.replication_lag(conn)
+                    replica.lag_unknown = False
+                except pymysql.MySQLError as e:
+                    if not e.args or e.args[0] != ER_SPECIFIC_ACCESS_DENIED:
+                        replica.pool.release(conn, discard=True)
+                        self._mark_down(replica)
+                        continue
+                    # La réplique répond : seul son retard ne peut pas être mesuré
+                    replica.lag = None
+                    replica.lag_unknown = True
+            if replica.lag is not None and replica.lag > self.max_lag:
+                replica.pool.release(conn)
+                replica.down_until = replica.checked_at + self.check_interval
+                continue
+            replica.reads += 1
+            return replica, conn
+        self.fallbacks += 1
+        return None
+
+    def close(self):
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'strategy': self.strategy,
+            'max_lag': self.max_lag,
+            'fallbacks': self.fallbacks,
+            'replicas': [{
+                'name': r.name,
+                'available': r.down_until <= now,
+                'lag': None if r.lag is None else (None if math.isinf(r.lag) else r.lag),
+                'replication_stopped': r.lag is not None and math.isinf(r.lag),
+                'lag_unknown': r.lag_unknown,
+                'reads': r.reads,
+                'failures': r.failures,
+                'pool': r.pool.stats(),
+            } for r in self.replicas],
+        }
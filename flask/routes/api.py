@@ -1,41 +1,317 @@
-from flask import Blueprint, jsonify, request
-from flask_login import login_required
+import heapq
+import os
+from flask import Blueprint, jsonify, request, current_app, Response, abort, send_file, url_for
+from werkzeug.wsgi import ClosingIterator
+from flask_login import current_user, login_required
 from decorators import role_required
 from werkzeug.security import generate_password_hash
-from db import get_db
+from db import get_db, get_shard, locate, merged_query, next_shard, read_only, scatter, shard_count, shard_of
+from streaming import json_stream
+import archive
+import bulk
+from models import User
+import search as search_engine
+from pagination import InvalidCursor, decode_cursor, encode_cursor, seek_condition
+import versioning
+from versioning import conditional
+import tokens
+import study_stats
+import loaders
+import jobs
+import changes as change_feed
 import pymysql
+from datetime import date, datetime
 
 api_bp = Blueprint('api', __name__)
 
+# --- Mises à jour par lot (PATCH) ---
+
+# Champs modifiables par table
+UPDATABLE_FIELDS = {
+    'patients': ('lastname', 'firstname', 'birthdate', 'gender'),
+    'studies': ('study_description', 'modality'),
+}
+
+def update_row(cursor, table, row_id, changes, expected_version=None):
+    """
+    Met à jour une ligne sans lecture préalable : le nombre de lignes affectées
+    suffit, `version` étant incrémentée à chaque écriture. Avec `expected_version`,
+    la mise à jour n'a lieu que si la ligne n'a pas changé depuis (verrou optimiste).
+    Renvoie True si la ligne a été modifiée.
+    """
+    assignments = ', '.join(f"{field} = %s" for field in changes)
+    sql = f"UPDATE {table} SET {assignments}, version = version + 1 WHERE id = %s"
+    params = [*changes.values(), row_id]
+    if expected_version is not None:
+        sql += " AND version = %s"
+        params.append(expected_version)
+    return cursor.execute(sql, params) == 1
+
+def current_versions(cursor, table, ids):
+    """Versions actuelles des lignes demandées, en une seule requête IN (...)."""
+    if not ids:
+        return {}
+    placeholders = ', '.join(['%s'] * len(ids))
+    cursor.execute(f"SELECT id, version FROM {table} WHERE id IN ({placeholders})", list(ids))
+    return {row['id']: row['version'] for row in cursor.fetchall()}
+
+def parse_patch_item(table, item):
+    """Valide un élément de lot ; renvoie (id, champs, version attendue) ou lève ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError("Chaque élément doit être un objet.")
+    row_id = item.get('id')
+    if not isinstance(row_id, int) or isinstance(row_id, bool):
+        raise ValueError("Champ 'id' entier manquant.")
+    version = item.get('version')
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+        raise ValueError("Le champ 'version' doit être un entier.")
+    changes = {key: value for key, value in item.items() if key in UPDATABLE_FIELDS[table]}
+    if not changes:
+        raise ValueError("Aucun champ valide à mettre à jour.")
+    return row_id, changes, version
+
+def batch_update(table):
+    """
+    Applique une liste de mises à jour partielles en une transaction par shard
+    (une seule sans shards).
+
+    Un UPDATE par élément, puis une unique lecture des versions pour les
+    éléments : les lignes non modifiées sont classées en `not_found` ou
+    `conflict` et les lignes modifiées reçoivent leur nouvelle version.
+    Les statistiques des études sont retirées puis recomptées en une fois pour
+    toutes les lignes du lot dont un champ statistique change.
+    Avec des shards, les UPDATE de tous les shards sont exécutés avant le
+    premier commit : une erreur SQL n'applique rien (500). Seul l'échec d'un
+    commit, après celui d'autres shards, laisse le lot appliqué en partie :
+    les éléments des shards annulés sont alors en `failed`.
+    """
+    items = request.get_json(silent=True)
+    if not isinstance(items, list) or not items:
+        return jsonify(status="error", message="Une liste non vide de mises à jour est attendue."), 400
+    max_items = current_app.config['PATCH_MAX_ITEMS']
+    if len(items) > max_items:
+        return jsonify(status="error", message=f"Trop d'éléments ({len(items)}), maximum {max_items} par appel."), 413
+
+    results, updates = [], []
+    for index, item in enumerate(items):
+        try:
+            updates.append((index, *parse_patch_item(table, item)))
+        except ValueError as e:
+            results.append({'index': index, 'id': item.get('id') if isinstance(item, dict) else None,
+                            'status': 'invalid', 'message': str(e)})
+    groups = {}
+    for update in updates:
+        groups.setdefault(update[1], []).append(update)
+    by_shard = {}
+    for row_id, shard in locate(table, list(groups)).items():
+        by_shard.setdefault(shard, []).extend(groups[row_id])
+
+    versions, pending = {}, []
+    try:
+        for shard, shard_updates in sorted(by_shard.items()):
+            stat_ids = sorted({row_id for _, row_id, changes, _ in shard_updates
+                               if study_stats.affects(table, changes)})
+            db = get_shard(shard)
+            pending.append((db, []))
+            with db.cursor() as cursor:
+                study_stats.remove(cursor, table, stat_ids)
+                updated_ids = []
+                for index, row_id, changes, version in shard_updates:
+                    updated = update_row(cursor, table, row_id, changes, version)
+                    result = {'index': index, 'id': row_id, 'status': 'updated' if updated else None,
+                              'expected_version': version}
+                    results.append(result)
+                    pending[-1][1].append(result)
+                    if updated:
+                        updated_ids.append(row_id)
+                study_stats.add(cursor, table, stat_ids)
+                versions.update(current_versions(cursor, table, {row_id for _, row_id, _, _ in shard_updates}))
+                if updated_ids:
+                    versioning.touch(cursor, table)
+                    change_feed.record(cursor, table, updated_ids)
+    except pymysql.MySQLError as e:
+        for db, _ in pending:
+            db.rollback()
+        return jsonify(status="error", message=f"Erreur lors de la mise à jour par lot (rien n'a été appliqué): {e}"), 500
+
+    failure = None
+    for db, shard_results in pending:
+        if failure is None:
+            try:
+                db.commit()
+                continue
+            except pymysql.MySQLError as e:
+                failure = f"Transaction annulée: {e}"
+        db.rollback()
+        for result in shard_results:
+            result['status'], result['message'] = 'failed', failure
+
+    results.sort(key=lambda r: r['index'])
+    for result in results:
+        expected = result.pop('expected_version', None)
+        if result['status'] in ('invalid', 'failed'):
+            continue
+        current = versions.get(result['id'])
+        if result['status'] == 'updated':
+            result['version'] = current
+        elif current is None:
+            result['status'] = 'not_found'
+        else:
+            result['status'] = 'conflict'
+            result['version'] = current
+            result['message'] = f"Version attendue {expected}, version actuelle {current}."
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    status = "success" if counts.get('updated') == len(results) else "partial"
+    return jsonify(status=status, counts=counts, results=results)
+
 # --- Routes API pour les Patients ---
 
+# Clés de tri autorisées pour la pagination des patients
+PATIENT_SORTS = {
+    'id': ['id'],
+    'name': ['lastname', 'firstname', 'id'],
+}
+
+# Fusion des pages des shards dans l'ordre du tri ; la comparaison des noms
+# approche la collation utf8mb4_unicode_ci (casse et accents ignorés)
+PATIENT_MERGE_KEYS = {
+    'id': lambda row: row['id'],
+    'name': lambda row: (search_engine.fold(row['lastname']), search_engine.fold(row['firstname']), row['id']),
+}
+
+def count_patients(mode):
+    """
+    Nombre total de patients, tous shards confondus : exact (compteur mis en
+    cache), estimé (statistiques de la table) ou omis.
+    """
+    if mode == 'none':
+        return None
+    if mode == 'estimate':
+        rows = scatter("SELECT TABLE_ROWS FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'patients'")
+        if not all(rows):
+            return None
+        return sum(shard_rows[0]['TABLE_ROWS'] for shard_rows in rows)
+    cache = current_app.extensions['count_cache']
+    total = cache.get('patients')
+    if total is None:
+        total = sum(shard_rows[0]['total'] for shard_rows in scatter("SELECT COUNT(*) AS total FROM patients"))
+        cache.set('patients', total)
+    return total
+
 @api_bp.route('/patients', methods=['GET'])
 @login_required
+@read_only
+@conditional('patients', includes=('studies',))
 def get_patients():
     """
-    Lister tous les patients avec pagination.
+    Lister les patients, par page (`page`) ou par curseur (`cursor` / `next_cursor`),
+    ou les lire par ids (`ids=1,2,3`). `include=studies` ajoute leurs études.
+    """
+    try:
+        includes = loaders.parse_include(request.args.get('include'))
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+    if 'ids' in request.args:
+        return get_patients_by_ids(includes)
+
+    per_page = request.args.get('per_page', 10, type=int)
+    per_page = max(1, min(per_page, current_app.config['PATIENTS_MAX_PER_PAGE']))
+    sort = request.args.get('sort', 'id')
+    if sort not in PATIENT_SORTS:
+        return jsonify(status="error", message=f"Tri inconnu: {sort}."), 400
+    columns = PATIENT_SORTS[sort]
+    order_by = ', '.join(columns)
+
+    # Le mode curseur est activé par la présence du paramètre (vide pour la première page)
+    token = request.args.get('cursor')
+    total_mode = request.args.get('total', 'none' if token is not None else 'exact')
+    if total_mode not in ('exact', 'estimate', 'none'):
+        return jsonify(status="error", message=f"Mode de total inconnu: {total_mode}."), 400
+
+    # Chaque shard renvoie sa propre page, fusionnée ici : avec plusieurs shards,
+    # une page OFFSET lit les `offset + per_page` premières lignes de chacun
+    merge_key = PATIENT_MERGE_KEYS[sort]
+    try:
+        if token is not None:
+            if token:
+                try:
+                    values = decode_cursor(token, sort, len(columns))
+                except InvalidCursor as e:
+                    return jsonify(status="error", message=str(e)), 400
+                condition, condition_params = seek_condition(columns)
+                pages = scatter(f"SELECT * FROM patients WHERE {condition} ORDER BY {order_by} LIMIT %s",
+                                (*condition_params(values), per_page + 1))
+            else:
+                pages = scatter(f"SELECT * FROM patients ORDER BY {order_by} LIMIT %s", (per_page + 1,))
+            patients = list(heapq.merge(*pages, key=merge_key))
+            has_more = len(patients) > per_page
+            patients = patients[:per_page]
+            last = patients[-1] if patients else None
+            response = {
+                'per_page': per_page,
+                'sort': sort,
+                'data': patients,
+                'next_cursor': encode_cursor(sort, [last[c] for c in columns]) if has_more else None,
+            }
+        else:
+            page = max(1, request.args.get('page', 1, type=int))
+            offset = (page - 1) * per_page
+            skip = 0 if shard_count() > 1 else offset
+            pages = scatter(f"SELECT * FROM patients ORDER BY {order_by} LIMIT %s OFFSET %s",
+                            (offset + per_page - skip, skip))
+            patients = list(heapq.merge(*pages, key=merge_key))[offset - skip:offset - skip + per_page]
+            response = {
+                'page': page,
+                'per_page': per_page,
+                'data': patients
+            }
+
+        if 'studies' in includes:
+            loaders.attach_all_studies(patients)
+
+        total = count_patients(total_mode)
+        if total is not None:
+            response['total'] = total
+            response['total_is_estimate'] = total_mode == 'estimate'
+
+        return jsonify(response)
+    except pymysql.MySQLError as e:
+        return jsonify(status="error", message=f"Erreur lors de la récupération des patients: {e}"), 500
+
+def get_patients_by_ids(includes):
+    """
+    Lecture groupée : une requête pour les patients et une par relation incluse
+    (par shard concerné), quel que soit le nombre d'ids (borné par PATIENTS_MAX_IDS).
     """
-    page = request.args.get('page', 1, type=int)
-    per_page = 10  # Nombre de résultats par page
-    offset = (page - 1) * per_page
+    try:
+        ids = loaders.parse_ids(request.args['ids'], current_app.config['PATIENTS_MAX_IDS'])
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
 
-    db = get_db()
     try:
-        with db.cursor() as cursor:
-            cursor.execute("SELECT * FROM patients LIMIT %s OFFSET %s", (per_page, offset))
-            patients = cursor.fetchall()
-
-            cursor.execute("SELECT COUNT(*) FROM patients")
-            total = cursor.fetchone()['COUNT(*)']
-
-        return jsonify({
-            'page': page,
-            'per_page': per_page,
-            'total': total,
-            'data': patients
-        })
+        patients, missing = loaders.load_patients(ids, includes)
     except pymysql.MySQLError as e:
         return jsonify(status="error", message=f"Erreur lors de la récupération des patients: {e}"), 500
+    return jsonify(data=patients, missing=missing)
+
+@api_bp.route('/patients/suggest', methods=['GET'])
+@login_required
+@read_only
+def suggest_patients():
+    """
+    Saisie semi-automatique : patients dont un mot du nom commence par `q`
+    (insensible à la casse et aux accents), servis par l'index en mémoire.
+    """
+    limit = max(1, min(request.args.get('limit', 10, type=int), current_app.config['SUGGEST_MAX_LIMIT']))
+    try:
+        results = current_app.extensions['patient_index'].suggest(request.args.get('q', ''), limit)
+    except pymysql.MySQLError as e:
+        return jsonify(status="error", message=f"Erreur lors du chargement de l'index des patients: {e}"), 500
+    return jsonify(results)
 
 @api_bp.route('/patients', methods=['POST'])
 @login_required
@@ -48,13 +324,18 @@ def create_patient():
     if not data or not all(k in data for k in ['lastname', 'firstname']):
         return jsonify(status="error", message="Données manquantes pour la création du patient."), 400
 
-    db = get_db()
+    # Le shard attribue l'id : l'auto-incrément de chaque shard ne produit que les siens
+    db = get_shard(next_shard())
     try:
         with db.cursor() as cursor:
             sql = "INSERT INTO patients (lastname, firstname, birthdate, gender) VALUES (%s, %s, %s, %s)"
             cursor.execute(sql, (data['lastname'], data['firstname'], data.get('birthdate'), data.get('gender')))
+            patient_id = cursor.lastrowid
+            versioning.touch(cursor, 'patients')
+            change_feed.record(cursor, 'patients', [patient_id], 'insert')
         db.commit()
-        return jsonify(status="success", message="Patient créé avec succès.", patient_id=cursor.lastrowid), 201
+        current_app.extensions['count_cache'].invalidate('patients')
+        return jsonify(status="success", message="Patient créé avec succès.", patient_id=patient_id), 201
     except pymysql.MySQLError as e:
         db.rollback()
         return jsonify(status="error", message=f"Erreur lors de la création du patient: {e}"), 500
@@ -63,15 +344,44 @@ def create_patient():
 @login_required
 def get_patient(patient_id):
     """
-    Voir un patient.
+    Voir un patient (avec `include=studies`, ses études). Répond 304 si la
+    version connue du client (If-None-Match) est à jour.
     """
-    db = get_db()
+    try:
+        includes = loaders.parse_include(request.args.get('include'))
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+
+    db = get_shard(shard_of(patient_id))
     try:
         with db.cursor() as cursor:
+            if request.if_none_match and not includes:
+                # Sonde légère : seule la version est lue pour valider le cache du client
+                cursor.execute("SELECT version, updated_at FROM patients WHERE id = %s", (patient_id,))
+                current = cursor.fetchone()
+                if current:
+                    etag = versioning.row_etag('patients', patient_id, current['version'])
+                    matched = versioning.matching_etag(etag)
+                    if matched:
+                        versioning.stats.record(request.endpoint, hit=True)
+                        return versioning.not_modified(matched, current['updated_at'])
             cursor.execute("SELECT * FROM patients WHERE id = %s", (patient_id,))
             patient = cursor.fetchone()
+            etag = patient and versioning.row_etag('patients', patient_id, patient['version'])
+            if patient and 'studies' in includes:
+                loaders.attach_studies(cursor, [patient])
+                # Les études changent sans toucher au patient : l'ETag couvre aussi leurs versions
+                etag = versioning.composite_etag('patients', patient_id, patient['version'], patient['studies'])
+                matched = versioning.matching_etag(etag)
+                if matched:
+                    versioning.stats.record(request.endpoint, hit=True)
+                    return versioning.not_modified(matched)
         if patient:
-            return jsonify(patient)
+            versioning.stats.record(request.endpoint, hit=False)
+            response = jsonify(patient)
+            response.set_etag(etag)
+            response.last_modified = patient['updated_at']
+            return response
         else:
             return jsonify(status="error", message="Patient non trouvé."), 404
     except pymysql.MySQLError as e:
@@ -88,50 +398,65 @@ def update_patient(patient_id):
     if not data:
         return jsonify(status="error", message="Données manquantes pour la mise à jour."), 400
 
-    db = get_db()
+    changes = {key: value for key, value in data.items() if key in UPDATABLE_FIELDS['patients']}
+    if not changes:
+        return jsonify(status="error", message="Aucun champ valide à mettre à jour."), 400
+
+    db = get_shard(shard_of(patient_id))
     try:
         with db.cursor() as cursor:
-            # Vérifier si le patient existe
-            cursor.execute("SELECT * FROM patients WHERE id = %s", (patient_id,))
-            if not cursor.fetchone():
+            recount = [patient_id] if study_stats.affects('patients', changes) else []
+            study_stats.remove(cursor, 'patients', recount)
+            if not update_row(cursor, 'patients', patient_id, changes, data.get('version')):
+                db.rollback()
+                if 'version' in data and current_versions(cursor, 'patients', [patient_id]):
+                    return jsonify(status="error", message="Le patient a été modifié entre-temps."), 409
                 return jsonify(status="error", message="Patient non trouvé."), 404
-
-            # Construire la requête de mise à jour dynamiquement
-            fields = []
-            params = []
-            for key, value in data.items():
-                if key in ['lastname', 'firstname', 'birthdate', 'gender']:
-                    fields.append(f"{key} = %s")
-                    params.append(value)
-
-            if not fields:
-                return jsonify(status="error", message="Aucun champ valide à mettre à jour."), 400
-
-            sql = f"UPDATE patients SET {', '.join(fields)} WHERE id = %s"
-            params.append(patient_id)
-            cursor.execute(sql, tuple(params))
+            study_stats.add(cursor, 'patients', recount)
+            versioning.touch(cursor, 'patients')
+            change_feed.record(cursor, 'patients', [patient_id])
         db.commit()
         return jsonify(status="success", message="Patient mis à jour avec succès.")
     except pymysql.MySQLError as e:
         db.rollback()
         return jsonify(status="error", message=f"Erreur lors de la mise à jour du patient: {e}"), 500
 
+@api_bp.route('/patients', methods=['PATCH'])
+@login_required
+@role_required('modification')
+def patch_patients():
+    """
+    Mettre à jour plusieurs patients : liste de {id, [version], champs...}, statut par élément.
+    """
+    return batch_update('patients')
+
 # --- Routes API pour les Studies ---
 
 @api_bp.route('/studies', methods=['GET'])
 @login_required
+@read_only
+@conditional('studies', vary=('Accept',))
 def get_studies():
     """
-    Lister toutes les études.
+    Lister les études, en flux (tableau JSON ou NDJSON selon l'en-tête Accept).
+    Seules les études de la fenêtre chaude par défaut : `archive=1` ajoute
+    l'archive, `from` et `to` (dates incluses) bornent la période.
+    Avec des shards ou l'archive, les flux de chacun sont fusionnés par id.
     """
-    db = get_db()
     try:
-        with db.cursor() as cursor:
-            cursor.execute("SELECT * FROM studies")
-            studies = cursor.fetchall()
-        return jsonify(studies)
+        date_from, date_to, include_archive = archive.parse_range(request.args)
+    except ValueError as e:
+        return jsonify(status="error", message=f"Date invalide (attendu AAAA-MM-JJ): {e}"), 400
+    tables = archive.study_tables(include_archive)
+    conditions, params = archive.date_conditions('study_date', date_from, date_to)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = " ORDER BY id" if shard_count() > 1 or len(tables) > 1 else ""
+    try:
+        statements = [f"SELECT {', '.join(archive.COLUMNS)} FROM {table}{where}{order}" for table in tables]
+        rows = merged_query(statements, params, key=lambda row: row['id'], size=current_app.config['STREAM_CHUNK_SIZE'])
     except pymysql.MySQLError as e:
         return jsonify(status="error", message=f"Erreur lors de la récupération des études: {e}"), 500
+    return json_stream(rows)
 
 @api_bp.route('/studies', methods=['POST'])
 @login_required
@@ -143,19 +468,28 @@ def create_study():
     data = request.get_json()
     if not data or not all(k in data for k in ['patient_id', 'study_description', 'modality']):
         return jsonify(status="error", message="Données manquantes pour la création de l'étude."), 400
+    try:
+        patient_id = int(data['patient_id'])
+    except (TypeError, ValueError):
+        return jsonify(status="error", message="patient_id doit être un entier."), 400
 
-    db = get_db()
+    # L'étude est créée sur le shard de son patient
+    db = get_shard(shard_of(patient_id))
     try:
         with db.cursor() as cursor:
             # Vérifier si le patient existe
-            cursor.execute("SELECT id FROM patients WHERE id = %s", (data['patient_id'],))
+            cursor.execute("SELECT id FROM patients WHERE id = %s", (patient_id,))
             if not cursor.fetchone():
                 return jsonify(status="error", message="Patient non trouvé pour lier l'étude."), 404
 
             sql = "INSERT INTO studies (patient_id, study_date, study_description, modality) VALUES (%s, NOW(), %s, %s)"
-            cursor.execute(sql, (data['patient_id'], data['study_description'], data['modality']))
+            cursor.execute(sql, (patient_id, data['study_description'], data['modality']))
+            study_id = cursor.lastrowid
+            study_stats.add(cursor, 'studies', [study_id])
+            versioning.touch(cursor, 'studies')
+            change_feed.record(cursor, 'studies', [study_id], 'insert')
         db.commit()
-        return jsonify(status="success", message="Étude créée avec succès.", study_id=cursor.lastrowid), 201
+        return jsonify(status="success", message="Étude créée avec succès.", study_id=study_id), 201
     except pymysql.MySQLError as e:
         db.rollback()
         return jsonify(status="error", message=f"Erreur lors de la création de l'étude: {e}"), 500
@@ -171,33 +505,136 @@ def update_study(study_id):
     if not data:
         return jsonify(status="error", message="Données manquantes pour la mise à jour."), 400
 
-    db = get_db()
+    changes = {key: value for key, value in data.items() if key in UPDATABLE_FIELDS['studies']}
+    if not changes:
+        return jsonify(status="error", message="Aucun champ valide à mettre à jour."), 400
+
+    db = get_shard(locate('studies', [study_id])[study_id])
     try:
         with db.cursor() as cursor:
-             # Vérifier si l'étude existe
-            cursor.execute("SELECT * FROM studies WHERE id = %s", (study_id,))
-            if not cursor.fetchone():
+            recount = [study_id] if study_stats.affects('studies', changes) else []
+            study_stats.remove(cursor, 'studies', recount)
+            if not update_row(cursor, 'studies', study_id, changes, data.get('version')):
+                db.rollback()
+                if 'version' in data and current_versions(cursor, 'studies', [study_id]):
+                    return jsonify(status="error", message="L'étude a été modifiée entre-temps."), 409
                 return jsonify(status="error", message="Étude non trouvée."), 404
-
-            fields = []
-            params = []
-            for key, value in data.items():
-                if key in ['study_description', 'modality']:
-                    fields.append(f"{key} = %s")
-                    params.append(value)
-
-            if not fields:
-                return jsonify(status="error", message="Aucun champ valide à mettre à jour."), 400
-
-            sql = f"UPDATE studies SET {', '.join(fields)} WHERE id = %s"
-            params.append(study_id)
-            cursor.execute(sql, tuple(params))
+            study_stats.add(cursor, 'studies', recount)
+            versioning.touch(cursor, 'studies')
+            change_feed.record(cursor, 'studies', [study_id])
         db.commit()
         return jsonify(status="success", message="Étude mise à jour avec succès.")
     except pymysql.MySQLError as e:
         db.rollback()
         return jsonify(status="error", message=f"Erreur lors de la mise à jour de l'étude: {e}"), 500
 
+@api_bp.route('/studies', methods=['PATCH'])
+@login_required
+@role_required('modification')
+def patch_studies():
+    """
+    Mettre à jour plusieurs études : liste de {id, [version], champs...}, statut par élément.
+    """
+    return batch_update('studies')
+
+# --- Routes API d'import en masse ---
+
+IMPORT_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/json': 'ndjson',
+}
+
+@api_bp.route('/import/<any(patients, studies):kind>', methods=['POST'])
+@login_required
+@role_required('modification')
+def bulk_import(kind):
+    """
+    Importer des patients ou des études en masse depuis un flux NDJSON ou CSV.
+    Le corps est lu au fil de l'eau et inséré par lots (`chunk_size`), un lot par transaction.
+    Avec `async=1`, il est seulement déposé et l'import suivi comme une tâche de fond (202).
+    """
+    fmt = IMPORT_FORMATS.get(request.mimetype)
+    if fmt is None:
+        return jsonify(status="error", message="Format non supporté (text/csv ou application/x-ndjson)."), 415
+
+    if request.args.get('async', type=int):
+        # Gros fichiers : le corps est déposé sur disque et importé par une tâche de fond
+        params = {'kind': kind, 'fmt': fmt, 'delimiter': request.args.get('delimiter', ','),
+                  'chunk_size': request.args.get('chunk_size', type=int),
+                  'file': jobs.save_upload(request.stream, f'import-{kind}', fmt)}
+        db = get_db()
+        try:
+            with db.cursor() as cursor:
+                job_id = jobs.enqueue(cursor, 'import', params, int(current_user.id))
+                job = jobs.fetch(cursor, job_id)
+            db.commit()
+        except pymysql.MySQLError as e:
+            db.rollback()
+            os.remove(os.path.join(current_app.config['JOBS_DIR'], params['file']))
+            return jsonify(status="error", message=f"Erreur lors de la mise en file de l'import: {e}"), 500
+        jobs.ensure_runner(current_app._get_current_object())
+        return _job_response(job, 202)
+
+    rows = bulk.read_rows(request.stream, fmt, delimiter=request.args.get('delimiter', ','))
+    report = bulk.import_rows(kind, rows, chunk_size=request.args.get('chunk_size', type=int))
+    if kind == 'patients' and report.inserted:
+        current_app.extensions['count_cache'].invalidate('patients')
+
+    status = "success" if not report.failed else ("partial" if report.inserted else "error")
+    return jsonify(status=status, **report.as_dict()), 200 if report.inserted or not report.failed else 422
+
+# --- Route API d'export en masse ---
+
+EXPORT_MIMETYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+@api_bp.route('/export/patients', methods=['GET'])
+@login_required
+@read_only
+def bulk_export():
+    """
+    Exporter tous les patients (avec `include=studies`, leurs études) en NDJSON ou CSV.
+    `since_id` / `until_id` (plage d'ids) et `updated_since` (date ISO) servent aux exports incrémentaux ;
+    `archive=1` ajoute les études archivées.
+    La réponse est compressée en gzip à la volée si le client l'accepte.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_MIMETYPES:
+        return jsonify(status="error", message=f"Format d'export inconnu: {fmt}."), 400
+    include_studies = request.args.get('include') == 'studies'
+    # Un filtre illisible ne doit pas se transformer en export complet
+    bounds = {}
+    for key in ('since_id', 'until_id'):
+        value = request.args.get(key) or None
+        if value is not None and not value.isdigit():
+            return jsonify(status="error", message=f"'{key}' doit être un entier."), 400
+        bounds[key] = int(value) if value is not None else None
+    try:
+        updated_since = (datetime.fromisoformat(request.args['updated_since'])
+                         if request.args.get('updated_since') else None)
+    except ValueError as e:
+        return jsonify(status="error", message=f"'updated_since' doit être une date ISO 8601: {e}"), 400
+
+    try:
+        rows = bulk.export_rows(include_studies, updated_since=updated_since, **bounds,
+                                size=current_app.config['STREAM_CHUNK_SIZE'],
+                                include_archive=request.args.get('archive') in ('1', 'true'))
+    except pymysql.MySQLError as e:
+        return jsonify(status="error", message=f"Erreur lors de l'export des patients: {e}"), 500
+
+    rows_out = bulk.nest_studies(rows) if include_studies and fmt == 'ndjson' else rows
+    body = bulk.encode_rows(rows_out, fmt, current_app.json.dumps, current_app.config['STREAM_CHUNK_SIZE'])
+    headers = {'Content-Disposition': f'attachment; filename=patients.{fmt}'}
+    if 'gzip' in request.accept_encodings:
+        body = bulk.gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+    return Response(ClosingIterator(body, rows.close), mimetype=EXPORT_MIMETYPES[fmt], headers=headers)
+
 # --- Routes API pour les Utilisateurs (Admin) ---
 
 @api_bp.route('/users', methods=['GET'])
@@ -244,40 +681,297 @@ def update_user(user_id):
             cursor.execute("UPDATE users SET role_id = %s WHERE id = %s", (role_id, user_id))
         if is_active is not None:
             cursor.execute("UPDATE users SET is_active = %s WHERE id = %s", (is_active, user_id))
+        if role_id is not None or (is_active is not None and not is_active):
+            # Le rôle est figé dans les jetons émis : ils ne doivent pas survivre au changement
+            tokens.revoke(cursor, user_id)
+        # Les autres workers vident leur cache d'utilisateurs (UsersVersion)
+        versioning.touch(cursor, 'users')
     db.commit()
+    User.invalidate(user_id)
     return jsonify(status="success", message="Utilisateur mis à jour.")
 
+@api_bp.route('/users/<int:user_id>/tokens', methods=['POST'])
+@login_required
+@role_required('admin')
+def create_token(user_id):
+    """
+    Émettre un jeton d'API pour un utilisateur : {scopes: ["read", "write"], ttl: secondes}.
+    Le jeton n'est renvoyé qu'une fois ; seul son identifiant (jti) est conservé en base.
+    """
+    data = request.get_json(silent=True) or {}
+    config = current_app.config
+    try:
+        scopes = tokens.parse_scopes(data.get('scopes'))
+        ttl = int(data.get('ttl', config['API_TOKEN_TTL']))
+    except (tokens.InvalidToken, TypeError, ValueError) as e:
+        return jsonify(status="error", message=str(e)), 400
+    if not 0 < ttl <= config['API_TOKEN_MAX_TTL']:
+        return jsonify(status="error", message=f"ttl doit être compris entre 1 et {config['API_TOKEN_MAX_TTL']}."), 400
+
+    db = get_db()
+    user = User.get(user_id)
+    if user is None or not user.is_active:
+        return jsonify(status="error", message="Utilisateur non trouvé ou désactivé."), 404
+    token, claims = tokens.issue(current_app, user.id, user.username, user.role, scopes, ttl)
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("INSERT INTO api_tokens (jti, user_id, role, scopes, expires_at) "
+                           "VALUES (%s, %s, %s, %s, FROM_UNIXTIME(%s))",
+                           (claims['jti'], user.id, user.role, ','.join(claims['scp']), claims['exp']))
+        db.commit()
+    except pymysql.MySQLError as e:
+        db.rollback()
+        return jsonify(status="error", message=f"Erreur lors de l'émission du jeton: {e}"), 500
+    return jsonify(status="success", token=token, jti=claims['jti'], role=claims['role'], scopes=claims['scp'],
+                   expires_at=datetime.fromtimestamp(claims['exp']).isoformat()), 201
+
+@api_bp.route('/users/<int:user_id>/tokens', methods=['GET'])
+@login_required
+@role_required('admin')
+def get_tokens(user_id):
+    with get_db().cursor() as cursor:
+        cursor.execute("SELECT jti, role, scopes, issued_at, expires_at, revoked_at FROM api_tokens "
+                       "WHERE user_id = %s ORDER BY issued_at DESC", (user_id,))
+        rows = cursor.fetchall()
+    return jsonify(rows)
+
+@api_bp.route('/users/<int:user_id>/tokens/<jti>', methods=['DELETE'])
+@login_required
+@role_required('admin')
+def revoke_token(user_id, jti):
+    db = get_db()
+    try:
+        with db.cursor() as cursor:
+            revoked = tokens.revoke(cursor, user_id, jti)
+        db.commit()
+    except pymysql.MySQLError as e:
+        db.rollback()
+        return jsonify(status="error", message=f"Erreur lors de la révocation du jeton: {e}"), 500
+    if not revoked:
+        return jsonify(status="error", message="Jeton actif non trouvé."), 404
+    return jsonify(status="success", message="Jeton révoqué.")
+
 # --- Route de Recherche ---
 
 @api_bp.route('/search', methods=['GET'])
 @login_required
+@read_only
+@conditional('patients', 'studies', vary=('Accept',))
 def search():
     """
-    Recherche multi-champs sur les patients et les études.
+    Recherche plein texte classée sur les patients et les études.
+    Paramètres : `q`, `fields` (name, description, modality) et `limit` ;
+    `from` et `to` (dates incluses) ne gardent que les études de la période,
+    `archive=1` cherche aussi dans les études archivées.
     """
     query = request.args.get('q', '')
     if not query:
         return jsonify(status="error", message="Le paramètre de recherche 'q' est manquant."), 400
 
+    try:
+        fields = search_engine.parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+    try:
+        date_from, date_to, include_archive = archive.parse_range(request.args)
+    except ValueError as e:
+        return jsonify(status="error", message=f"Date invalide (attendu AAAA-MM-JJ): {e}"), 400
+    limit = request.args.get('limit', 50, type=int)
+    limit = max(1, min(limit, current_app.config['SEARCH_MAX_LIMIT']))
+
+    try:
+        results = search_engine.search_shards(query, fields=fields, limit=limit, date_from=date_from,
+                                              date_to=date_to, include_archive=include_archive)
+        # Résultats bornés par `limit` : pas besoin de curseur serveur, seul le format suit l'en-tête Accept
+        return json_stream(results)
+    except pymysql.MySQLError as e:
+        return jsonify(status="error", message=f"Erreur lors de la recherche: {e}"), 500
+
+# --- Route de Statistiques ---
+
+@api_bp.route('/stats', methods=['GET'])
+@login_required
+@read_only
+@conditional('patients', 'studies')
+def get_stats():
+    """
+    Nombre d'études lu dans les tables de synthèse, sans parcourir `studies`.
+    Paramètres : `group` (day, month, modality ou cohort_day, gender, age_band,
+    séparés par des virgules ; modality par défaut), `from` et `to` (dates incluses).
+    """
+    group = [name.strip() for name in request.args.get('group', 'modality').split(',') if name.strip()]
+    try:
+        date_from = date.fromisoformat(request.args['from']) if request.args.get('from') else None
+        date_to = date.fromisoformat(request.args['to']) if request.args.get('to') else None
+    except ValueError as e:
+        return jsonify(status="error", message=f"Date invalide (attendu AAAA-MM-JJ): {e}"), 400
+
+    try:
+        rows = study_stats.summary_all(group, date_from, date_to)
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+    except pymysql.MySQLError as e:
+        return jsonify(status="error", message=f"Erreur lors du calcul des statistiques: {e}"), 500
+    return jsonify(group=group, date_from=date_from and date_from.isoformat(),
+                   date_to=date_to and date_to.isoformat(),
+                   total=sum(row['study_count'] for row in rows), rows=rows)
+
+# --- Flux des modifications (Server-Sent Events) ---
+
+@api_bp.route('/changes', methods=['GET'])
+@login_required
+def change_stream():
+    """
+    Pousse les patients et études créés ou modifiés (`tables`, les deux par
+    défaut) à partir du jeton de reprise : en-tête Last-Event-ID envoyé par le
+    navigateur à la reconnexion, ou paramètre `last_event_id` à la première.
+    Les abonnés n'occupent aucune connexion à la base pendant le flux.
+    """
+    tables = tuple(name for name in request.args.get('tables', ','.join(change_feed.TABLES)).split(',') if name)
+    unknown = set(tables) - set(change_feed.TABLES)
+    if not tables or unknown:
+        return jsonify(status="error", message=f"Tables inconnues: {', '.join(sorted(unknown)) or '(aucune)'} "
+                                               f"(parmi : {', '.join(change_feed.TABLES)})."), 400
+    token = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        resume = change_feed.parse_token(token) if token else None
+    except ValueError:
+        return jsonify(status="error", message="Jeton de reprise invalide."), 400
+
+    config = current_app.config
+    try:
+        subscription = change_feed.get_feed().subscribe(resume, tables)
+    except change_feed.FeedFull:
+        return jsonify(status="error", message="Trop d'abonnés au flux des modifications."), 503, {'Retry-After': '30'}
+    except pymysql.MySQLError as e:
+        return jsonify(status="error", message=f"Erreur lors de l'ouverture du flux des modifications: {e}"), 500
+    stream = subscription.stream(keepalive=config['CHANGES_KEEPALIVE'], max_duration=config['CHANGES_MAX_DURATION'])
+    return Response(stream, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- Routes API des tâches de fond ---
+
+JOBS_MAX_LIMIT = 200
+
+def _visible_job(cursor, job_id):
+    """La tâche si elle existe et appartient à l'utilisateur (toutes pour un admin), sinon None."""
+    job = jobs.fetch(cursor, job_id)
+    if job is None or (current_user.role != 'admin' and job['user_id'] != int(current_user.id)):
+        return None
+    return job
+
+def _job_response(job, code=200):
+    headers = {'Location': url_for('api.get_job', job_id=job['id'])} if code == 202 else {}
+    return jsonify(status="success", job=jobs.describe(job)), code, headers
+
+@api_bp.route('/jobs', methods=['POST'])
+@login_required
+def submit_job():
+    """
+    Soumettre une tâche de fond : {"type": ..., "params": {...}}. La requête ne
+    fait que la mettre en file (202) ; l'avancement se suit sur GET /api/jobs/<id>.
+    """
+    data = request.get_json(silent=True) or {}
+    definition = jobs.JOB_TYPES.get(data.get('type'))
+    if definition is None or not definition.submittable:
+        names = ', '.join(name for name, job in jobs.JOB_TYPES.items() if job.submittable)
+        return jsonify(status="error", message=f"Type de tâche inconnu: {data.get('type')} (parmi : {names})."), 400
+    if definition.role and current_user.role not in (definition.role, 'admin'):
+        abort(403)
+    params = data.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify(status="error", message="'params' doit être un objet."), 400
+    try:
+        params = definition.validate(params) if definition.validate else {}
+    except ValueError as e:
+        return jsonify(status="error", message=str(e)), 400
+
     db = get_db()
     try:
         with db.cursor() as cursor:
-            # Recherche combinée avec JOIN
-            sql = """
-                SELECT
-                    p.id as patient_id, p.lastname, p.firstname, p.birthdate, p.gender,
-                    s.id as study_id, s.study_date, s.study_description, s.modality
-                FROM patients p
-                LEFT JOIN studies s ON p.id = s.patient_id
-                WHERE
-                    p.lastname LIKE %s OR
-                    p.firstname LIKE %s OR
-                    s.study_description LIKE %s OR
-                    s.modality LIKE %s
-            """
-            search_term = f"%{query}%"
-            cursor.execute(sql, (search_term, search_term, search_term, search_term))
-            results = cursor.fetchall()
-        return jsonify(results)
+            job_id = jobs.enqueue(cursor, definition.name, params, int(current_user.id))
+            job = jobs.fetch(cursor, job_id)
+        db.commit()
     except pymysql.MySQLError as e:
-        return jsonify(status="error", message=f"Erreur lors de la recherche: {e}"), 500
+        db.rollback()
+        return jsonify(status="error", message=f"Erreur lors de la mise en file de la tâche: {e}"), 500
+    jobs.ensure_runner(current_app._get_current_object())
+    return _job_response(job, 202)
+
+@api_bp.route('/jobs', methods=['GET'])
+@login_required
+def get_jobs():
+    """Tâches récentes de l'utilisateur (toutes pour un admin), filtrables par `status` et `type`."""
+    conditions, params = [], []
+    if current_user.role != 'admin':
+        conditions.append("user_id = %s")
+        params.append(int(current_user.id))
+    for arg, column in (('status', 'status'), ('type', 'job_type')):
+        if request.args.get(arg):
+            conditions.append(f"{column} = %s")
+            params.append(request.args[arg])
+    limit = max(1, min(request.args.get('limit', 50, type=int), JOBS_MAX_LIMIT))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    db = get_db()
+    with db.cursor() as cursor:
+        cursor.execute(f"SELECT {jobs.JOB_COLUMNS} FROM jobs {where} ORDER BY id DESC LIMIT %s", params + [limit])
+        rows = cursor.fetchall()
+    return jsonify([jobs.describe(row) for row in rows])
+
+@api_bp.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job(job_id):
+    """État et avancement d'une tâche."""
+    db = get_db()
+    with db.cursor() as cursor:
+        job = _visible_job(cursor, job_id)
+    if job is None:
+        return jsonify(status="error", message="Tâche non trouvée."), 404
+    return _job_response(job)
+
+@api_bp.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """
+    Annuler une tâche : immédiatement si elle est en file, sinon au prochain
+    point d'avancement de la tâche (les lots déjà validés d'un import restent).
+    """
+    db = get_db()
+    try:
+        with db.cursor() as cursor:
+            job = _visible_job(cursor, job_id)
+            if job is None:
+                return jsonify(status="error", message="Tâche non trouvée."), 404
+            cancelled = jobs.cancel(cursor, job_id)
+            job = jobs.fetch(cursor, job_id)
+        db.commit()
+    except pymysql.MySQLError as e:
+        db.rollback()
+        return jsonify(status="error", message=f"Erreur lors de l'annulation de la tâche: {e}"), 500
+    if not cancelled:
+        return jsonify(status="error", message=f"Tâche déjà terminée ({job['status']}).",
+                       job=jobs.describe(job)), 409
+    return _job_response(job)
+
+@api_bp.route('/jobs/<int:job_id>/result', methods=['GET'])
+@login_required
+def get_job_result(job_id):
+    """Résultat d'une tâche réussie : objet JSON, ou fichier produit (export)."""
+    db = get_db()
+    with db.cursor() as cursor:
+        job = _visible_job(cursor, job_id)
+    if job is None:
+        return jsonify(status="error", message="Tâche non trouvée."), 404
+    if job['status'] != 'succeeded':
+        return jsonify(status="error", message=f"Pas de résultat : tâche {job['status']}.",
+                       job=jobs.describe(job)), 409
+
+    result = jobs.result_of(job)
+    if isinstance(result, dict) and result.get('file'):
+        path = os.path.join(current_app.config['JOBS_DIR'], os.path.basename(result['file']))
+        if not os.path.exists(path):
+            return jsonify(status="error", message="Fichier de résultat supprimé."), 410
+        mimetype = 'application/gzip' if result.get('gzip') else EXPORT_MIMETYPES[result['format']]
+        return send_file(path, mimetype=mimetype, as_attachment=True,
+                         download_name=f"patients-{job_id}.{result['format']}" + ('.gz' if result.get('gzip') else ''))
+    return jsonify(result)
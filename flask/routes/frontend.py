@@ -1,7 +1,19 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import (Blueprint, render_template, request, redirect, url_for, flash, current_app, Response,
+                   stream_with_context)
 from flask_login import login_user, logout_user, login_required, current_user
 from models import User
-from db import get_db
+import heapq
+from datetime import datetime
+from db import get_db, get_shard, locate, merged_query, next_shard, read_only, scatter, shard_of
+from werkzeug.wsgi import ClosingIterator
+from pagination import InvalidCursor, decode_cursor, encode_cursor, seek_condition
+import versioning
+from versioning import conditional
+import study_stats
+import changes
+import loaders
+import archive
+import search as search_engine
 import pymysql
 
 frontend_bp = Blueprint('frontend', __name__)
@@ -28,41 +40,119 @@ def logout():
     logout_user()
     return redirect(url_for('frontend.login'))
 
+DASHBOARD_SELECT = """
+    SELECT p.id as patient_id, p.firstname, p.lastname, s.id, s.study_date, s.study_description, s.modality,
+           {archived} AS archived
+    FROM {studies} s
+    JOIN patients p ON s.patient_id = p.id
+"""
+
+# Tri du tableau de bord : les plus récentes d'abord, l'id départage les égalités de date
+DASHBOARD_SORT = ['s.study_date', 's.id']
+
+def dashboard_select(table):
+    """DASHBOARD_SELECT sur la table chaude ou l'archive ; `archived` distingue les lignes en lecture seule."""
+    return DASHBOARD_SELECT.format(studies=table, archived=int(table == archive.ARCHIVE_TABLE))
+
+def dashboard_key(row):
+    """Clé de fusion des shards pour ORDER BY s.study_date DESC, s.id DESC (dates NULL en dernier)."""
+    return (row['study_date'] is not None, row['study_date'] or datetime.min, row['id'])
+
+def dashboard_seek(values):
+    """
+    Condition « après cette ligne » pour DASHBOARD_SORT et ses paramètres.
+    `study_date` peut être NULL : ces études viennent après toutes les autres
+    (ORDER BY ... DESC) et ne se départagent que par l'id.
+    """
+    study_date, study_id = values
+    if study_date is None:
+        return "(s.study_date IS NULL AND s.id < %s)", [study_id]
+    condition, condition_params = seek_condition(DASHBOARD_SORT, descending=True)
+    return f"({condition} OR s.study_date IS NULL)", condition_params(values)
+
 @frontend_bp.route('/')
 @login_required
+@read_only
+@conditional('patients', 'studies', vary=('Cookie',))
 def dashboard():
     """
     Affiche le tableau de bord principal avec les études et la fonctionnalité de recherche.
+    Les études sont servies par pages (`cursor`), ou en flux continu avec `stream=1`.
+    Seule la fenêtre chaude est lue, sauf avec `archive=1` ; `from` et `to` bornent la période.
+    La page s'abonne ensuite à /api/changes à partir de `change_token` pour se tenir à jour.
     """
-    db = get_db()
     search_query = request.args.get('q', '')
+    try:
+        date_from, date_to, include_archive = archive.parse_range(request.args)
+    except ValueError as e:
+        return f"Date invalide (attendu AAAA-MM-JJ): {e}", 400
+    tables = archive.study_tables(include_archive)
+    conditions, date_params = archive.date_conditions('s.study_date', date_from, date_to)
+    filters = {key: request.args[key] for key in ('from', 'to', 'archive') if request.args.get(key)}
+    if not search_query and request.args.get('stream'):
+        return stream_dashboard(tables, conditions, date_params, filters)
 
+    next_cursor = None
     try:
-        with db.cursor() as cursor:
-            if search_query:
-                sql = """
-                    SELECT p.id as patient_id, p.firstname, p.lastname, s.id, s.study_date, s.study_description, s.modality
-                    FROM studies s
-                    JOIN patients p ON s.patient_id = p.id
-                    WHERE p.lastname LIKE %s OR p.firstname LIKE %s OR s.study_description LIKE %s OR s.modality LIKE %s
-                    ORDER BY s.study_date DESC
-                """
-                search_term = f"%{search_query}%"
-                cursor.execute(sql, (search_term, search_term, search_term, search_term))
-            else:
-                sql = """
-                    SELECT p.id as patient_id, p.firstname, p.lastname, s.id, s.study_date, s.study_description, s.modality
-                    FROM studies s
-                    JOIN patients p ON s.patient_id = p.id
-                    ORDER BY s.study_date DESC
-                """
-                cursor.execute(sql)
-            studies = cursor.fetchall()
+        change_token = changes.position()
+        if search_query:
+            studies = [
+                dict(row, id=row['study_id'])
+                for row in search_engine.search_shards(search_query,
+                                                       limit=current_app.config['SEARCH_MAX_LIMIT'],
+                                                       studies_only=True, date_from=date_from, date_to=date_to,
+                                                       include_archive=include_archive)
+            ]
+        else:
+            # Une page par shard et par table, fusionnées : la page suivante repart du même curseur sur chacune
+            per_page = current_app.config['DASHBOARD_PER_PAGE']
+            token = request.args.get('cursor')
+            params = list(date_params)
+            if token:
+                try:
+                    values = decode_cursor(token, 'study_date', len(DASHBOARD_SORT))
+                except InvalidCursor as e:
+                    return str(e), 400
+                condition, condition_params = dashboard_seek(values)
+                conditions = [*conditions, condition]
+                params.extend(condition_params)
+            where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            order = " ORDER BY s.study_date DESC, s.id DESC LIMIT %s"
+            pages = []
+            for table in tables:
+                pages.extend(scatter(dashboard_select(table) + where + order, (*params, per_page + 1)))
+            studies = list(heapq.merge(*pages, key=dashboard_key, reverse=True))
+            if len(studies) > per_page:
+                studies = studies[:per_page]
+                last = studies[-1]
+                next_cursor = encode_cursor('study_date', [last['study_date'], last['id']])
     except pymysql.MySQLError as e:
         # Gérer l'erreur
         return f"Erreur lors de la récupération des études: {e}", 500
 
-    return render_template('dashboard.html', studies=studies, search_query=search_query)
+    return render_template('dashboard.html', studies=studies, search_query=search_query, next_cursor=next_cursor,
+                           change_token=change_token, filters=filters)
+
+def stream_dashboard(tables, conditions, params, filters):
+    """
+    Rend le tableau complet au fil de la lecture d'un curseur non bufferisé :
+    le premier octet part avant la fin de la requête et la mémoire reste constante.
+    La connexion n'est rendue au pool qu'une fois le flux terminé.
+    """
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        change_token = changes.position()
+        rows = merged_query([dashboard_select(table) + where + " ORDER BY s.study_date DESC, s.id DESC"
+                             for table in tables], params, key=dashboard_key, reverse=True)
+    except pymysql.MySQLError as e:
+        return f"Erreur lors de la récupération des études: {e}", 500
+
+    context = dict(studies=rows, search_query='', next_cursor=None, streamed=True, change_token=change_token,
+                   filters=filters)
+    current_app.update_template_context(context)
+    stream = current_app.jinja_env.get_template('dashboard.html').stream(context)
+    stream.enable_buffering(current_app.config['DASHBOARD_STREAM_BUFFER'])
+    return Response(ClosingIterator(stream_with_context(stream), rows.close), mimetype='text/html')
 
 @frontend_bp.route('/patient/new', methods=['GET', 'POST'])
 @login_required
@@ -71,7 +161,7 @@ def new_patient():
     Gère la création d'un nouveau patient.
     """
     if request.method == 'POST':
-        db = get_db()
+        db = get_shard(next_shard())
         try:
             with db.cursor() as cursor:
                 sql = "INSERT INTO patients (lastname, firstname, birthdate, gender) VALUES (%s, %s, %s, %s)"
@@ -81,10 +171,14 @@ def new_patient():
                     request.form['birthdate'],
                     request.form['gender']
                 ))
+                patient_id = cursor.lastrowid
+                versioning.touch(cursor, 'patients')
+                changes.record(cursor, 'patients', [patient_id], 'insert')
             db.commit()
         except pymysql.MySQLError as e:
             db.rollback()
             return f"Erreur lors de la création du patient: {e}", 500
+        current_app.extensions['count_cache'].invalidate('patients')
         return redirect(url_for('frontend.dashboard'))
     return render_template('patient_form.html')
 
@@ -92,25 +186,25 @@ def new_patient():
 @login_required
 def patient_detail(patient_id):
     """
-    Affiche les détails d'un patient et ses études.
+    Affiche les détails d'un patient et ses études, archivées comprises avec `archive=1`.
     """
-    db = get_db()
+    include_archive = request.args.get('archive') in ('1', 'true')
+    # Le patient et ses études sont sur le même shard
+    db = get_shard(shard_of(patient_id))
     try:
         with db.cursor() as cursor:
-            # Récupérer les infos du patient
-            cursor.execute("SELECT * FROM patients WHERE id = %s", (patient_id,))
-            patient = cursor.fetchone()
-
-            # Récupérer les études du patient
-            cursor.execute("SELECT * FROM studies WHERE patient_id = %s ORDER BY study_date DESC", (patient_id,))
-            studies = cursor.fetchall()
+            # Mêmes chargeurs que l'API ; les études ne sont lues que si le patient existe
+            patients, _ = loaders.fetch_patients(cursor, [patient_id])
+            loaders.attach_studies(cursor, patients, archive.study_tables(include_archive))
     except pymysql.MySQLError as e:
         return f"Erreur lors de la récupération du patient: {e}", 500
 
-    if not patient:
+    if not patients:
         return "Patient non trouvé", 404
 
-    return render_template('patient_detail.html', patient=patient, studies=studies)
+    patient = patients[0]
+    return render_template('patient_detail.html', patient=patient, studies=patient['studies'],
+                           include_archive=include_archive)
 
 @frontend_bp.route('/patient/edit/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
@@ -118,22 +212,29 @@ def edit_patient(patient_id):
     """
     Gère l'édition d'un patient.
     """
-    db = get_db()
+    db = get_shard(shard_of(patient_id))
     if request.method == 'POST':
         try:
             with db.cursor() as cursor:
+                study_stats.remove(cursor, 'patients', [patient_id])
                 sql = """
                     UPDATE patients
-                    SET lastname=%s, firstname=%s, birthdate=%s, gender=%s
+                    SET lastname=%s, firstname=%s, birthdate=%s, gender=%s, version=version+1
                     WHERE id=%s
                 """
-                cursor.execute(sql, (
+                updated = cursor.execute(sql, (
                     request.form['lastname'],
                     request.form['firstname'],
                     request.form['birthdate'],
                     request.form['gender'],
                     patient_id
                 ))
+                if not updated:
+                    db.rollback()
+                    return "Patient non trouvé", 404
+                study_stats.add(cursor, 'patients', [patient_id])
+                versioning.touch(cursor, 'patients')
+                changes.record(cursor, 'patients', [patient_id])
             db.commit()
         except pymysql.MySQLError as e:
             db.rollback()
@@ -158,30 +259,32 @@ def new_study():
     """
     Gère la création d'une nouvelle étude.
     """
-    db = get_db()
     if request.method == 'POST':
+        patient_id = request.form.get('patient_id', type=int)
+        if patient_id is None:
+            return "Patient invalide", 400
+        # L'étude est créée sur le shard de son patient
+        db = get_shard(shard_of(patient_id))
         try:
             with db.cursor() as cursor:
                 sql = "INSERT INTO studies (patient_id, study_description, modality, study_date) VALUES (%s, %s, %s, NOW())"
                 cursor.execute(sql, (
-                    request.form['patient_id'],
+                    patient_id,
                     request.form['study_description'],
                     request.form['modality']
                 ))
+                study_id = cursor.lastrowid
+                study_stats.add(cursor, 'studies', [study_id])
+                versioning.touch(cursor, 'studies')
+                changes.record(cursor, 'studies', [study_id], 'insert')
             db.commit()
         except pymysql.MySQLError as e:
             db.rollback()
             return f"Erreur lors de la création de l'étude: {e}", 500
         return redirect(url_for('frontend.dashboard'))
 
-    try:
-        with db.cursor() as cursor:
-            cursor.execute("SELECT id, lastname, firstname FROM patients ORDER BY lastname, firstname")
-            patients = cursor.fetchall()
-    except pymysql.MySQLError as e:
-        return f"Erreur lors de la récupération des patients: {e}", 500
-
-    return render_template('study_form.html', patients=patients)
+    # Le patient est choisi par saisie semi-automatique (/api/patients/suggest)
+    return render_template('study_form.html')
 
 @frontend_bp.route('/study/edit/<int:study_id>', methods=['GET', 'POST'])
 @login_required
@@ -189,20 +292,27 @@ def edit_study(study_id):
     """
     Gère l'édition d'une étude.
     """
-    db = get_db()
+    db = get_shard(locate('studies', [study_id])[study_id])
     if request.method == 'POST':
         try:
             with db.cursor() as cursor:
+                study_stats.remove(cursor, 'studies', [study_id])
                 sql = """
                     UPDATE studies
-                    SET study_description=%s, modality=%s
+                    SET study_description=%s, modality=%s, version=version+1
                     WHERE id=%s
                 """
-                cursor.execute(sql, (
+                updated = cursor.execute(sql, (
                     request.form['study_description'],
                     request.form['modality'],
                     study_id
                 ))
+                if not updated:
+                    db.rollback()
+                    return "Étude non trouvée", 404
+                study_stats.add(cursor, 'studies', [study_id])
+                versioning.touch(cursor, 'studies')
+                changes.record(cursor, 'studies', [study_id])
             db.commit()
         except pymysql.MySQLError as e:
             db.rollback()
@@ -211,36 +321,37 @@ def edit_study(study_id):
 
     try:
         with db.cursor() as cursor:
-            cursor.execute("SELECT * FROM studies WHERE id = %s", (study_id,))
+            cursor.execute("SELECT s.*, p.lastname, p.firstname FROM studies s "
+                           "JOIN patients p ON p.id = s.patient_id WHERE s.id = %s", (study_id,))
             study = cursor.fetchone()
-
-            cursor.execute("SELECT id, lastname, firstname FROM patients ORDER BY lastname, firstname")
-            patients = cursor.fetchall()
     except pymysql.MySQLError as e:
         return f"Erreur lors de la récupération de l'étude: {e}", 500
 
     if not study:
         return "Étude non trouvée", 404
 
-    return render_template('study_form.html', study=study, patients=patients)
+    return render_template('study_form.html', study=study)
 
 @frontend_bp.route('/study/<int:study_id>')
 @login_required
 def study_detail(study_id):
     """
-    Affiche les détails d'une étude.
+    Affiche les détails d'une étude, cherchée dans l'archive si elle n'est plus dans la table chaude.
     """
-    db = get_db()
+    study = None
     try:
-        with db.cursor() as cursor:
-            sql = """
-                SELECT s.*, p.lastname as patient_lastname, p.firstname as patient_firstname
-                FROM studies s
-                JOIN patients p ON s.patient_id = p.id
-                WHERE s.id = %s
-            """
-            cursor.execute(sql, (study_id,))
-            study = cursor.fetchone()
+        for table in archive.study_tables(include_archive=True):
+            with get_shard(locate(table, [study_id])[study_id]).cursor() as cursor:
+                sql = f"""
+                    SELECT s.*, p.lastname as patient_lastname, p.firstname as patient_firstname
+                    FROM {table} s
+                    JOIN patients p ON s.patient_id = p.id
+                    WHERE s.id = %s
+                """
+                cursor.execute(sql, (study_id,))
+                study = cursor.fetchone()
+            if study:
+                break
     except pymysql.MySQLError as e:
         return f"Erreur lors de la récupération de l'étude: {e}", 500
 
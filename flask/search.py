@@ -0,0 +1,165 @@
+import re
+import unicodedata
+
+import archive
+from db import get_shard, shard_count
+
+# Champs interrogeables et colonnes indexées correspondantes
+SEARCH_FIELDS = ('name', 'description', 'modality')
+
+# En dessous de cette longueur, InnoDB n'indexe pas les mots (innodb_ft_min_token_size)
+FT_MIN_TOKEN_SIZE = 3
+
+_SELECT = """
+    SELECT
+        p.id as patient_id, p.lastname, p.firstname, p.birthdate, p.gender,
+        s.id as study_id, s.study_date, s.study_description, s.modality, {archived} AS archived,
+        {score} AS score
+"""
+
+# {studies} : table d'études interrogée ; {join} : jointure des patients à leurs études
+_BRANCHES = {
+    # Les patients sans étude restent visibles, comme avec l'ancienne recherche LIKE
+    'name': (
+        "MATCH(p.lastname, p.firstname) AGAINST (%s IN BOOLEAN MODE)",
+        "FROM patients p {join} {studies} s ON p.id = s.patient_id",
+        "WHERE MATCH(p.lastname, p.firstname) AGAINST (%s IN BOOLEAN MODE)",
+    ),
+    'description': (
+        "MATCH(s.study_description) AGAINST (%s IN BOOLEAN MODE)",
+        "FROM {studies} s JOIN patients p ON p.id = s.patient_id",
+        "WHERE MATCH(s.study_description) AGAINST (%s IN BOOLEAN MODE)",
+    ),
+}
+
+# Filtre ajouté au MATCH pour chaque mot trop court pour l'index plein texte
+_SHORT_FILTERS = {
+    'name': ("(p.lastname LIKE %s OR p.firstname LIKE %s)", lambda t: (t + '%', t + '%')),
+    'description': ("s.study_description LIKE %s", lambda t: ('%' + t + '%',)),
+}
+
+
+def short_filters(field, tokens):
+    """Conditions SQL (« AND ... ») et paramètres exigeant chacun des mots courts dans `field`."""
+    condition, params = _SHORT_FILTERS[field]
+    return ''.join(f" AND {condition}" for _ in tokens), [p for t in tokens for p in params(t)]
+
+
+def fold(text):
+    """Minuscules sans accents : « Hélène » -> « helene »."""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def tokenize(text):
+    """Découpe une saisie libre en mots normalisés, sans les opérateurs du mode booléen."""
+    return [t for t in re.split(r'[\W_]+', fold(text)) if t]
+
+
+def boolean_query(tokens):
+    """Tous les mots sont requis et recherchés en préfixe : « dup je » -> « +dup* +je* »."""
+    return ' '.join(f'+{t}*' for t in tokens)
+
+
+def parse_fields(value):
+    """Valide la liste `fields` passée en paramètre ; tous les champs par défaut."""
+    if not value:
+        return list(SEARCH_FIELDS)
+    fields = [f.strip() for f in value.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in SEARCH_FIELDS]
+    if unknown:
+        raise ValueError(f"Champ(s) de recherche inconnu(s): {', '.join(unknown)}.")
+    return fields
+
+
+def search(cursor, query, fields=SEARCH_FIELDS, limit=50, studies_only=False, date_from=None, date_to=None,
+           tables=('studies',)):
+    """
+    Recherche classée sur les index FULLTEXT des patients et des études.
+
+    Chaque champ est interrogé séparément pour que chaque branche utilise son
+    propre index, puis les scores d'une même ligne (patient, étude) sont additionnés.
+    Tous les mots sont requis dans le champ interrogé : ceux trop courts pour
+    l'index plein texte s'ajoutent au MATCH comme filtres LIKE ; sans aucun mot
+    indexable, le nom est cherché par préfixe (index du nom de famille). La
+    modalité, un code court, est comparée à chacun des mots. Avec une période, seules les études
+    datées de la période sont renvoyées ; chaque table de `tables` (études
+    chaudes, archive) est interrogée à son tour.
+    """
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    indexed = [t for t in tokens if len(t) >= FT_MIN_TOKEN_SIZE]
+    short = [t for t in tokens if len(t) < FT_MIN_TOKEN_SIZE]
+    conditions, date_params = archive.date_conditions('s.study_date', date_from, date_to)
+    dates = ''.join(f" AND {condition}" for condition in conditions)
+
+    results = {}
+
+    def collect(sql, params):
+        cursor.execute(sql, params)
+        for row in cursor.fetchall():
+            if studies_only and row['study_id'] is None:
+                continue
+            key = (row['patient_id'], row['study_id'])
+            if key in results:
+                results[key]['score'] += float(row['score'])
+            else:
+                # MATCH() renvoie un DOUBLE, les branches à score constant un DECIMAL
+                row['score'] = float(row['score'])
+                results[key] = row
+
+    for position, table in enumerate(tables):
+        # Les patients sans étude ne sont renvoyés qu'une fois, par la première table
+        join = 'LEFT JOIN' if position == 0 else 'JOIN'
+        archived = int(table == archive.ARCHIVE_TABLE)
+        for field in fields:
+            if field in _BRANCHES and indexed:
+                score, source, where = _BRANCHES[field]
+                ft_query = boolean_query(indexed)
+                sql = (_SELECT.format(score=score, archived=archived) + source.format(join=join, studies=table)
+                       + "\n" + where + dates + "\nORDER BY score DESC LIMIT %s")
+                filters, filter_params = short_filters(field, short)
+                sql = (_SELECT.format(score=score, archived=archived) + source.format(join=join, studies=table)
+                       + "\n" + where + filters + dates + "\nORDER BY score DESC LIMIT %s")
+                collect(sql, (ft_query, ft_query, *filter_params, *date_params, limit))
+            elif field == 'name' and short:
+                # Initiales ou noms très courts : le premier mot en préfixe sur le nom de
+                # famille (index), les suivants sur le nom ou le prénom
+                filters, filter_params = short_filters(field, short[1:])
+                sql = (_SELECT.format(score="1.0", archived=archived)
+                       + f"FROM patients p {join} {table} s ON p.id = s.patient_id\n"
+                       f"WHERE p.lastname LIKE %s{filters}{dates} LIMIT %s")
+                collect(sql, (short[0] + '%', *filter_params, *date_params, limit))
+            elif field == 'modality':
+                # Les codes de modalité (IRM, RX, CT...) sont courts : égalité par préfixe sur
+                # l'index, l'un des mots de la saisie suffit
+                matches = ' OR '.join(['s.modality LIKE %s'] * len(tokens))
+                sql = (_SELECT.format(score="1.0", archived=archived)
+                       + f"FROM {table} s JOIN patients p ON p.id = s.patient_id\n"
+                       f"WHERE ({matches}){dates} ORDER BY s.study_date DESC LIMIT %s")
+                collect(sql, (*[t + '%' for t in tokens], *date_params, limit))
+
+    return rank(results.values(), limit)
+
+
+def rank(rows, limit):
+    """Meilleurs scores d'abord, puis les études les plus récentes."""
+    ranked = sorted(rows, key=lambda r: (r['score'], r['study_date'] is not None, r['study_date'] or 0),
+                    reverse=True)
+    return ranked[:limit]
+
+
+def search_shards(query, fields=SEARCH_FIELDS, limit=50, studies_only=False, date_from=None, date_to=None,
+                  include_archive=False):
+    """
+    `search` sur chaque shard, puis classement commun : une ligne (patient,
+    étude) n'existe que sur un shard, ses scores sont déjà additionnés.
+    """
+    tables = archive.study_tables(include_archive)
+    rows = []
+    for index in range(shard_count()):
+        with get_shard(index).cursor() as cursor:
+            rows.extend(search(cursor, query, fields=fields, limit=limit, studies_only=studies_only,
+                               date_from=date_from, date_to=date_to, tables=tables))
+    return rank(rows, limit) if shard_count() > 1 else rows
@@ -0,0 +1,55 @@
+# Partitionnement horizontal (DB_SHARDS) : les patients sont répartis sur
+# plusieurs bases MariaDB, chacun avec ses études. Chaque shard attribue des
+# ids d'une même classe modulo le nombre de shards (auto_increment_increment /
+# auto_increment_offset) : les ids restent uniques sur l'ensemble des bases et
+# le shard d'un patient se déduit de son id, sans table de correspondance.
+
+import heapq
+
+
+def parse_shards(value):
+    """Shards supplémentaires de DB_SHARDS (« hôte[:port]/base,... ») : liste de (hôte, port, base)."""
+    shards = []
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        address, _, database = item.partition('/')
+        host, _, port = address.partition(':')
+        if not host or not database or (port and not port.isdigit()):
+            raise ValueError(f"DB_SHARDS invalide: {item} (attendu hôte[:port]/base).")
+        shards.append((host, int(port or 3306), database))
+    return shards
+
+
+def shard_of(row_id, count):
+    """Shard dont l'auto-incrément produit cet id."""
+    return (int(row_id) - 1) % count
+
+
+def init_command(index, count):
+    """Réglage de session des connexions au shard `index` : ses ids valent index + 1 modulo `count`."""
+    return f"SET SESSION auto_increment_increment = {count}, auto_increment_offset = {index + 1}"
+
+
+def next_id(position, index, count):
+    """Plus petit id attribuable par le shard `index` au-delà de `position`."""
+    return position + (index - position) % count + 1
+
+
+class MergedStream:
+    """
+    Fusion ordonnée des flux de plusieurs shards (RowStream), chacun trié
+    selon `key` : une ligne par shard en mémoire. close() les ferme tous.
+    """
+
+    def __init__(self, streams, key, reverse=False):
+        self.streams = streams
+        self._rows = heapq.merge(*streams, key=key, reverse=reverse)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._rows)
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
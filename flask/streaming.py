@@ -0,0 +1,51 @@
+from flask import Response, current_app, request
+from werkzeug.wsgi import ClosingIterator
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def negotiate_format():
+    """Choisit NDJSON si le client le préfère explicitement, sinon un tableau JSON."""
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE, 'application/jsonl'],
+                                               default='application/json')
+    return 'json' if best == 'application/json' else 'ndjson'
+
+
+def _chunks(rows, fmt, dumps, chunk_size):
+    """Sérialise les lignes par paquets de `chunk_size` pour limiter le nombre d'écritures."""
+    first = True
+    if fmt == 'json':
+        yield '['
+    batch = []
+    for row in rows:
+        batch.append(dumps(row))
+        if len(batch) >= chunk_size:
+            yield _join(batch, fmt, first)
+            first = False
+            batch = []
+    if batch:
+        yield _join(batch, fmt, first)
+    if fmt == 'json':
+        yield ']'
+
+
+def _join(batch, fmt, first):
+    if fmt == 'ndjson':
+        return '\n'.join(batch) + '\n'
+    return ('' if first else ',') + ','.join(batch)
+
+
+def json_stream(rows, fmt=None):
+    """
+    Réponse JSON (tableau) ou NDJSON produite au fil de l'itération de `rows`.
+
+    `rows` est typiquement un `db.RowStream` : seule une fenêtre de
+    STREAM_CHUNK_SIZE lignes est en mémoire, et la connexion est rendue au
+    pool quand le client a tout reçu (ou s'est déconnecté).
+    """
+    fmt = fmt or negotiate_format()
+    dumps = current_app.json.dumps
+    body = _chunks(rows, fmt, dumps, current_app.config['STREAM_CHUNK_SIZE'])
+    close = getattr(rows, 'close', None)
+    mimetype = NDJSON_MIMETYPE if fmt == 'ndjson' else 'application/json'
+    return Response(ClosingIterator(body, [close] if close else None), mimetype=mimetype)
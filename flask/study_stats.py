@@ -0,0 +1,192 @@
+from collections import Counter
+
+import click
+from flask.cli import AppGroup
+from db import get_shard, shard_count
+
+# Colonnes dont la modification change la contribution d'une ligne aux statistiques
+STAT_FIELDS = {
+    'studies': ('study_date', 'modality', 'patient_id'),
+    'patients': ('birthdate', 'gender'),
+}
+
+AGE_BAND_YEARS = 10
+MAX_AGE_BAND = 90
+UNKNOWN_GENDER = 'U'
+UNKNOWN_AGE_BAND = -1
+
+# Clés des tables de synthèse, calculées en SQL ; age_band() en est l'équivalent Python
+DAILY_KEY = "DATE(s.study_date), COALESCE(s.modality, '')"
+COHORT_KEY = (f"DATE(s.study_date), COALESCE(p.gender, '{UNKNOWN_GENDER}'), "
+              f"COALESCE(GREATEST(LEAST(TIMESTAMPDIFF(YEAR, p.birthdate, s.study_date) "
+              f"DIV {AGE_BAND_YEARS} * {AGE_BAND_YEARS}, {MAX_AGE_BAND}), 0), {UNKNOWN_AGE_BAND})")
+
+UPSERT = " ON DUPLICATE KEY UPDATE study_count = study_count + VALUES(study_count)"
+
+# Les études archivées restent comptées : les synthèses couvrent les deux tables
+STUDY_TABLES = ('studies', 'studies_archive')
+ALL_STUDIES = ("(SELECT id, patient_id, study_date, modality FROM studies UNION ALL "
+               "SELECT id, patient_id, study_date, modality FROM studies_archive)")
+
+
+def age_band(birthdate, study_date):
+    """Tranche d'âge du patient à la date de l'étude, comme COHORT_KEY."""
+    if birthdate is None:
+        return UNKNOWN_AGE_BAND
+    years = study_date.year - birthdate.year - ((study_date.month, study_date.day) < (birthdate.month, birthdate.day))
+    return max(0, min(years // AGE_BAND_YEARS * AGE_BAND_YEARS, MAX_AGE_BAND))
+
+
+def affects(table, changes):
+    return any(field in STAT_FIELDS[table] for field in changes)
+
+
+def _apply(cursor, table, ids, sign):
+    """
+    Ajoute (sign=1) ou retire (sign=-1) la contribution des lignes `ids` de
+    `table` (studies, studies_archive ou patients) aux synthèses.
+    L'INSERT ... SELECT pose des verrous partagés sur les études lues : les
+    compteurs restent exacts face aux écritures concurrentes.
+    """
+    if not ids:
+        return
+    placeholders = ', '.join(['%s'] * len(ids))
+    if table == 'patients':
+        # Les études archivées d'un patient comptent aussi dans les cohortes
+        column, sources = 's.patient_id', STUDY_TABLES
+    else:
+        column, sources = 's.id', (table,)
+    where = f"{column} IN ({placeholders}) AND s.study_date IS NOT NULL"
+    for source in sources:
+        if table != 'patients':
+            # Les modifications d'un patient ne changent pas les comptes par modalité
+            cursor.execute(f"INSERT INTO study_stats_daily (stat_date, modality, study_count) "
+                           f"SELECT {DAILY_KEY}, %s * COUNT(*) FROM {source} s WHERE {where} GROUP BY 1, 2" + UPSERT,
+                           [sign, *ids])
+        cursor.execute(f"INSERT INTO study_stats_cohort (stat_date, gender, age_band, study_count) "
+                       f"SELECT {COHORT_KEY}, %s * COUNT(*) FROM {source} s JOIN patients p ON p.id = s.patient_id "
+                       f"WHERE {where} GROUP BY 1, 2, 3" + UPSERT, [sign, *ids])
+
+
+def add(cursor, table, ids):
+    """À appeler dans la transaction, après l'insertion ou la mise à jour des lignes."""
+    _apply(cursor, table, ids, 1)
+
+
+def remove(cursor, table, ids):
+    """À appeler dans la transaction, avant la mise à jour des lignes."""
+    _apply(cursor, table, ids, -1)
+
+
+def add_rows(cursor, rows):
+    """
+    Ajoute des études déjà connues de l'appelant (import en masse), sans les relire :
+    `rows` produit des tuples (study_date, modality, gender, birthdate).
+    """
+    daily, cohort = Counter(), Counter()
+    for study_date, modality, gender, birthdate in rows:
+        if study_date is None:
+            continue
+        daily[(study_date.date(), modality or '')] += 1
+        cohort[(study_date.date(), gender or UNKNOWN_GENDER, age_band(birthdate, study_date))] += 1
+    if daily:
+        cursor.executemany("INSERT INTO study_stats_daily (stat_date, modality, study_count) VALUES (%s, %s, %s)"
+                           + UPSERT, [(*key, n) for key, n in daily.items()])
+    if cohort:
+        cursor.executemany("INSERT INTO study_stats_cohort (stat_date, gender, age_band, study_count) "
+                           "VALUES (%s, %s, %s, %s)" + UPSERT, [(*key, n) for key, n in cohort.items()])
+
+
+def rebuild(db):
+    """Recalcule les synthèses depuis les études et leur archive, en une transaction (DELETE, pas TRUNCATE)."""
+    with db.cursor() as cursor:
+        cursor.execute("DELETE FROM study_stats_daily")
+        cursor.execute("DELETE FROM study_stats_cohort")
+        cursor.execute(f"INSERT INTO study_stats_daily (stat_date, modality, study_count) "
+                       f"SELECT {DAILY_KEY}, COUNT(*) FROM {ALL_STUDIES} s "
+                       f"WHERE s.study_date IS NOT NULL GROUP BY 1, 2")
+        daily = cursor.rowcount
+        cursor.execute(f"INSERT INTO study_stats_cohort (stat_date, gender, age_band, study_count) "
+                       f"SELECT {COHORT_KEY}, COUNT(*) FROM {ALL_STUDIES} s JOIN patients p ON p.id = s.patient_id "
+                       f"WHERE s.study_date IS NOT NULL GROUP BY 1, 2, 3")
+        cohort = cursor.rowcount
+    db.commit()
+    return daily, cohort
+
+
+def rebuild_all():
+    """`rebuild` sur chaque shard : chacun tient les synthèses de ses propres études."""
+    daily = cohort = 0
+    for index in range(shard_count()):
+        shard_daily, shard_cohort = rebuild(get_shard(index))
+        daily += shard_daily
+        cohort += shard_cohort
+    return daily, cohort
+
+
+# Axes de regroupement de /api/stats : (table de synthèse, expression)
+DIMENSIONS = {
+    'day': ('study_stats_daily', "DATE_FORMAT(stat_date, '%%Y-%%m-%%d')"),
+    'month': ('study_stats_daily', "DATE_FORMAT(stat_date, '%%Y-%%m')"),
+    'modality': ('study_stats_daily', 'modality'),
+    'cohort_day': ('study_stats_cohort', "DATE_FORMAT(stat_date, '%%Y-%%m-%%d')"),
+    'gender': ('study_stats_cohort', 'gender'),
+    'age_band': ('study_stats_cohort', 'age_band'),
+}
+
+
+def summary(cursor, group, date_from=None, date_to=None):
+    """
+    Nombre d'études regroupé selon `group` (liste d'axes de DIMENSIONS, tous
+    issus de la même table de synthèse), entre deux dates incluses.
+    Lève ValueError si les axes sont inconnus ou incompatibles.
+    """
+    unknown = [name for name in group if name not in DIMENSIONS]
+    if unknown:
+        raise ValueError(f"Axe(s) inconnu(s): {', '.join(unknown)} (parmi : {', '.join(DIMENSIONS)}).")
+    tables = {DIMENSIONS[name][0] for name in group}
+    if len(tables) > 1:
+        raise ValueError("Les axes modality/day/month et gender/age_band/cohort_day ne se combinent pas.")
+    table = tables.pop() if tables else 'study_stats_daily'
+
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append("stat_date >= %s")
+        params.append(date_from)
+    if date_to is not None:
+        conditions.append("stat_date <= %s")
+        params.append(date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    columns = ''.join(f"{DIMENSIONS[name][1]} AS {name}, " for name in group)
+    grouping = f"GROUP BY {', '.join(group)} HAVING study_count > 0 ORDER BY {', '.join(group)}" if group else ""
+    cursor.execute(f"SELECT {columns}CAST(SUM(study_count) AS SIGNED) AS study_count FROM {table} {where} {grouping}",
+                   params)
+    rows = cursor.fetchall()
+    if not group:
+        rows = [row for row in rows if row['study_count']]
+    return rows
+
+
+def summary_all(group, date_from=None, date_to=None):
+    """`summary` sur chaque shard, les comptes d'un même groupe additionnés."""
+    count = shard_count()
+    if count == 1:
+        with get_shard(0).cursor() as cursor:
+            return summary(cursor, group, date_from, date_to)
+    totals = {}
+    for index in range(count):
+        with get_shard(index).cursor() as cursor:
+            for row in summary(cursor, group, date_from, date_to):
+                key = tuple(row[name] for name in group)
+                totals[key] = totals.get(key, 0) + row['study_count']
+    return [dict(zip(group, key), study_count=n) for key, n in sorted(totals.items()) if n]
+
+
+stats_cli = AppGroup('stats', help="Statistiques des études.")
+
+
+@stats_cli.command('rebuild')
+def rebuild_command():
+    """Recalculer les tables de synthèse depuis la table `studies`."""
+    daily, cohort = rebuild_all()
+    click.echo(f"Synthèses recalculées : {daily} ligne(s) par jour et modalité, {cohort} par cohorte.")
@@ -0,0 +1,133 @@
+# Les modules de l'application sont à plat dans flask/ : ils sont importés
+# comme le fait `flask run` depuis ce répertoire.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from instrumentation import current_queries
+
+
+# Colonnes DATETIME relues en datetime, comme avec PyMySQL
+sqlite3.register_converter('DATETIME', lambda value: datetime.fromisoformat(value.decode()))
+
+
+class SqliteCursor:
+    """Curseur SQLite présenté comme un DictCursor de PyMySQL (paramètres %s, lignes en dict)."""
+
+    def __init__(self, conn):
+        self._cursor = conn.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+        return False
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace('%s', '?'), tuple(params or ()))
+        # Comptées comme par les curseurs instrumentés de db.py (X-Query-Count)
+        queries = current_queries()
+        if queries is not None:
+            queries.record(sql, 0.0, self._cursor.rowcount)
+        return self._cursor.rowcount
+
+    def executemany(self, sql, seq):
+        self._cursor.executemany(sql.replace('%s', '?'), [tuple(p) for p in seq])
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [dict(row) for row in self._cursor.fetchall()]
+
+    def fetchmany(self, size):
+        return [dict(row) for row in self._cursor.fetchmany(size)]
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    """Connexion SQLite en mémoire utilisable là où le code attend une connexion PyMySQL."""
+
+    def __init__(self):
+        self.conn = sqlite3.connect(':memory:', check_same_thread=False,
+                                    detect_types=sqlite3.PARSE_DECLTYPES)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.create_function('NOW', 0, lambda: '2026-01-01 00:00:00')
+
+    def cursor(self, cursorclass=None):
+        # Curseurs serveur (stream_query) compris : SQLite lit les lignes à la demande
+        return SqliteCursor(self.conn)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def script(self, sql):
+        self.conn.executescript(sql)
+
+    def rows(self, sql, params=()):
+        with self.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+@pytest.fixture
+def sqlite_db():
+    db = SqliteConnection()
+    yield db
+    db.conn.close()
+
+
+# Comptes de l'application : table des rôles et un administrateur (id 1)
+USERS_SCHEMA = """
+    CREATE TABLE roles (id INTEGER PRIMARY KEY, name TEXT);
+    CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, password_hash TEXT, role_id INT, is_active BOOLEAN);
+    INSERT INTO roles VALUES (1, 'admin');
+    INSERT INTO users VALUES (1, 'admin', 'x', 1, 1);
+"""
+
+
+@pytest.fixture
+def sqlite_app(monkeypatch):
+    """
+    Fabrique d'applications complètes (create_app) dont la base principale et
+    chaque shard sont des connexions SQLite : build(primaire, shard1, ...).
+    Le client renvoyé est connecté avec le compte administrateur.
+    """
+    def build(*dbs):
+        settings = {'JOBS_RUNNER': 'off', 'ADMISSION_RATES': '', 'ADMISSION_CONCURRENCY': '',
+                    'DB_POOL_MIN_SIZE': '0', 'SERVER_TIMING': '1',
+                    'DB_SHARDS': ','.join(f"shard{index}/patients" for index in range(1, len(dbs)))}
+        for key, value in settings.items():
+            monkeypatch.setenv(key, value)
+        from app import create_app
+        app = create_app()
+        for pool, db in zip([app.extensions['db_pool'], *app.extensions['db_shards']], dbs):
+            monkeypatch.setattr(pool, 'acquire', lambda timeout=None, db=db: db)
+            monkeypatch.setattr(pool, 'release', lambda conn, discard=False: None)
+        dbs[0].script(USERS_SCHEMA)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = '1'
+        return app, client
+    return build
@@ -0,0 +1,28 @@
+import json
+
+import pytest
+
+from admission import AdmissionControl, TokenBuckets, parse_classes, parse_rate
+
+
+def test_stats_are_serializable_before_any_request():
+    control = AdmissionControl({'search': (2, 10)}, {'list': 2})
+    stats = control.stats()
+    json.dumps(stats)
+    assert stats['search']['rate'] == {'per_sec': 2, 'burst': 10, 'keys': 0}
+    assert stats['list']['rate'] is None
+    assert stats['list']['concurrency']['limit'] == 2
+
+
+def test_token_bucket_throttles_after_burst():
+    buckets = TokenBuckets(rate=1, burst=2)
+    assert buckets.take('a') == 0
+    assert buckets.take('a') == 0
+    assert buckets.take('a') > 0
+    assert buckets.take('b') == 0
+
+
+def test_parse_classes_rejects_unknown_class():
+    assert parse_classes('search=2:10', 'ADMISSION_RATES', parse_rate) == {'search': (2.0, 10.0)}
+    with pytest.raises(ValueError):
+        parse_classes('upload=1', 'ADMISSION_RATES', parse_rate)
@@ -0,0 +1,97 @@
+from datetime import datetime
+
+import pytest
+
+import archive
+import study_stats
+from conftest import SqliteConnection, SqliteCursor
+
+SCHEMA = """
+    CREATE TABLE studies (id INTEGER PRIMARY KEY, patient_id INT, study_date DATETIME, study_description TEXT,
+                          modality TEXT, version INT, updated_at DATETIME);
+    CREATE TABLE studies_archive (id INTEGER PRIMARY KEY, patient_id INT, study_date DATETIME,
+                                  study_description TEXT, modality TEXT, version INT, updated_at DATETIME);
+    CREATE TABLE study_stats_daily (stat_date TEXT, modality TEXT, study_count INT);
+    CREATE TABLE table_versions (table_name TEXT PRIMARY KEY, version INT, updated_at DATETIME);
+    CREATE TABLE change_log (id INTEGER PRIMARY KEY, table_name TEXT, row_id INT, op TEXT);
+    INSERT INTO studies VALUES
+        (1, 1, '2020-03-01 09:00:00', 'IRM genou', 'IRM', 2, '2020-03-01 09:00:00'),
+        (2, 1, '2020-01-15 10:00:00', 'Radio thorax', 'RX', 1, '2020-01-15 10:00:00'),
+        (3, 2, '2020-01-15 11:00:00', 'Scanner', 'CT', 1, '2020-01-15 11:00:00'),
+        (4, 2, '2025-06-01 08:00:00', 'Radio main', 'RX', 1, '2025-06-01 08:00:00');
+    INSERT INTO study_stats_daily VALUES ('2020-01-15', 'RX', 1), ('2020-01-15', 'CT', 1),
+                                         ('2020-03-01', 'IRM', 1), ('2025-06-01', 'RX', 1);
+    INSERT INTO table_versions VALUES ('studies', 7, '2025-06-01 08:00:00');
+"""
+
+
+class ArchiveCursor(SqliteCursor):
+    """SQLite verrouille toute la base en écriture : le FOR UPDATE de MariaDB n'a pas d'équivalent."""
+
+    def execute(self, sql, params=()):
+        return super().execute(sql.replace(' FOR UPDATE', ''), params)
+
+
+class ArchiveDb(SqliteConnection):
+    fail_on = None
+
+    def cursor(self):
+        cursor = ArchiveCursor(self.conn)
+        if self.fail_on:
+            execute = cursor.execute
+
+            def failing(sql, params=()):
+                if sql.startswith(self.fail_on):
+                    raise RuntimeError("connexion perdue")
+                return execute(sql, params)
+            cursor.execute = failing
+        return cursor
+
+
+@pytest.fixture
+def db():
+    db = ArchiveDb()
+    db.script(SCHEMA)
+    yield db
+    db.conn.close()
+
+
+def daily_counts(db):
+    """Synthèse par jour et modalité recalculée sur les deux tables, comme study_stats.rebuild."""
+    return db.rows(f"SELECT {study_stats.DAILY_KEY}, COUNT(*) AS n FROM {study_stats.ALL_STUDIES} s "
+                   f"GROUP BY 1, 2 ORDER BY 1, 2")
+
+
+def test_oldest_studies_move_to_the_archive_unchanged(db):
+    before = db.rows("SELECT * FROM studies ORDER BY id")
+    assert archive.archive_batch(db, datetime(2021, 1, 1), batch_size=2) == 2
+
+    # Les plus anciennes d'abord : l'étude 1 (mars 2020) attend le lot suivant
+    assert [row['id'] for row in db.rows("SELECT id FROM studies ORDER BY id")] == [1, 4]
+    assert db.rows("SELECT * FROM studies_archive ORDER BY id") == [before[1], before[2]]
+    assert archive.archive_batch(db, datetime(2021, 1, 1), batch_size=2) == 1
+    assert archive.archive_batch(db, datetime(2021, 1, 1), batch_size=2) == 0
+    assert [row['id'] for row in db.rows("SELECT id FROM studies_archive ORDER BY id")] == [1, 2, 3]
+
+
+def test_archiving_leaves_the_statistics_alone(db):
+    stats, counts = db.rows("SELECT * FROM study_stats_daily"), daily_counts(db)
+    archive.archive_batch(db, datetime(2021, 1, 1), batch_size=10)
+    assert db.rows("SELECT * FROM study_stats_daily") == stats
+    assert daily_counts(db) == counts
+
+
+def test_moved_studies_are_published_as_deleted(db):
+    archive.archive_batch(db, datetime(2021, 1, 1), batch_size=10)
+    assert db.rows("SELECT table_name, row_id, op FROM change_log ORDER BY row_id") == [
+        {'table_name': 'studies', 'row_id': study_id, 'op': 'delete'} for study_id in (1, 2, 3)]
+    assert db.rows("SELECT version FROM table_versions") == [{'version': 8}]
+
+
+def test_failed_batch_moves_nothing(db):
+    db.fail_on = 'DELETE FROM studies'
+    with pytest.raises(RuntimeError):
+        archive.archive_batch(db, datetime(2021, 1, 1), batch_size=10)
+    assert len(db.rows("SELECT id FROM studies")) == 4
+    assert db.rows("SELECT id FROM studies_archive") == []
+    assert db.rows("SELECT id FROM change_log") == []
@@ -0,0 +1,85 @@
+import pymysql
+import pytest
+
+from conftest import SqliteConnection
+
+SHARD_SCHEMA = """
+    CREATE TABLE patients (id INTEGER PRIMARY KEY, lastname TEXT, firstname TEXT, birthdate TEXT, gender TEXT,
+                           version INT DEFAULT 1);
+    CREATE TABLE table_versions (table_name TEXT PRIMARY KEY, version INT);
+    CREATE TABLE change_log (id INTEGER PRIMARY KEY, table_name TEXT, row_id INT, op TEXT);
+    INSERT INTO table_versions VALUES ('patients', 0), ('studies', 0), ('users', 0);
+"""
+
+
+class FailingShard(SqliteConnection):
+    """Shard dont l'UPDATE des patients ou le commit échoue."""
+
+    def __init__(self, fail_on):
+        super().__init__()
+        self.fail_on = fail_on
+
+    def cursor(self):
+        cursor = super().cursor()
+        if self.fail_on == 'update':
+            execute = cursor.execute
+
+            def failing(sql, params=()):
+                if sql.startswith('UPDATE patients'):
+                    raise pymysql.err.OperationalError(1205, "Lock wait timeout exceeded")
+                return execute(sql, params)
+            cursor.execute = failing
+        return cursor
+
+    def commit(self):
+        if self.fail_on == 'commit':
+            raise pymysql.err.OperationalError(2013, "Lost connection to MySQL server during query")
+        super().commit()
+
+
+def shards(second):
+    # Ids impairs sur le shard 0, pairs sur le shard 1 (auto_increment_offset)
+    dbs = (SqliteConnection(), second)
+    for index, db in enumerate(dbs):
+        db.script(SHARD_SCHEMA)
+        db.conn.execute("INSERT INTO patients (id, lastname, firstname) VALUES (?, 'Avant', 'A')", (index + 1,))
+        db.conn.commit()
+    return dbs
+
+
+def lastnames(db):
+    return [row['lastname'] for row in db.rows("SELECT lastname FROM patients")]
+
+
+def patch(client):
+    return client.patch('/api/patients', json=[{'id': 1, 'lastname': 'Après'}, {'id': 2, 'lastname': 'Après'}])
+
+
+def test_batch_spanning_shards_is_applied_on_each(sqlite_app):
+    dbs = shards(SqliteConnection())
+    _, client = sqlite_app(*dbs)
+    response = patch(client)
+    assert response.json['status'] == 'success'
+    assert [lastnames(db) for db in dbs] == [['Après'], ['Après']]
+    assert [len(db.rows("SELECT * FROM change_log")) for db in dbs] == [1, 1]
+
+
+def test_sql_error_on_a_later_shard_applies_nothing(sqlite_app):
+    dbs = shards(FailingShard('update'))
+    _, client = sqlite_app(*dbs)
+    response = patch(client)
+    assert response.status_code == 500
+    assert "rien n'a été appliqué" in response.json['message']
+    assert [lastnames(db) for db in dbs] == [['Avant'], ['Avant']]
+    assert dbs[0].rows("SELECT * FROM change_log") == []
+
+
+def test_failed_commit_reports_which_items_were_applied(sqlite_app):
+    dbs = shards(FailingShard('commit'))
+    _, client = sqlite_app(*dbs)
+    response = patch(client)
+    assert response.status_code == 200 and response.json['status'] == 'partial'
+    statuses = {result['id']: result['status'] for result in response.json['results']}
+    assert statuses == {1: 'updated', 2: 'failed'}
+    assert response.json['counts'] == {'updated': 1, 'failed': 1}
+    assert [lastnames(db) for db in dbs] == [['Après'], ['Avant']]
@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+import bulk
+from conftest import SqliteConnection
+
+SCHEMA = """
+    CREATE TABLE patients (id INTEGER PRIMARY KEY, lastname TEXT, firstname TEXT, birthdate TEXT, gender TEXT,
+                           updated_at DATETIME);
+    CREATE TABLE studies (id INTEGER PRIMARY KEY, patient_id INT, study_date DATETIME, study_description TEXT,
+                          modality TEXT, updated_at DATETIME);
+    CREATE TABLE studies_archive (id INTEGER PRIMARY KEY, patient_id INT, study_date DATETIME,
+                                  study_description TEXT, modality TEXT, updated_at DATETIME);
+    INSERT INTO patients VALUES (1, 'Dupont', 'Jean', NULL, 'M', '2020-01-01 00:00:00'),
+                                (2, 'Durand', 'Marie', NULL, 'F', '2020-01-01 00:00:00'),
+                                (3, 'Martin', 'Paul', NULL, 'M', '2020-01-01 00:00:00');
+    INSERT INTO studies VALUES (5, 1, '2025-02-01 09:00:00', 'Radio main', 'RX', '2025-02-01 09:00:00');
+    -- Patient 3 n'a plus que des études archivées, dont une corrigée récemment
+    INSERT INTO studies_archive VALUES (3, 1, '2019-05-01 09:00:00', 'IRM genou', 'IRM', '2019-05-01 09:00:00'),
+                                       (4, 3, '2018-03-01 09:00:00', 'Scanner', 'CT', '2025-06-01 00:00:00');
+"""
+
+
+@pytest.fixture
+def export(sqlite_app):
+    """export_rows exécuté sur une base SQLite, lignes regroupées par patient : {id: [ids d'études]}."""
+    db = SqliteConnection()
+    db.script(SCHEMA)
+    app, _ = sqlite_app(db)
+
+    def run(**filters):
+        with app.app_context():
+            rows = bulk.export_rows(include_studies=True, size=2, **filters)
+            try:
+                return {p['id']: [s['id'] for s in p['studies']] for p in bulk.nest_studies(rows)}
+            finally:
+                rows.close()
+    return run
+
+
+def test_export_with_archive_nests_hot_and_archived_studies(export):
+    assert export(include_archive=True) == {1: [3, 5], 2: [], 3: [4]}
+
+
+def test_export_without_archive_reads_hot_studies_only(export):
+    # Le patient 3 reste exporté, sans ses études archivées
+    assert export() == {1: [5], 2: [], 3: []}
+
+
+def test_recent_archived_study_selects_its_patient(export):
+    since = datetime(2025, 5, 1)
+    assert export(updated_since=since, include_archive=True) == {3: [4]}
+    assert export(updated_since=since) == {}
+
+
+def test_since_id_applies_to_both_study_tables(export):
+    assert export(since_id=1, include_archive=True) == {2: [], 3: [4]}
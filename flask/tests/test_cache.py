@@ -0,0 +1,108 @@
+import pytest
+from flask import Flask
+
+import cache as cache_module
+import models
+from cache import TTLCache
+from models import User
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = TTLCache(ttl=10)
+    cache.set('a', 1)
+    clock[0] += 9
+    assert cache.get('a') == 1
+    clock[0] += 2
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+
+
+def test_invalidate_and_clear(clock):
+    cache = TTLCache()
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.invalidate('a')
+    cache.invalidate('missing')
+    assert cache.get('a') is None and cache.get('b') == 2
+    cache.clear()
+    assert cache.stats()['size'] == 0
+
+
+USERS_SQL = """
+    CREATE TABLE roles (id INTEGER PRIMARY KEY, name TEXT);
+    CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT, password_hash TEXT, role_id INT, is_active BOOLEAN);
+    CREATE TABLE table_versions (table_name TEXT PRIMARY KEY, version INT);
+    INSERT INTO roles VALUES (1, 'admin'), (2, 'lecture');
+    INSERT INTO users VALUES (1, 'alice', 'x', 1, 1);
+    INSERT INTO table_versions VALUES ('users', 0);
+"""
+
+
+def worker(interval=0):
+    """Application d'un worker Gunicorn : son propre cache, la base partagée."""
+    app = Flask(__name__)
+    app.extensions['user_cache'] = TTLCache()
+    app.extensions['users_version'] = models.UsersVersion(interval)
+    return app
+
+
+@pytest.fixture
+def users_db(sqlite_db, monkeypatch):
+    sqlite_db.script(USERS_SQL)
+    monkeypatch.setattr(models, 'get_db', lambda: sqlite_db)
+    return sqlite_db
+
+
+def demote(db, user_id):
+    """Ce que fait PUT /api/users/<id> : changement de rôle et version de `users`."""
+    with db.cursor() as cursor:
+        cursor.execute("UPDATE users SET role_id = 2 WHERE id = %s", (user_id,))
+        cursor.execute("UPDATE table_versions SET version = version + 1 WHERE table_name = 'users'")
+    db.commit()
+
+
+def test_get_cached_reads_user_once_until_invalidated(users_db):
+    with worker(interval=60).app_context():
+        assert User.get_cached(1).role == 'admin'
+        demote(users_db, 1)
+        assert User.get_cached('1').role == 'admin'
+        User.invalidate(1)
+        assert User.get_cached(1).role == 'lecture'
+
+
+def test_other_workers_drop_cached_users_when_users_version_changes(users_db):
+    first, second = worker(), worker()
+    for app in (first, second):
+        with app.app_context():
+            assert User.get_cached(1).role == 'admin'
+    with first.app_context():
+        demote(users_db, 1)
+        User.invalidate(1)
+    with second.app_context():
+        assert User.get_cached(1).role == 'lecture'
+
+
+def test_users_version_is_read_at_most_once_per_interval(users_db):
+    app = worker(interval=60)
+    with app.app_context():
+        User.get_cached(1)
+        demote(users_db, 1)
+        assert User.get_cached(1).role == 'admin'
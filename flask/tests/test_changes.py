@@ -0,0 +1,22 @@
+from datetime import date, datetime
+
+from changes import iso_dates, subscriber_limit
+
+
+def test_gevent_keeps_configured_limit():
+    assert subscriber_limit(1000, 'gevent', 4) == 1000
+
+
+def test_gthread_leaves_threads_for_other_requests():
+    assert subscriber_limit(1000, 'gthread', 4) == 2
+    assert subscriber_limit(1, 'gthread', 8) == 1
+
+
+def test_sync_workers_disable_the_feed():
+    assert subscriber_limit(1000, 'sync', 4) == 0
+
+
+def test_event_rows_carry_iso_dates():
+    row = {'id': 1, 'study_date': datetime(2024, 3, 5, 14, 30), 'birthdate': date(1980, 1, 2), 'modality': 'CT'}
+    assert iso_dates(row) == {'id': 1, 'study_date': '2024-03-05T14:30:00', 'birthdate': '1980-01-02',
+                              'modality': 'CT'}
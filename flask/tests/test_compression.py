@@ -0,0 +1,38 @@
+from flask import Flask, jsonify
+
+import compression
+import versioning
+
+
+def make_app():
+    app = Flask(__name__)
+    app.config.update(COMPRESSION_ENCODINGS='gzip', COMPRESSION_MIN_SIZE=16)
+    compression.init_app(app)
+
+    @app.route('/items')
+    def items():
+        if versioning.is_fresh('v1'):
+            return versioning.not_modified(versioning.matching_etag('v1'))
+        response = jsonify(items=['x' * 10] * 50)
+        response.set_etag('v1')
+        return response
+
+    return app
+
+
+def test_compressed_body_gets_its_own_etag():
+    client = make_app().test_client()
+    identity = client.get('/items')
+    gzipped = client.get('/items', headers={'Accept-Encoding': 'gzip'})
+    assert identity.headers['ETag'] == '"v1"'
+    assert gzipped.headers['Content-Encoding'] == 'gzip'
+    assert gzipped.headers['ETag'] == '"v1-gzip"'
+
+
+def test_suffixed_etag_is_accepted_in_if_none_match():
+    client = make_app().test_client()
+    response = client.get('/items', headers={'Accept-Encoding': 'gzip', 'If-None-Match': '"v1-gzip"'})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == '"v1-gzip"'
+    assert client.get('/items', headers={'If-None-Match': '"v1"'}).status_code == 304
+    assert client.get('/items', headers={'If-None-Match': '"v1-br"'}).status_code == 200
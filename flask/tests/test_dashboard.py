@@ -0,0 +1,33 @@
+import sqlite3
+
+from pagination import decode_cursor, encode_cursor
+from routes.frontend import DASHBOARD_SORT, dashboard_seek
+
+
+def pages(rows, per_page):
+    """Parcourt le tableau de bord page par page, comme la vue (SQLite trie aussi les NULL en dernier en DESC)."""
+    db = sqlite3.connect(':memory:')
+    db.execute("CREATE TABLE studies (id INTEGER PRIMARY KEY, study_date TEXT)")
+    db.executemany("INSERT INTO studies VALUES (?, ?)", rows)
+    seen, token = [], None
+    while True:
+        where, params = "", []
+        if token:
+            condition, params = dashboard_seek(decode_cursor(token, 'study_date', len(DASHBOARD_SORT)))
+            where = " WHERE " + condition
+        sql = (f"SELECT s.id, s.study_date FROM studies s{where} "
+               f"ORDER BY s.study_date DESC, s.id DESC LIMIT ?").replace('%s', '?')
+        page = db.execute(sql, (*params, per_page + 1)).fetchall()
+        seen.extend(row[0] for row in page[:per_page])
+        if len(page) <= per_page:
+            return seen
+        last = page[per_page - 1]
+        token = encode_cursor('study_date', [last[1], last[0]])
+
+
+def test_pages_cover_studies_without_date():
+    rows = [(1, '2024-01-01 10:00:00'), (2, None), (3, '2024-02-01 10:00:00'), (4, None),
+            (5, '2024-01-01 10:00:00'), (6, None), (7, None)]
+    expected = [3, 5, 1, 7, 6, 4, 2]
+    for per_page in (1, 2, 3, 10):
+        assert pages(rows, per_page) == expected
@@ -0,0 +1,69 @@
+import pytest
+
+SCHEMA = """
+    CREATE TABLE patients (id INTEGER PRIMARY KEY, lastname TEXT, firstname TEXT, birthdate TEXT, gender TEXT);
+    CREATE TABLE studies (id INTEGER PRIMARY KEY, patient_id INT, study_date DATETIME, study_description TEXT,
+                          modality TEXT);
+    CREATE TABLE table_versions (table_name TEXT PRIMARY KEY, version INT, updated_at DATETIME);
+    CREATE TABLE change_log (id INTEGER PRIMARY KEY);
+    INSERT INTO table_versions VALUES ('patients', 1, '2026-01-01 00:00:00'), ('studies', 1, '2026-01-01 00:00:00'),
+                                      ('users', 1, '2026-01-01 00:00:00');
+"""
+
+
+@pytest.fixture
+def client(sqlite_db, sqlite_app):
+    _, client = sqlite_app(sqlite_db)
+    sqlite_db.script(SCHEMA)
+    return client, sqlite_db
+
+
+def add_studies(db, count):
+    db.conn.executemany("INSERT INTO patients (lastname, firstname) VALUES (?, ?)",
+                        [(f"Nom{i}", f"Prénom{i}") for i in range(count)])
+    db.conn.executemany("INSERT INTO studies (patient_id, study_date, study_description, modality) "
+                        "VALUES (?, ?, 'Genou', 'IRM')",
+                        [(i + 1, f"2026-01-{i % 28 + 1:02d} 10:00:00") for i in range(count)])
+
+
+def user_queries(statements):
+    return [sql for sql in statements if 'users' in sql.split() or 'roles' in sql.split()]
+
+
+def render(client):
+    from flask import g
+    client.get('/')  # premier passage : chargement de l'utilisateur et des index
+    with client:
+        response = client.get('/')
+        assert response.status_code == 200
+        return [sql for sql, _, _ in g.sql_queries.statements], response
+
+
+@pytest.mark.parametrize('rows', [3, 40])
+def test_dashboard_does_not_look_up_users_or_roles(client, rows):
+    client, db = client
+    add_studies(db, rows)
+    statements, response = render(client)
+    assert response.get_data(as_text=True).count('Genou') == rows
+    assert user_queries(statements) == []
+
+
+def test_dashboard_query_count_does_not_grow_with_rows(client):
+    client, db = client
+    add_studies(db, 3)
+    few, _ = render(client)
+    add_studies(db, 40)
+    many, _ = render(client)
+    assert len(many) == len(few)
+
+
+def test_user_is_loaded_once_then_served_from_cache(client):
+    client, db = client
+    add_studies(db, 10)
+    from flask import g
+    with client:
+        client.get('/')
+        first = user_queries(sql for sql, _, _ in g.sql_queries.statements)
+    assert len(first) == 1
+    statements, _ = render(client)
+    assert user_queries(statements) == []
@@ -0,0 +1,53 @@
+import pytest
+from flask import Flask
+
+import jobs
+
+JOBS_SQL = """
+    CREATE TABLE jobs (
+        id INTEGER PRIMARY KEY, job_type TEXT, status TEXT, attempts INT, max_attempts INT,
+        cancel_requested BOOLEAN DEFAULT FALSE, worker TEXT, heartbeat_at TEXT, error TEXT, finished_at TEXT
+    );
+    INSERT INTO jobs (id, job_type, status, attempts, max_attempts, cancel_requested, worker) VALUES
+        (1, 'import', 'running', 1, 1, FALSE, 'web:1'),
+        (2, 'export_patients', 'running', 1, 3, FALSE, 'web:1'),
+        (3, 'export_patients', 'running', 1, 3, TRUE, 'web:1'),
+        (4, 'export_patients', 'running', 1, 3, FALSE, 'web:2'),
+        (5, 'export_patients', 'succeeded', 1, 3, FALSE, 'web:1');
+"""
+
+
+@pytest.fixture
+def jobs_db(sqlite_db):
+    sqlite_db.script(JOBS_SQL)
+    return sqlite_db
+
+
+def statuses(db):
+    return {row['id']: (row['status'], row['worker']) for row in db.rows("SELECT id, status, worker FROM jobs")}
+
+
+def test_release_running_respects_attempts_and_cancellation(jobs_db):
+    with jobs_db.cursor() as cursor:
+        assert jobs.release_running(cursor, "worker = %s", ('web:1',)) == 1
+    assert statuses(jobs_db) == {
+        1: ('failed', 'web:1'),
+        2: ('queued', None),
+        3: ('cancelled', 'web:1'),
+        4: ('running', 'web:2'),
+        5: ('succeeded', 'web:1'),
+    }
+
+
+def test_graceful_stop_does_not_replay_an_import(jobs_db, monkeypatch):
+    app = Flask(__name__)
+    monkeypatch.setattr(jobs, 'get_db', lambda: jobs_db)
+    runner = jobs.JobRunner(app, {'import': 1, 'export_patients': 2})
+    runner.worker = 'web:1'
+    contexts = {job_id: jobs.JobContext(job_id, 1) for job_id in (1, 2)}
+    runner._running = {1: ('import', contexts[1]), 2: ('export_patients', contexts[2])}
+    runner.stop()
+    assert all(ctx.lost for ctx in contexts.values())
+    assert statuses(jobs_db)[1] == ('failed', 'web:1')
+    assert statuses(jobs_db)[2] == ('queued', None)
+    assert runner.stats()['requeued'] == 1
@@ -0,0 +1,49 @@
+import pytest
+
+import loaders
+
+
+def test_parse_ids_keeps_request_order_without_duplicates():
+    assert loaders.parse_ids(' 3,1, 3,,2 ', max_ids=10) == [3, 1, 2]
+
+
+@pytest.mark.parametrize('value, message', [('1,a', "invalide"), ('1,-2', "invalide"), (' , ', "vide"),
+                                            ('1,2,3', "Trop")])
+def test_parse_ids_rejects_bad_lists(value, message):
+    with pytest.raises(ValueError, match=message):
+        loaders.parse_ids(value, max_ids=2)
+
+
+def test_parse_include():
+    assert loaders.parse_include(None) == set()
+    assert loaders.parse_include('studies, studies') == {'studies'}
+    with pytest.raises(ValueError, match="inconnue: users"):
+        loaders.parse_include('studies,users')
+
+
+class FakeCursor:
+    def __init__(self, tables):
+        self.tables = tables
+        self.queries = 0
+
+    def execute(self, sql, params):
+        self.queries += 1
+        table = sql.split()[3]
+        self.rows = [row for row in self.tables[table] if row.get('patient_id', row['id']) in params]
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_fetch_patients_and_attach_studies_in_one_query_per_table():
+    cursor = FakeCursor({
+        'patients': [{'id': 1}, {'id': 2}],
+        'studies': [{'id': 10, 'patient_id': 2}, {'id': 11, 'patient_id': 1}],
+        'studies_archive': [{'id': 5, 'patient_id': 2}],
+    })
+    patients, missing = loaders.fetch_patients(cursor, [2, 9, 1])
+    assert [p['id'] for p in patients] == [2, 1] and missing == [9]
+    loaders.attach_studies(cursor, patients, ('studies', 'studies_archive'))
+    assert [s['id'] for s in patients[0]['studies']] == [10, 5]
+    assert [s['id'] for s in patients[1]['studies']] == [11]
+    assert cursor.queries == 3
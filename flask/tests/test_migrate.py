@@ -0,0 +1,84 @@
+import os
+
+import click
+import pytest
+
+import migrate
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+
+def write(directory, name, sql):
+    path = directory / name
+    path.write_text(sql, encoding='utf-8')
+    return path
+
+
+def test_repository_migrations_are_ordered_and_split():
+    migrations = migrate.discover(MIGRATIONS_DIR)
+    versions = [m.version for m in migrations]
+    assert versions == sorted(set(versions))
+    for migration in migrations:
+        statements = migration.statements()
+        assert statements
+        assert not any(statement.endswith(';') or statement.startswith('--') for statement in statements)
+
+
+def test_statements_split_on_trailing_semicolons_only(tmp_path):
+    write(tmp_path, '0001_init.sql', "-- commentaire ; ignoré\nCREATE TABLE a (x VARCHAR(3) DEFAULT ';');\n\n"
+                                      "CREATE INDEX i ON a (x)  ;\n")
+    write(tmp_path, 'notes.txt', "pas une migration")
+    migration, = migrate.discover(tmp_path)
+    assert (migration.version, migration.name) == ('0001', 'init')
+    assert migration.statements() == ["CREATE TABLE a (x VARCHAR(3) DEFAULT ';')", "CREATE INDEX i ON a (x)"]
+
+
+def test_duplicate_versions_are_rejected(tmp_path):
+    write(tmp_path, '0001_a.sql', "SELECT 1;")
+    write(tmp_path, '0001_b.sql', "SELECT 2;")
+    with pytest.raises(click.ClickException, match="0001"):
+        migrate.discover(tmp_path)
+
+
+class FakeCursor:
+    def __init__(self, applied):
+        self.applied = applied
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+    def fetchall(self):
+        return self.applied
+
+
+class FakeDb:
+    def __init__(self, applied):
+        self.cursor_ = FakeCursor(applied)
+        self.commits = 0
+
+    def cursor(self):
+        return self.cursor_
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_upgrade_applies_pending_migrations_up_to_target(tmp_path):
+    first = write(tmp_path, '0001_a.sql', "CREATE TABLE a (x INT);")
+    write(tmp_path, '0002_b.sql', "CREATE TABLE b (x INT);")
+    write(tmp_path, '0003_c.sql', "CREATE TABLE c (x INT);")
+    checksum = migrate.Migration('0001', 'a', str(first)).checksum
+    db = FakeDb([{'version': '0001', 'name': 'a', 'checksum': checksum, 'applied_at': None}])
+    messages = []
+    assert migrate.upgrade(db, tmp_path, target='0002', log=messages.append) == 1
+    assert "CREATE TABLE b (x INT)" in db.cursor_.executed
+    assert not any('TABLE a' in sql or 'TABLE c' in sql for sql in db.cursor_.executed)
+    assert db.commits == 1
+    assert messages == ["Application de 0002_b..."]
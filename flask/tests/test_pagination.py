@@ -0,0 +1,39 @@
+from datetime import datetime
+
+import pytest
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor, seek_condition
+
+
+@pytest.mark.parametrize('values', [[42], ['Éloïse', 'Zoé', 7], [None, 3]])
+def test_cursor_round_trip(values):
+    token = encode_cursor('name', values)
+    assert '=' not in token
+    assert decode_cursor(token, 'name', len(values)) == values
+
+
+def test_datetime_cursor_round_trips_as_sql_literal():
+    token = encode_cursor('study_date', [datetime(2024, 3, 5, 14, 30), 9])
+    assert decode_cursor(token, 'study_date', 2) == ['2024-03-05 14:30:00', 9]
+
+
+@pytest.mark.parametrize('token', ['', 'not-base64!', encode_cursor('name', 'abc')[:-2] + '!!'])
+def test_unreadable_cursor_is_rejected(token):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(token, 'name', 3)
+
+
+def test_cursor_of_another_sort_is_rejected():
+    token = encode_cursor('id', [42])
+    with pytest.raises(InvalidCursor, match="incompatible"):
+        decode_cursor(token, 'name', 3)
+    with pytest.raises(InvalidCursor, match="incompatible"):
+        decode_cursor(encode_cursor('name', [1, 2]), 'name', 3)
+
+
+def test_seek_condition_expands_composite_key():
+    sql, params = seek_condition(['lastname', 'firstname', 'id'])
+    assert sql == "(lastname > %s OR (lastname = %s AND (firstname > %s OR (firstname = %s AND (id > %s)))))"
+    assert params(['a', 'b', 3]) == ['a', 'a', 'b', 'b', 3]
+    sql, params = seek_condition(['id'], descending=True)
+    assert (sql, params([5])) == ("(id < %s)", [5])
@@ -0,0 +1,88 @@
+import os
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+import patient_index
+from conftest import USERS_SCHEMA, SqliteConnection
+
+PATIENTS_SCHEMA = """
+    CREATE TABLE patients (id INTEGER PRIMARY KEY, lastname TEXT, firstname TEXT, birthdate TEXT,
+                           updated_at DATETIME);
+    CREATE TABLE table_versions (table_name TEXT PRIMARY KEY, version INT, updated_at DATETIME);
+    CREATE TABLE change_log (id INTEGER PRIMARY KEY, table_name TEXT, row_id INT, op TEXT, created_at DATETIME);
+    INSERT INTO patients VALUES (1, 'Dupont', 'Jean', NULL, '2026-01-01 10:00:00'),
+                                (2, 'Durand', 'Marie', NULL, '2026-01-01 10:00:00');
+    INSERT INTO table_versions VALUES ('patients', 1, '2026-01-01 10:00:00');
+"""
+
+# Écritures validées sur le primaire après la construction de l'index
+WRITES = """
+    DELETE FROM patients WHERE id = 2;
+    INSERT INTO patients VALUES (3, 'Durieux', 'Paul', NULL, '2026-01-01 10:05:00');
+    INSERT INTO change_log (table_name, row_id, op, created_at) VALUES
+        ('patients', 2, 'delete', '2026-01-01 10:05:00'),
+        -- Patient 1 déplacé sur ce shard par un rééquilibrage : toujours présent
+        ('patients', 1, 'delete', '2026-01-01 10:05:00');
+    UPDATE table_versions SET version = 2 WHERE table_name = 'patients';
+"""
+
+
+class StaleReplicas:
+    """Réplique en retard : elle n'a reçu aucune des écritures de WRITES."""
+
+    def __init__(self, db):
+        self.replica = SimpleNamespace(name='replica', pool=SimpleNamespace(release=lambda conn, discard=False: None))
+        self.db = db
+
+    def acquire(self):
+        return self.replica, self.db
+
+
+@pytest.fixture
+def suggest(sqlite_app, monkeypatch):
+    # SQLite n'a pas la syntaxe INTERVAL de MariaDB
+    monkeypatch.setattr(patient_index, 'CHANGED_SQL',
+                        patient_index.CHANGED_SQL.replace("%s - INTERVAL %s SECOND", "datetime(%s, -%s || ' seconds')"))
+    monkeypatch.setattr(patient_index, 'DELETED_SQL',
+                        patient_index.DELETED_SQL.replace("%s - INTERVAL %s SECOND", "datetime(%s, -%s || ' seconds')"))
+    monkeypatch.setenv('SUGGEST_REFRESH_INTERVAL', '0')
+    primary, replica = SqliteConnection(), SqliteConnection()
+    for db in (primary, replica):
+        db.script(PATIENTS_SCHEMA)
+    replica.script(USERS_SCHEMA)
+    app, client = sqlite_app(primary)
+    app.extensions['db_replicas'] = StaleReplicas(replica)
+
+    index = app.extensions['patient_index']
+    index._state = (patient_index.build_segment(primary.rows("SELECT * FROM patients ORDER BY id")),
+                    patient_index.Delta())
+    index._pid = os.getpid()
+    index._version = [1]
+    index._watermark = [datetime(2026, 1, 1, 10)]
+    index._deleted_at = [datetime(2026, 1, 1, 10)]
+    index._built_at = time.monotonic()
+    primary.script(WRITES)
+
+    def get(query):
+        response = client.get('/api/patients/suggest', query_string={'q': query})
+        assert response.status_code == 200
+        return [row['id'] for row in response.get_json()]
+    get.primary = primary
+    return get
+
+
+def test_refresh_reads_the_primary_and_drops_deleted_patients(suggest):
+    assert suggest('du') == [1, 3]
+
+
+def test_deleted_patient_comes_back_when_recreated(suggest):
+    primary = suggest.primary
+    assert suggest('durand') == []
+    primary.script("""
+        INSERT INTO patients VALUES (2, 'Durand', 'Marie', NULL, '2026-01-01 10:06:00');
+        UPDATE table_versions SET version = 3 WHERE table_name = 'patients';
+    """)
+    assert suggest('durand') == [2]
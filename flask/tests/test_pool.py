@@ -0,0 +1,48 @@
+import pytest
+
+import pool as pool_module
+from pool import ConnectionPool, PoolClosed
+
+
+class FakeConnection:
+    open = True
+
+    def ping(self, reconnect=False):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.open = False
+
+
+def test_checkout_counters_stay_bounded(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(pool_module.time, 'monotonic', lambda: clock[0])
+    pool = ConnectionPool({}, min_size=0, max_size=1)
+    monkeypatch.setattr(pool, '_connect', lambda: pool_module._PooledConnection(FakeConnection()))
+    for _ in range(5000):
+        pool.release(pool.acquire())
+        clock[0] += 0.1
+    assert len(pool._recent_checkouts) <= ConnectionPool.RATE_WINDOW
+    stats = pool.stats()
+    # 10 emprunts par seconde sur la dernière minute
+    assert 9.5 <= stats['checkouts_per_sec'] <= 10.5
+    assert stats['checkouts'] == 5000
+
+
+def test_close_discards_borrowed_connections_and_refuses_new_ones():
+    pool = ConnectionPool({}, min_size=0, max_size=2)
+    pool._connect = lambda: pool_module._PooledConnection(FakeConnection())
+    idle, borrowed = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    pool.close()
+    assert idle.open is False
+    assert borrowed.open is True
+
+    pool.release(borrowed)
+    assert borrowed.open is False
+    assert pool.stats()['size'] == 0
+    with pytest.raises(PoolClosed):
+        pool.acquire(timeout=0.1)
@@ -0,0 +1,74 @@
+import pymysql
+
+from replicas import Replica, ReplicaSet
+
+
+class FakeCursor:
+    def __init__(self, error=None, status=None):
+        self.error = error
+        self.status = status
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.error is not None:
+            raise self.error
+
+    def fetchone(self):
+        return self.status
+
+
+class FakeConnection:
+    def __init__(self, **cursor):
+        self._cursor = FakeCursor(**cursor)
+
+    def cursor(self):
+        return self._cursor
+
+
+class FakePool:
+    in_use = 0
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.discarded = 0
+
+    def acquire(self, timeout=None):
+        return self.conn
+
+    def release(self, conn, discard=False):
+        self.discarded += discard
+
+    def stats(self):
+        return {}
+
+
+def replica_set(**cursor):
+    pool = FakePool(FakeConnection(**cursor))
+    return ReplicaSet([Replica('replica', pool)]), pool
+
+
+def test_missing_replication_privilege_keeps_replica_with_unknown_lag():
+    replicas, pool = replica_set(error=pymysql.err.OperationalError(1227, "Access denied"))
+    replica, conn = replicas.acquire()
+    assert conn is pool.conn
+    stats = replicas.stats()['replicas'][0]
+    assert stats['available'] and stats['lag_unknown'] and stats['lag'] is None
+    assert replicas.fallbacks == 0
+
+
+def test_other_errors_mark_replica_down():
+    replicas, pool = replica_set(error=pymysql.err.OperationalError(2013, "Lost connection"))
+    assert replicas.acquire() is None
+    assert pool.discarded == 1
+    assert replicas.stats()['replicas'][0]['available'] is False
+
+
+def test_stopped_replication_is_skipped():
+    replicas, pool = replica_set(status={'Seconds_Behind_Master': None})
+    assert replicas.acquire() is None
+    assert replicas.stats()['replicas'][0]['replication_stopped'] is True
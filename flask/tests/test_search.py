@@ -0,0 +1,91 @@
+from datetime import datetime
+from decimal import Decimal
+
+import search
+
+
+class FakeCursor:
+    """Renvoie, pour chaque requête, les lignes de la branche correspondante."""
+
+    def __init__(self, branches):
+        self.branches = branches
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        self.rows = []
+        for marker, rows in self.branches.items():
+            if marker in sql:
+                self.rows = [dict(row) for row in rows]
+                break
+
+    def fetchall(self):
+        return self.rows
+
+
+def row(score, study_id=10):
+    return {'patient_id': 1, 'lastname': 'Dupont', 'firstname': 'Jean', 'birthdate': None, 'gender': 'M',
+            'study_id': study_id, 'study_date': datetime(2024, 1, 1), 'study_description': 'IRM genou',
+            'modality': 'IRM', 'archived': 0, 'score': score}
+
+
+def test_scores_of_a_row_matching_several_branches_are_added():
+    # La description (MATCH, float) et la modalité (score constant, Decimal) trouvent la même étude
+    cursor = FakeCursor({
+        'MATCH(s.study_description)': [row(2.5)],
+        's.modality LIKE': [row(Decimal('1.0'))],
+    })
+    results = search.search(cursor, 'irm', fields=['description', 'modality'])
+    assert len(results) == 1
+    assert results[0]['score'] == 3.5
+    assert isinstance(results[0]['score'], float)
+
+
+def test_decimal_score_first_then_float():
+    cursor = FakeCursor({
+        'p.lastname LIKE': [row(Decimal('1.0'))],
+        's.modality LIKE': [row(Decimal('1.0'))],
+    })
+    results = search.search(cursor, 'du', fields=['name', 'modality'])
+    assert [r['score'] for r in results] == [2.0]
+
+
+def test_tokenize_folds_accents_and_drops_operators():
+    assert search.tokenize('Hélène +DUP*') == ['helene', 'dup']
+    assert search.boolean_query(['dup', 'je']) == '+dup* +je*'
+
+
+class RecordingCursor(FakeCursor):
+    """Garde chaque requête et ses paramètres, sans renvoyer de ligne."""
+
+    def __init__(self):
+        super().__init__({})
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        self.rows = []
+
+
+def test_short_words_of_a_mixed_query_filter_the_fulltext_branch():
+    cursor = RecordingCursor()
+    search.search(cursor, 'Li Martin', fields=['name'])
+    [(sql, params)] = cursor.executed
+    assert 'MATCH(p.lastname, p.firstname)' in sql
+    assert '(p.lastname LIKE %s OR p.firstname LIKE %s)' in sql
+    assert params == ('+martin*', '+martin*', 'li%', 'li%', 50)
+
+
+def test_every_short_word_is_required_without_indexed_words():
+    cursor = RecordingCursor()
+    search.search(cursor, 'Li Wu', fields=['name'])
+    [(sql, params)] = cursor.executed
+    assert 'MATCH' not in sql
+    assert params == ('li%', 'wu%', 'wu%', 50)
+
+
+def test_modality_is_compared_with_every_word():
+    cursor = RecordingCursor()
+    search.search(cursor, 'genou irm', fields=['modality'])
+    [(sql, params)] = cursor.executed
+    assert '(s.modality LIKE %s OR s.modality LIKE %s)' in sql
+    assert params == ('genou%', 'irm%', 50)
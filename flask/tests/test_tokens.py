@@ -0,0 +1,82 @@
+import os
+import time
+
+import pytest
+from flask import Blueprint, Flask, request
+from werkzeug.exceptions import HTTPException
+
+import tokens
+from tokens import InvalidToken, RevocationSet
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', API_TOKEN_SECRET=None)
+    api = Blueprint('api', __name__)
+    api.add_url_rule('/api/ping', 'ping', lambda: 'pong', methods=['GET', 'POST'])
+    app.register_blueprint(api)
+    return app
+
+
+@pytest.fixture
+def revocations(monkeypatch):
+    # Liste déjà chargée dans ce processus : aucune lecture de la base
+    revoked = RevocationSet()
+    revoked._loaded, revoked._pid = True, os.getpid()
+    monkeypatch.setattr(tokens, 'revocations', revoked)
+    return revoked
+
+
+def test_issued_token_decodes_to_its_claims(app):
+    token, claims = tokens.issue(app, 7, 'alice', 'admin', {'write', 'read'}, ttl=60)
+    assert tokens.decode(app, token) == claims
+    assert claims['scp'] == ['read', 'write']
+
+
+def test_tampered_and_expired_tokens_are_rejected(app):
+    token, claims = tokens.issue(app, 7, 'alice', 'admin', {'read'}, ttl=60)
+    prefix, payload, signature = token.split('.')
+    with pytest.raises(InvalidToken, match="Signature"):
+        tokens.decode(app, f"{prefix}.{payload}x.{signature}")
+    with pytest.raises(InvalidToken, match="expiré"):
+        tokens.decode(app, token, now=claims['exp'])
+    app.config['API_TOKEN_SECRET'] = 'autre'
+    with pytest.raises(InvalidToken, match="Signature"):
+        tokens.decode(app, token)
+
+
+@pytest.mark.parametrize('token', ['', 'pt1.abc', 'pt1.é.abc', 'pt1.abc.é', 'pt1.abc.def.ghi'])
+def test_malformed_tokens_are_rejected(app, token):
+    with pytest.raises(InvalidToken, match="mal formé"):
+        tokens.decode(app, token)
+
+
+def test_revocation_set_forgets_expired_tokens():
+    revoked = RevocationSet()
+    revoked.add('a', time.time() + 60)
+    revoked.add('b', time.time() - 1)
+    assert 'a' in revoked
+    assert 'b' not in revoked
+    assert 'c' not in revoked
+
+
+def authenticate(app, token, method='GET'):
+    with app.test_request_context('/api/ping', method=method, headers={'Authorization': f'Bearer {token}'}):
+        try:
+            return tokens.load_from_request(request)
+        except HTTPException as e:
+            return e.code
+
+
+def test_request_loader_checks_revocation_and_scope(app, revocations):
+    token, claims = tokens.issue(app, 7, 'alice', 'user', {'read'}, ttl=60)
+    user = authenticate(app, token)
+    assert (user.id, user.username, user.scopes) == (7, 'alice', frozenset({'read'}))
+    assert authenticate(app, token, method='POST') == 403
+    revocations.add(claims['jti'], claims['exp'])
+    assert authenticate(app, token) == 401
+
+
+def test_request_loader_rejects_non_ascii_header(app, revocations):
+    assert authenticate(app, 'pt1.é.é') == 401
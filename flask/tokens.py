@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+import uuid
+
+import pymysql
+from flask import abort, current_app
+from flask_login import UserMixin
+
+# Portées d'un jeton : lecture (GET/HEAD) et/ou écriture (autres méthodes)
+SCOPES = ('read', 'write')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+TOKEN_PREFIX = 'pt1'
+
+
+class InvalidToken(ValueError):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signing_key(app):
+    # Clé dérivée : un jeton ne peut pas servir de cookie de session, et inversement
+    secret = app.config['API_TOKEN_SECRET'] or app.config['SECRET_KEY']
+    return hmac.new(secret.encode('utf-8'), b'api-token', hashlib.sha256).digest()
+
+
+def _sign(app, payload):
+    return _b64encode(hmac.new(_signing_key(app), payload.encode('ascii'), hashlib.sha256).digest())
+
+
+def issue(app, user_id, username, role, scopes, ttl):
+    """Renvoie (jeton, claims). Le jeton porte tout ce qu'il faut pour authentifier sans la base."""
+    now = int(time.time())
+    claims = {
+        'sub': user_id,
+        'usr': username,
+        'role': role,
+        'scp': sorted(scopes),
+        'iat': now,
+        'exp': now + ttl,
+        'jti': uuid.uuid4().hex,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+    return f"{TOKEN_PREFIX}.{payload}.{_sign(app, payload)}", claims
+
+
+def decode(app, token, now=None):
+    """Vérifie la signature et l'expiration d'un jeton et renvoie ses claims."""
+    try:
+        prefix, payload, signature = token.split('.')
+        valid = prefix == TOKEN_PREFIX and hmac.compare_digest(signature, _sign(app, payload))
+    except (ValueError, TypeError):
+        # Nombre de parties, ou caractères non ASCII (UnicodeEncodeError, TypeError de compare_digest)
+        raise InvalidToken("Jeton mal formé.")
+    if not valid:
+        raise InvalidToken("Signature invalide.")
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        raise InvalidToken("Jeton mal formé.")
+    if claims['exp'] <= (now or time.time()):
+        raise InvalidToken("Jeton expiré.")
+    return claims
+
+
+class RevocationSet:
+    """
+    Identifiants (jti) des jetons révoqués et non encore expirés, en mémoire.
+
+    Chargée une première fois de façon synchrone, puis rafraîchie par un thread
+    du processus toutes les `interval` secondes : la vérification d'un jeton ne
+    fait aucune requête SQL. Une révocation faite dans ce processus est prise en
+    compte immédiatement, celles des autres workers au rafraîchissement suivant.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._loaded = False
+        self._pid = None
+        self.refreshed_at = None
+        self.refresh_errors = 0
+
+    def _load(self, app):
+        pool = app.extensions['db_pool']
+        conn = pool.acquire()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT jti, UNIX_TIMESTAMP(expires_at) AS exp FROM api_tokens "
+                               "WHERE revoked_at IS NOT NULL AND expires_at > NOW()")
+                revoked = {row['jti']: float(row['exp']) for row in cursor.fetchall()}
+        except pymysql.MySQLError:
+            pool.release(conn, discard=True)
+            raise
+        pool.release(conn)
+        with self._lock:
+            self._revoked = revoked
+            self._loaded = True
+            self.refreshed_at = time.time()
+
+    def _run(self, app):
+        interval = app.config['API_TOKEN_REVOCATION_REFRESH']
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    self._load(app)
+            except Exception:
+                self.refresh_errors += 1
+                app.logger.exception("Échec du rafraîchissement des jetons révoqués")
+
+    def ensure_loaded(self, app):
+        """Premier chargement et démarrage du thread, une fois par processus (après le fork de Gunicorn)."""
+        if self._loaded and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._loaded = False
+                threading.Thread(target=self._run, args=(app,), name='token-revocations', daemon=True).start()
+        if not self._loaded:
+            self._load(app)
+
+    def add(self, jti, exp):
+        with self._lock:
+            self._revoked[jti] = exp
+
+    def __contains__(self, jti):
+        revoked = self._revoked
+        return jti in revoked and revoked[jti] > time.time()
+
+    def stats(self):
+        return {'revoked': len(self._revoked), 'refreshed_at': self.refreshed_at,
+                'refresh_errors': self.refresh_errors}
+
+
+revocations = RevocationSet()
+
+
+class TokenUser(UserMixin):
+    """Utilisateur reconstruit à partir des claims d'un jeton, sans lecture de la table users."""
+
+    is_token = True
+
+    def __init__(self, claims):
+        self.id = claims['sub']
+        self.username = claims['usr']
+        self.role = claims['role']
+        self.scopes = frozenset(claims['scp'])
+        self.jti = claims['jti']
+        self.expires_at = claims['exp']
+
+
+def load_from_request(req):
+    """
+    `request_loader` de Flask-Login : authentifie une requête de l'API portant
+    `Authorization: Bearer <jeton>`. Jeton invalide, expiré ou révoqué : 401 (et
+    non la redirection vers la page de connexion). Portée insuffisante pour la
+    méthode HTTP : 403.
+    """
+    header = req.headers.get('Authorization', '')
+    if not header.startswith('Bearer ') or req.blueprint != 'api':
+        return None
+    app = current_app._get_current_object()
+    try:
+        claims = decode(app, header[7:].strip())
+    except InvalidToken as e:
+        abort(401, description=str(e))
+    try:
+        revocations.ensure_loaded(app)
+    except pymysql.MySQLError:
+        current_app.logger.exception("Liste des jetons révoqués indisponible")
+        abort(503)
+    if claims['jti'] in revocations:
+        abort(401, description="Jeton révoqué.")
+    required = 'read' if req.method in SAFE_METHODS else 'write'
+    if required not in claims['scp']:
+        abort(403)
+    return TokenUser(claims)
+
+
+def parse_scopes(value):
+    """Valide la liste de portées demandée à l'émission d'un jeton."""
+    scopes = value if value is not None else ['read']
+    if not isinstance(scopes, list) or not scopes or any(s not in SCOPES for s in scopes):
+        raise InvalidToken(f"Portées invalides (parmi : {', '.join(SCOPES)}).")
+    return set(scopes)
+
+
+def revoke(cursor, user_id, jti=None):
+    """
+    Révoque un jeton (ou tous les jetons actifs de l'utilisateur) en base et dans
+    ce processus. Renvoie le nombre de jetons révoqués ; commit à la charge de l'appelant.
+    """
+    sql = ("SELECT jti, UNIX_TIMESTAMP(expires_at) AS exp FROM api_tokens "
+           "WHERE user_id = %s AND revoked_at IS NULL AND expires_at > NOW()")
+    params = [user_id]
+    if jti is not None:
+        sql += " AND jti = %s"
+        params.append(jti)
+    cursor.execute(sql, params)
+    rows = cursor.fetchall()
+    if rows:
+        placeholders = ', '.join(['%s'] * len(rows))
+        cursor.execute(f"UPDATE api_tokens SET revoked_at = NOW() WHERE jti IN ({placeholders})",
+                       [row['jti'] for row in rows])
+    for row in rows:
+        revocations.add(row['jti'], float(row['exp']))
+    return len(rows)
@@ -0,0 +1,145 @@
+import hashlib
+import threading
+from collections import defaultdict
+from functools import wraps
+
+from flask import Response, current_app, make_response, request
+from db import get_shard, shard_count
+
+# Tables dont les écritures incrémentent le compteur de `table_versions`
+TRACKED_TABLES = ('patients', 'studies')
+
+
+class ETagStats:
+    """Compteurs de réponses 304 (hits) et complètes (misses) par endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+    def record(self, endpoint, hit):
+        with self._lock:
+            self._counts[endpoint]['hits' if hit else 'misses'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._counts.items()}
+
+
+stats = ETagStats()
+
+
+def touch(cursor, *tables):
+    """
+    Incrémente le compteur des tables modifiées. À appeler dans la transaction
+    de l'écriture, pour que le compteur ne bouge qu'au commit.
+    """
+    placeholders = ', '.join(['%s'] * len(tables))
+    cursor.execute(f"UPDATE table_versions SET version = version + 1 WHERE table_name IN ({placeholders})", tables)
+
+
+def table_versions(cursor, tables):
+    """Renvoie ({table: version}, date de dernière modification) pour les tables demandées."""
+    placeholders = ', '.join(['%s'] * len(tables))
+    cursor.execute(f"SELECT table_name, version, updated_at FROM table_versions WHERE table_name IN ({placeholders})",
+                   tables)
+    rows = cursor.fetchall()
+    versions = {row['table_name']: row['version'] for row in rows}
+    last_modified = max((row['updated_at'] for row in rows), default=None)
+    return versions, last_modified
+
+
+def shard_versions(tables):
+    """
+    table_versions additionnés sur tous les shards : chaque compteur ne fait
+    que croître, leur somme change donc à chaque écriture sur l'un d'eux.
+    """
+    versions, last_modified = {}, None
+    for index in range(shard_count()):
+        with get_shard(index).cursor() as cursor:
+            shard, modified = table_versions(cursor, tables)
+        for table, version in shard.items():
+            versions[table] = versions.get(table, 0) + version
+        if modified is not None and (last_modified is None or modified > last_modified):
+            last_modified = modified
+    return versions, last_modified
+
+
+def row_etag(table, row_id, version):
+    return f"{table}-{row_id}-v{version}"
+
+
+def composite_etag(table, row_id, version, related):
+    """ETag d'une ligne et des lignes liées incluses (dicts avec id et version)."""
+    key = row_etag(table, row_id, version) + ''.join(f",{r['id']}.{r['version']}" for r in related)
+    return f"{table}-{row_id}-" + hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def not_modified(etag, last_modified=None):
+    """Réponse 304 portant les mêmes validateurs que la réponse complète."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def encoded_etag(etag, encoding):
+    """ETag de la représentation compressée : « abc » -> « abc-gzip »."""
+    return f"{etag}-{encoding}"
+
+
+def matching_etag(etag):
+    """Valeur de If-None-Match qui désigne `etag`, brute ou suffixée d'un encodage ; None sinon."""
+    if not request.if_none_match:
+        return None
+    encodings = current_app.extensions.get('compression_encodings', ())
+    for candidate in (etag, *(encoded_etag(etag, encoding) for encoding in encodings)):
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+
+def is_fresh(etag, last_modified=None):
+    """Vrai si les en-têtes conditionnels du client correspondent encore à la ressource."""
+    if request.if_none_match:
+        return matching_etag(etag) is not None
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    return False
+
+
+def conditional(*tables, vary=(), includes=()):
+    """
+    Décorateur de GET conditionnel pour les listes dérivées de `tables`.
+
+    L'ETag dépend du chemin, des paramètres, des en-têtes listés dans `vary` et
+    des compteurs de version des tables : une lecture de `table_versions` (par
+    shard) suffit pour répondre 304 sans exécuter la requête de la liste. Les tables de
+    `includes` ne comptent que si le paramètre `include` les demande.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            requested = request.args.get('include', '').split(',')
+            used = tables + tuple(table for table in includes if table in requested)
+            versions, last_modified = shard_versions(used)
+            key = [request.path, sorted(request.args.items(multi=True)),
+                   [request.headers.get(h, '') for h in vary], sorted(versions.items())]
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()
+
+            if is_fresh(etag, last_modified):
+                stats.record(request.endpoint, hit=True)
+                return not_modified(matching_etag(etag) or etag, last_modified)
+
+            stats.record(request.endpoint, hit=False)
+            response = make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                if vary:
+                    response.vary.update(vary)
+            return response
+        return decorated_function
+    return decorator